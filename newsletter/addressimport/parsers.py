@@ -1,6 +1,7 @@
 import logging
 logger = logging.getLogger(__name__)
 
+import codecs
 import io
 
 from django import forms
@@ -9,81 +10,133 @@ from django.core.validators import validate_email
 from django.utils.translation import gettext as _
 
 from newsletter.models import Subscription
+from newsletter.settings import newsletter_settings
 
 
 class AddressList:
-    """ List with unique addresses. """
+    """
+    List with unique addresses.
+
+    Addresses are checked against existing subscriptions in batches of
+    `NEWSLETTER_IMPORT_BATCH_SIZE`, rather than one query per address.
+    Entries skipped when ignoring errors are described in `errors`.
+    """
 
-    def __init__(self, newsletter, ignore_errors=False):
+    def __init__(self, newsletter, ignore_errors=False,
+                 subscription_import=None):
         self.newsletter = newsletter
         self.ignore_errors = ignore_errors
-        self.addresses = {}
+        self._addresses = {}
+
+        # Addresses staged by the import are checked along with existing
+        # subscriptions.
+        self.subscription_import = subscription_import
+
+        # Addresses not checked against existing subscriptions yet, mapping
+        # email to (name, location).
+        self._pending = {}
+
+        self.rows = 0
+        self.errors = []
+
+    @property
+    def addresses(self):
+        """ Dictionary mapping email addresses to names. """
+        self._check_pending()
+        return self._addresses
+
+    def reject(self, message, warning):
+        """
+        Raise ValidationError with message or, when ignoring errors, record
+        it in `errors` to skip the entry.
+        """
+        logger.warning(warning)
+
+        if not self.ignore_errors:
+            raise forms.ValidationError(message)
+
+        self.errors.append(message)
 
     def add(self, email, name=None, location='unknown location'):
         """ Add name to list. """
 
         logger.debug("Going to add %s <%s>", name, email)
 
+        self.rows += 1
+
         name = check_name(name, self.ignore_errors)
         email = check_email(email, self.ignore_errors)
 
         try:
             validate_email(email)
         except ValidationError:
-            logger.warning(
+            # Skip this entry
+            return self.reject(
+                _("Entry '%s' does not contain a valid "
+                  "e-mail address.") % name,
                 "Entry '%s' does not contain a valid e-mail address at %s."
                 % (email, location)
             )
 
-            if not self.ignore_errors:
-                raise forms.ValidationError(_(
-                    "Entry '%s' does not contain a valid "
-                    "e-mail address.") % name
-                )
-
+        if email in self._addresses or email in self._pending:
             # Skip this entry
-            return
-
-        if email in self.addresses:
-            logger.warning(
+            return self.reject(
+                _("The address file contains duplicate entries "
+                  "for '%s'.") % email,
                 "Entry '%s' contains a duplicate entry at %s."
                 % (email, location)
             )
 
-            if not self.ignore_errors:
-                raise forms.ValidationError(_(
-                    "The address file contains duplicate entries "
-                    "for '%s'.") % email)
-
-            # Skip this entry
-            return
-
-        if subscription_exists(self.newsletter, email, name):
-            logger.warning(
-                "Entry '%s' is already subscribed to at %s."
-                % (email, location)
-            )
+        self._pending[email] = (name, location)
 
-            if not self.ignore_errors:
-                raise forms.ValidationError(
-                    _("Some entries are already subscribed to."))
+        if len(self._pending) >= newsletter_settings.IMPORT_BATCH_SIZE:
+            self._check_pending()
 
-            # Skip this entry
+    def _check_pending(self):
+        """ Move pending addresses which aren't subscribed yet to the list. """
+        pending = self._pending
+        if not pending:
             return
+        self._pending = {}
+
+        subscribed = get_subscribed_emails(self.newsletter, pending)
+
+        staged = set()
+        if self.subscription_import is not None:
+            staged = self.subscription_import.get_staged_emails(pending)
+
+        for email, (name, location) in pending.items():
+            if email in staged:
+                # Skip this entry
+                self.reject(
+                    _("The address file contains duplicate entries "
+                      "for '%s'.") % email,
+                    "Entry '%s' contains a duplicate entry at %s."
+                    % (email, location)
+                )
+                continue
 
-        self.addresses[email] = name
+            if email in subscribed:
+                # Skip this entry
+                self.reject(
+                    _("Some entries are already subscribed to."),
+                    "Entry '%s' is already subscribed to at %s."
+                    % (email, location)
+                )
+                continue
 
+            self._addresses[email] = name
 
-def subscription_exists(newsletter, email, name=None):
+
+def get_subscribed_emails(newsletter, emails):
     """
-    Return wheter or not a subscription exists.
+    Return the set of emails which are subscribed to the newsletter.
     """
-    qs = Subscription.objects.filter(
+    return set(Subscription.objects.filter(
         newsletter__id=newsletter.id,
         subscribed=True,
-        email_field__exact=email)
-
-    return qs.exists()
+        email_field__in=list(emails)
+    ).values_list('email_field', flat=True))
 
 
 def check_email(email, ignore_errors=False):
@@ -141,21 +194,118 @@ def check_name(name, ignore_errors=False):
         )
 
 
-def get_encoding(myfile):
-    """ Returns encoding of file, rewinding the file after detection. """
+# Bytes read from the start of files, and from a few places further on, for
+# detecting their encoding.
+ENCODING_SAMPLE_SIZE = 64 * 1024
+ENCODING_SAMPLES = 4
+
+BOMS = (
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+)
+
+
+def get_samples(myfile):
+    """
+    Yield a sample from the start of the file and `ENCODING_SAMPLES` more
+    spread over the rest of it, up to its end, without reading the whole
+    file.
+    """
+    myfile.seek(0)
+    yield myfile.read(ENCODING_SAMPLE_SIZE)
+
+    myfile.seek(0, io.SEEK_END)
+    size = myfile.tell()
+    if size <= ENCODING_SAMPLE_SIZE:
+        return
+
+    # The last sample ends with the file
+    stride = (size - ENCODING_SAMPLE_SIZE) / ENCODING_SAMPLES
+    for number in range(1, ENCODING_SAMPLES + 1):
+        myfile.seek(int(stride * number))
+        sample = myfile.read(ENCODING_SAMPLE_SIZE)
+
+        # Skip the rest of an UTF-8 character cut off by the offset
+        start = 0
+        while start < min(3, len(sample)) and 0x80 <= sample[start] < 0xc0:
+            start += 1
+
+        yield sample[start:]
+
+
+def is_utf8(sample):
+    """ Whether sample is valid UTF-8, apart from a truncated last character. """
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+    except UnicodeDecodeError:
+        return False
+    return True
 
-    # Detect encoding
-    from chardet.universaldetector import UniversalDetector
 
-    detector = UniversalDetector()
+def get_non_utf8(myfile):
+    """
+    Return the first part of the file which is not valid UTF-8, or None,
+    decoding the file part by part rather than reading it at once.
+    """
+    myfile.seek(0)
+    decoder = codecs.getincrementaldecoder('utf-8')()
+
+    while True:
+        part = myfile.read(ENCODING_SAMPLE_SIZE)
+
+        try:
+            decoder.decode(part, final=not part)
+        except UnicodeDecodeError:
+            return part
+
+        if not part:
+            return None
+
+
+def get_encoding(myfile):
+    """
+    Returns encoding of file, rewinding the file after detection.
 
-    for line in myfile.readlines():
-        detector.feed(line)
-        if detector.done:
+    Files starting with a byte order mark are recognized right away. When
+    the samples are valid UTF-8, the rest of the file is checked to be so
+    too. Otherwise, the samples are fed into chardet, along with the part
+    which is not valid UTF-8.
+    """
+    samples = get_samples(myfile)
+    head = next(samples)
+
+    encoding = None
+    for bom, bom_encoding in BOMS:
+        if head.startswith(bom):
+            encoding = bom_encoding
             break
 
-    detector.close()
-    encoding = detector.result['encoding']
+    if encoding is None:
+        samples = [head] + list(samples)
+
+        if all(is_utf8(sample) for sample in samples):
+            non_utf8 = get_non_utf8(myfile)
+            if non_utf8 is None:
+                encoding = 'utf-8'
+            else:
+                samples.append(non_utf8)
+
+        if encoding is None:
+            # Detect encoding
+            from chardet.universaldetector import UniversalDetector
+
+            detector = UniversalDetector()
+
+            for sample in samples:
+                detector.feed(sample)
+                if detector.done:
+                    break
+
+            detector.close()
+            encoding = detector.result['encoding']
 
     # Reset the file index
     myfile.seek(0)
@@ -163,11 +313,10 @@ def get_encoding(myfile):
     return encoding
 
 
-def parse_csv(myfile, newsletter, ignore_errors=False):
+def read_csv(myfile):
     """
-    Parse addresses from CSV file-object into newsletter.
-
-    Returns a dictionary mapping email addresses into Subscription objects.
+    Open CSV file-object for reading, returning a reader for the rows after
+    the header and the numbers of the e-mail and name columns.
     """
 
     import unicodecsv
@@ -179,6 +328,9 @@ def parse_csv(myfile, newsletter, ignore_errors=False):
     encodedfile = io.TextIOWrapper(myfile, encoding=encoding, newline='')
     dialect = unicodecsv.Sniffer().sniff(encodedfile.read(1024))
 
+    # Keep the file open when the wrapper is garbage collected
+    encodedfile.detach()
+
     # Reset the file index
     myfile.seek(0)
 
@@ -245,38 +397,53 @@ def parse_csv(myfile, newsletter, ignore_errors=False):
             }
         )
 
+    return myreader, mailcol, namecol
+
+
+def iter_csv(myfile, newsletter, ignore_errors=False, **kwargs):
+    """
+    Parse addresses from CSV file-object into newsletter, only keeping
+    `NEWSLETTER_IMPORT_BATCH_SIZE` rows in memory.
+
+    Yields an AddressList for every batch of rows, with their addresses
+    and, when ignoring errors, the errors of the skipped rows. Further
+    keyword arguments are passed on to AddressList, e.g.
+    `subscription_import` to skip addresses staged from earlier batches.
+    """
+    myreader, mailcol, namecol = read_csv(myfile)
+
     logger.debug('Extracting data.')
 
-    address_list = AddressList(newsletter, ignore_errors)
+    address_list = AddressList(newsletter, ignore_errors, **kwargs)
 
     for row in myreader:
         if not max(namecol, mailcol) < len(row):
-            logger.warning(
-                "Column count does not match for row number %d",
-                myreader.line_num, extra=dict(data={'row': row})
+            address_list.rows += 1
+
+            # Skip this record
+            address_list.reject(
+                _("Row with content '%(row)s' does not contain a name and "
+                  "email field.") % {'row': row},
+                "Column count does not match for row number %d"
+                % myreader.line_num
+            )
+        else:
+            address_list.add(
+                row[mailcol], row[namecol],
+                location="line %d" % myreader.line_num
             )
 
-            if ignore_errors:
-                # Skip this record
-                continue
-            else:
-                raise forms.ValidationError(_(
-                    "Row with content '%(row)s' does not contain a name and "
-                    "email field.") % {'row': row}
-                )
-
-        address_list.add(
-            row[mailcol], row[namecol], location="line %d" % myreader.line_num
-        )
+        if address_list.rows >= newsletter_settings.IMPORT_BATCH_SIZE:
+            yield address_list
+            address_list = AddressList(newsletter, ignore_errors, **kwargs)
 
-    return address_list.addresses
+    if address_list.rows:
+        yield address_list
 
 
-def parse_vcard(myfile, newsletter, ignore_errors=False):
+def iter_vcard(myfile, newsletter, ignore_errors=False, **kwargs):
     """
-    Parse addresses from vCard file-object into newsletter.
-
-    Returns a dictionary mapping email addresses into Subscription objects.
+    Like `iter_csv()` for vCard file-objects, yielding a single AddressList.
     """
     import card_me
 
@@ -290,7 +457,7 @@ def parse_vcard(myfile, newsletter, ignore_errors=False):
             _("Error reading vCard file: %s" % e)
         )
 
-    address_list = AddressList(newsletter, ignore_errors)
+    address_list = AddressList(newsletter, ignore_errors, **kwargs)
 
     for myvcard in myvcards:
         name = myvcard.fn.value if hasattr(myvcard, 'fn') else None
@@ -307,18 +474,16 @@ def parse_vcard(myfile, newsletter, ignore_errors=False):
 
         address_list.add(email, name)
 
-    return address_list.addresses
+    yield address_list
 
 
-def parse_ldif(myfile, newsletter, ignore_errors=False):
+def iter_ldif(myfile, newsletter, ignore_errors=False, **kwargs):
     """
-    Parse addresses from LDIF file-object into newsletter.
-
-    Returns a dictionary mapping email addresses into Subscription objects.
+    Like `iter_csv()` for LDIF file-objects, yielding a single AddressList.
     """
     from ldif import LDIFParser
 
-    address_list = AddressList(newsletter, ignore_errors)
+    address_list = AddressList(newsletter, ignore_errors, **kwargs)
 
     class MyLDIFParser(LDIFParser):
         def handle(self, dn, entry):
@@ -337,4 +502,40 @@ def parse_ldif(myfile, newsletter, ignore_errors=False):
         if not ignore_errors:
             raise forms.ValidationError(e)
 
-    return address_list.addresses
+    yield address_list
+
+
+PARSERS = {
+    'csv': iter_csv,
+    'vcf': iter_vcard,
+    'ldif': iter_ldif,
+}
+
+
+def stage_addresses(subscription_import, myfile, ext, ignore_errors=False):
+    """
+    Parse addresses from file-object with extension ext into the staging
+    table of subscription_import, recording the amount of rows read and
+    rejected, along with the first reasons for rejecting them, after every
+    batch. Raises ValidationError for unsupported extensions.
+    """
+    if ext not in PARSERS:
+        raise forms.ValidationError(
+            _("File extension '%s' was not recognized.") % ext)
+
+    address_lists = PARSERS[ext](
+        myfile, subscription_import.newsletter, ignore_errors,
+        subscription_import=subscription_import
+    )
+
+    for address_list in address_lists:
+        subscription_import.add_addresses(address_list.addresses.items())
+
+        # Report progress
+        subscription_import.save_state(
+            rows=subscription_import.rows + address_list.rows,
+            rejected=subscription_import.rejected + len(address_list.errors),
+            rejections=(
+                subscription_import.rejections + address_list.errors
+            )[:subscription_import.MAX_REJECTIONS]
+        )
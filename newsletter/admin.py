@@ -9,13 +9,17 @@ from django.db import models
 from django.conf import settings
 
 from django.contrib import admin, messages
+from django.contrib.admin.views.main import ChangeList
 from django.contrib.sites.shortcuts import get_current_site
 
 
 from django.core import serializers
+from django.core.paginator import Paginator
 from django.core.exceptions import PermissionDenied
 
-from django.http import HttpResponse, HttpResponseRedirect, Http404
+from django.http import (
+    HttpResponse, HttpResponseRedirect, Http404, JsonResponse
+)
 
 from django.shortcuts import render
 
@@ -38,8 +42,8 @@ except (ImportError, RuntimeError):
     pass
 
 from .models import (
-    Newsletter, Subscription, Attachment, Article, Message, Submission,
-    render_message
+    Newsletter, Subscription, SubscriptionJob, SubscriptionImport, Attachment,
+    Article, Message, Submission, Delivery, render_message
 )
 
 from django.utils.timezone import now
@@ -49,7 +53,7 @@ from .admin_forms import (
     SubmissionAdminForm, SubscriptionAdminForm, ImportForm, ConfirmForm,
     ArticleFormSet
 )
-from .admin_utils import ExtendibleModelAdminMixin, make_subscription
+from .admin_utils import ExtendibleModelAdminMixin
 from .fields import DynamicImageField
 from .settings import newsletter_settings
 
@@ -104,18 +108,46 @@ class NewsletterAdminLinkMixin:
     admin_newsletter.short_description = _('newsletter')
 
 
+class SubmissionChangeList(ChangeList):
+    def get_results(self, request):
+        super().get_results(request)
+
+        # Count deliveries per status for the listed page only, using the
+        # (submission, status) index
+        self.result_list = list(self.result_list)
+        counts = dict(
+            ((submission_id, status), count)
+            for submission_id, status, count in Delivery.objects.filter(
+                submission__in=self.result_list
+            ).order_by().values_list('submission', 'status').annotate(
+                models.Count('pk')
+            )
+        )
+
+        for submission in self.result_list:
+            submission.sent_count = counts.get(
+                (submission.pk, Delivery.SENT), 0
+            )
+            submission.failed_count = counts.get(
+                (submission.pk, Delivery.FAILED), 0
+            )
+
+
 class SubmissionAdmin(NewsletterAdminLinkMixin, ExtendibleModelAdminMixin,
                       admin.ModelAdmin):
     form = SubmissionAdminForm
     list_display = (
         'admin_message', 'admin_newsletter', 'admin_publish_date', 'publish',
-        'admin_status_text', 'admin_status'
+        'admin_status_text', 'admin_status', 'admin_deliveries'
     )
     date_hierarchy = 'publish_date'
     list_filter = ('newsletter', 'publish', 'sent')
     save_as = True
     filter_horizontal = ('subscriptions',)
 
+    def get_changelist(self, request, **kwargs):
+        return SubmissionChangeList
+
     """ List extensions """
     def admin_message(self, obj):
         return format_html('<a href="{}/">{}</a>', obj.id, obj.message.title)
@@ -166,6 +198,14 @@ class SubmissionAdmin(NewsletterAdminLinkMixin, ExtendibleModelAdminMixin,
             return _("Not sent.")
     admin_status_text.short_description = _('Status')
 
+    def admin_deliveries(self, obj):
+        if obj.failed_count:
+            return _("%(sent)d sent, %(failed)d failed") % {
+                'sent': obj.sent_count, 'failed': obj.failed_count
+            }
+        return _("%(sent)d sent") % {'sent': obj.sent_count}
+    admin_deliveries.short_description = _('Deliveries')
+
     """ Views """
     def submit(self, request, object_id):
         submission = self._getobj(request, object_id)
@@ -419,10 +459,47 @@ class SubscriptionAdmin(NewsletterAdminLinkMixin, ExtendibleModelAdminMixin,
     admin_unsubscribe_date.short_description = _("unsubscribe date")
 
     """ Actions """
+    def _run_in_background(self, request, queryset, action):
+        """
+        Queue a job for selections above `NEWSLETTER_BULK_ACTION_THRESHOLD`,
+        returning whether it was queued.
+        """
+        threshold = newsletter_settings.BULK_ACTION_THRESHOLD
+        if threshold is None:
+            return False
+
+        rows = queryset.count()
+        if rows <= threshold:
+            return False
+
+        job = SubscriptionJob.create(queryset, action)
+
+        if action == 'subscribe':
+            message = ngettext(
+                "%d user will be subscribed in the background.",
+                "%d users will be subscribed in the background.",
+                rows
+            ) % rows
+        else:
+            message = ngettext(
+                "%d user will be unsubscribed in the background.",
+                "%d users will be unsubscribed in the background.",
+                rows
+            ) % rows
+
+        self.message_user(request, format_html(
+            '{} <a href="{}">{}</a>', message,
+            reverse('admin:newsletter_subscriptionjob_change', args=[job.pk]),
+            _("Show progress")
+        ))
+        return True
+
     def make_subscribed(self, request, queryset):
-        for subscription in queryset.all():
-            subscription.update('subscribe')
+        if self._run_in_background(request, queryset, 'subscribe'):
+            return
+
         rows_updated = queryset.count()
+        Subscription.update_queryset(queryset, 'subscribe')
         self.message_user(
             request,
             ngettext(
@@ -434,9 +511,11 @@ class SubscriptionAdmin(NewsletterAdminLinkMixin, ExtendibleModelAdminMixin,
     make_subscribed.short_description = _("Subscribe selected users")
 
     def make_unsubscribed(self, request, queryset):
-        for subscription in queryset.all():
-            subscription.update('unsubscribe')
+        if self._run_in_background(request, queryset, 'unsubscribe'):
+            return
+
         rows_updated = queryset.count()
+        Subscription.update_queryset(queryset, 'unsubscribe')
         self.message_user(
             request,
             ngettext(
@@ -452,11 +531,19 @@ class SubscriptionAdmin(NewsletterAdminLinkMixin, ExtendibleModelAdminMixin,
         if not request.user.has_perm('newsletter.add_subscription'):
             raise PermissionDenied()
         if request.POST:
+            SubscriptionImport.delete_expired()
+
             form = ImportForm(request.POST, request.FILES)
             if form.is_valid():
-                request.session['addresses'] = form.get_addresses()
-                request.session['newsletter_pk'] = \
-                    form.cleaned_data['newsletter'].pk
+                subscription_import = form.get_import()
+                request.session['subscription_import_pk'] = \
+                    subscription_import.pk
+
+                if newsletter_settings.IMPORT_IN_BACKGROUND:
+                    return HttpResponseRedirect(reverse(
+                        'admin:newsletter_subscription_import_progress',
+                        args=[subscription_import.pk]
+                    ))
 
                 confirm_url = reverse(
                     'admin:newsletter_subscription_import_confirm'
@@ -472,39 +559,41 @@ class SubscriptionAdmin(NewsletterAdminLinkMixin, ExtendibleModelAdminMixin,
         )
 
     def subscribers_import_confirm(self, request):
-        # If no addresses are in the session, start all over.
+        # If no addresses are staged, start all over.
+        subscription_import = SubscriptionImport.objects.filter(
+            pk=request.session.get('subscription_import_pk'),
+            status=SubscriptionImport.STAGED
+        ).select_related('newsletter').first()
 
-        if 'addresses' not in request.session:
+        if subscription_import is None:
             import_url = reverse('admin:newsletter_subscription_import')
             return HttpResponseRedirect(import_url)
 
-        addresses = request.session['addresses']
-        newsletter = Newsletter.objects.get(
-            pk=request.session['newsletter_pk']
-        )
-
-        logger.debug('Confirming addresses: %s', addresses)
-
         if request.POST:
             form = ConfirmForm(request.POST)
-            if form.is_valid():
+            if form.is_valid() and newsletter_settings.IMPORT_IN_BACKGROUND:
+                # Leave inserting the addresses to submit_newsletter --jobs.
+                del request.session['subscription_import_pk']
+                subscription_import.request_confirmation()
+
+                return HttpResponseRedirect(reverse(
+                    'admin:newsletter_subscription_import_progress',
+                    args=[subscription_import.pk]
+                ))
+
+            elif form.is_valid():
                 try:
-                    for email, name in addresses.items():
-                        address_inst = make_subscription(
-                            newsletter, email, name
-                        )
-                        address_inst.save()
+                    count = subscription_import.confirm()
                 finally:
-                    del request.session['addresses']
-                    del request.session['newsletter_pk']
+                    del request.session['subscription_import_pk']
 
                 messages.success(
                     request,
                     ngettext(
                         "%d subscription has been successfully added.",
                         "%d subscriptions have been successfully added.",
-                        len(addresses)
-                    ) % len(addresses)
+                        count
+                    ) % count
                 )
 
                 changelist_url = reverse(
@@ -514,12 +603,54 @@ class SubscriptionAdmin(NewsletterAdminLinkMixin, ExtendibleModelAdminMixin,
         else:
             form = ConfirmForm()
 
+        paginator = Paginator(
+            subscription_import.addresses.all(), self.list_per_page
+        )
+
         return render(
             request,
             "admin/newsletter/subscription/confirmimportform.html",
-            {'form': form, 'subscribers': addresses},
+            {
+                'form': form,
+                'subscription_import': subscription_import,
+                'page': paginator.get_page(request.GET.get('page')),
+            },
         )
 
+    def _get_import(self, request, import_id):
+        if not request.user.has_perm('newsletter.add_subscription'):
+            raise PermissionDenied()
+
+        try:
+            return SubscriptionImport.objects.select_related(
+                'newsletter'
+            ).get(pk=import_id)
+        except SubscriptionImport.DoesNotExist:
+            raise Http404(_('Subscription import does not exist.'))
+
+    def subscribers_import_progress(self, request, import_id):
+        subscription_import = self._get_import(request, import_id)
+
+        return render(
+            request,
+            "admin/newsletter/subscription/importprogress.html",
+            {'subscription_import': subscription_import},
+        )
+
+    def subscribers_import_status(self, request, import_id):
+        """ Progress of a background import, for polling. """
+        subscription_import = self._get_import(request, import_id)
+
+        return JsonResponse({
+            'status': subscription_import.status,
+            'status_display': subscription_import.get_status_display(),
+            'rows': subscription_import.rows,
+            'rejected': subscription_import.rejected,
+            'staged': subscription_import.addresses.count(),
+            'inserted': subscription_import.inserted,
+            'error': subscription_import.error,
+        })
+
     """ URLs """
     def get_urls(self):
         urls = super().get_urls()
@@ -531,6 +662,12 @@ class SubscriptionAdmin(NewsletterAdminLinkMixin, ExtendibleModelAdminMixin,
             path('import/confirm/',
                  self._wrap(self.subscribers_import_confirm),
                  name=self._view_name('import_confirm')),
+            path('import/<int:import_id>/',
+                 self._wrap(self.subscribers_import_progress),
+                 name=self._view_name('import_progress')),
+            path('import/<int:import_id>/status/',
+                 self._wrap(self.subscribers_import_status),
+                 name=self._view_name('import_status')),
         ]
         # Translated JS strings - these should be app-wide but are
         # only used in this part of the admin. For now, leave them here.
@@ -541,6 +678,32 @@ class SubscriptionAdmin(NewsletterAdminLinkMixin, ExtendibleModelAdminMixin,
         return my_urls + urls
 
 
+class SubscriptionJobAdmin(admin.ModelAdmin):
+    list_display = (
+        '__str__', 'status', 'admin_progress', 'created', 'updated'
+    )
+    list_filter = ('status', 'action')
+    readonly_fields = (
+        'action', 'status', 'admin_progress', 'error', 'created', 'updated'
+    )
+    exclude = ('total', 'processed')
+
+    """ List extensions """
+    def admin_progress(self, obj):
+        return _("%(processed)d of %(total)d") % {
+            'processed': obj.processed, 'total': obj.total
+        }
+    admin_progress.short_description = _('progress')
+
+    """ Permissions """
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+admin.site.register(SubscriptionJob, SubscriptionJobAdmin)
 admin.site.register(Newsletter, NewsletterAdmin)
 admin.site.register(Submission, SubmissionAdmin)
 admin.site.register(Message, MessageAdmin)
@@ -1,13 +1,15 @@
 import logging
 
 from django import forms
+from django.db import transaction
 
 from django.contrib.admin import widgets, options
 
 from django.utils.translation import gettext as _
 
-from .models import Subscription, Newsletter, Submission
-from .addressimport.parsers import parse_csv, parse_vcard, parse_ldif
+from .models import Subscription, SubscriptionImport, Newsletter, Submission
+from .addressimport.parsers import PARSERS
+from .settings import newsletter_settings
 
 
 logger = logging.getLogger(__name__)
@@ -43,30 +45,36 @@ class ImportForm(forms.Form):
                 "File type '%s' was not recognized.") % content_type)
 
         ext = myvalue.name.rsplit('.', 1)[-1].lower()
-        if ext == 'vcf':
-            self.addresses = parse_vcard(
-                myvalue.file, newsletter, ignore_errors)
+        if ext not in PARSERS:
+            raise forms.ValidationError(
+                _("File extension '%s' was not recognized.") % ext)
 
-        elif ext == 'ldif':
-            self.addresses = parse_ldif(
-                myvalue.file, newsletter, ignore_errors)
+        if newsletter_settings.IMPORT_IN_BACKGROUND:
+            # Parsed by submit_newsletter --jobs
+            self.subscription_import = SubscriptionImport.objects.create(
+                newsletter=newsletter, address_file=myvalue,
+                ignore_errors=ignore_errors
+            )
+            return self.cleaned_data
 
-        elif ext == 'csv':
-            self.addresses = parse_csv(
-                myvalue.file, newsletter, ignore_errors)
+        # Errors roll back staging
+        with transaction.atomic():
+            subscription_import = SubscriptionImport.objects.create(
+                newsletter=newsletter, ignore_errors=ignore_errors
+            )
+            subscription_import.stage(myvalue.file, ext)
 
-        else:
-            raise forms.ValidationError(
-                _("File extension '%s' was not recognized.") % ext)
+            if not subscription_import.addresses.exists():
+                raise forms.ValidationError(
+                    _("No entries could found in this file."))
 
-        if len(self.addresses) == 0:
-            raise forms.ValidationError(
-                _("No entries could found in this file."))
+        self.subscription_import = subscription_import
 
         return self.cleaned_data
 
-    def get_addresses(self):
-        return getattr(self, 'addresses', {})
+    def get_import(self):
+        """ Return the SubscriptionImport staging the addresses. """
+        return getattr(self, 'subscription_import', None)
 
     newsletter = forms.ModelChoiceField(
         label=_("Newsletter"),
@@ -0,0 +1,495 @@
+""" Helpers for delivering submission e-mails. """
+
+import asyncio
+import base64
+import io
+import logging
+import mimetypes
+import tempfile
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from email.mime.base import MIMEBase
+from smtplib import SMTPServerDisconnected
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail import get_connection
+from django.core.mail.message import (
+    DEFAULT_ATTACHMENT_MIME_TYPE, sanitize_address
+)
+from django.db import connections
+
+from .settings import newsletter_settings
+
+logger = logging.getLogger(__name__)
+
+RATE_PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+# Amount of bytes encoding into a single line of base64
+BASE64_LINE_BYTES = 57
+
+
+class SendingStopped(Exception):
+    """ Sending was stopped before all messages of a submission were sent. """
+
+
+class ClaimLost(SendingStopped):
+    """ Sending was stopped as another worker took over the claim. """
+
+
+class SendingLimit(threading.Event):
+    """
+    Event telling when to stop sending: once it is set (e.g. from a signal
+    handler), after `max_messages` messages or after `time_limit` seconds.
+    A single limit can be shared by all submissions and workers of a run.
+    """
+
+    def __init__(self, max_messages=None, time_limit=None):
+        super().__init__()
+
+        self.max_messages = max_messages
+        self.deadline = time.monotonic() + time_limit \
+            if time_limit is not None else None
+        self.messages = 0
+
+        self._lock = threading.Lock()
+
+    def is_set(self):
+        return (
+            super().is_set() or
+            (self.max_messages is not None and
+             self.messages >= self.max_messages) or
+            (self.deadline is not None and time.monotonic() >= self.deadline)
+        )
+
+    def wait(self, timeout=None):
+        if self.deadline is not None:
+            remaining = max(self.deadline - time.monotonic(), 0)
+            timeout = remaining if timeout is None else min(timeout, remaining)
+
+        return super().wait(timeout) or self.is_set()
+
+    def take(self):
+        """ Count a message about to be sent, unless the limit is reached. """
+        with self._lock:
+            if self.is_set():
+                return False
+
+            self.messages += 1
+            return True
+
+
+class ReusableConnection:
+    """
+    E-mail backend connection shared by many messages.
+
+    The connection is opened lazily on the first message, reopened after
+    `max_messages` messages (if set) and reopened once when the server
+    drops the connection. Keeps track of the amount of connections opened
+    and messages sent for reporting.
+    """
+
+    def __init__(self, max_messages=None, **kwargs):
+        self.max_messages = max_messages
+        self.backend_kwargs = kwargs
+
+        self.connection = None
+        self.connections_opened = 0
+        self.messages_sent = 0
+        self._connection_messages = 0
+
+    def open(self):
+        self.close()
+
+        self.connection = get_connection(**self.backend_kwargs)
+        self.connection.open()
+
+        self.connections_opened += 1
+        self._connection_messages = 0
+
+    def close(self):
+        if self.connection is None:
+            return
+
+        try:
+            self.connection.close()
+        finally:
+            self.connection = None
+
+    def send(self, message):
+        """ Send a single message, (re)connecting when required. """
+
+        if self.connection is None or (
+            self.max_messages and
+            self._connection_messages >= self.max_messages
+        ):
+            self.open()
+
+        try:
+            sent = self.connection.send_messages([message])
+        except SMTPServerDisconnected:
+            logger.info(
+                'Server disconnected after %d messages, reconnecting.',
+                self._connection_messages
+            )
+            self.open()
+            sent = self.connection.send_messages([message])
+
+        self._connection_messages += 1
+        self.messages_sent += sent or 0
+
+        return sent
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class AttachmentCache:
+    """
+    Base64 encoded MIME parts for message attachments, which are read and
+    encoded once to be attached to any number of messages.
+
+    Encoded attachments are kept in memory up to a total of `max_memory`
+    bytes. Beyond that, they are spilled to temporary files, to be read back
+    for every message.
+    """
+
+    def __init__(self, max_memory):
+        self.max_memory = max_memory
+        self.memory = 0
+
+        self._attachments = []
+        self._lock = threading.Lock()
+
+    def add(self, filename, fileobj, size):
+        """ Encode the contents of fileobj, being `size` bytes long. """
+        mimetype = mimetypes.guess_type(filename)[0] or \
+            DEFAULT_ATTACHMENT_MIME_TYPE
+
+        # Lines of 76 characters plus newline
+        encoded_size = -(-size // BASE64_LINE_BYTES) * 77
+
+        if self.memory + encoded_size <= self.max_memory:
+            self.memory += encoded_size
+            encoded = io.BytesIO()
+        else:
+            logger.debug('Spilling attachment %s to disk.', filename)
+            encoded = tempfile.TemporaryFile()
+
+        while chunk := fileobj.read(BASE64_LINE_BYTES * 1024):
+            encoded.write(base64.encodebytes(chunk))
+
+        if isinstance(encoded, io.BytesIO):
+            encoded = encoded.getvalue().decode('ascii')
+
+        self._attachments.append((filename, mimetype, encoded))
+
+    def _read(self, encoded):
+        if isinstance(encoded, str):
+            return encoded
+
+        with self._lock:
+            encoded.seek(0)
+            return encoded.read().decode('ascii')
+
+    def parts(self):
+        """ Yield a MIME part for every attachment. """
+        for filename, mimetype, encoded in self._attachments:
+            part = MIMEBase(*mimetype.split('/', 1))
+            part.set_payload(self._read(encoded))
+            part['Content-Transfer-Encoding'] = 'base64'
+
+            try:
+                filename.encode('ascii')
+            except UnicodeEncodeError:
+                filename = ('utf-8', '', filename)
+            part.add_header(
+                'Content-Disposition', 'attachment', filename=filename
+            )
+
+            yield part
+
+    def close(self):
+        for _, _, encoded in self._attachments:
+            if not isinstance(encoded, str):
+                encoded.close()
+
+        self._attachments = []
+        self.memory = 0
+
+
+class RateLimiter:
+    """
+    Token bucket limiting sending to `rate` messages per `period` seconds,
+    allowing bursts of up to `burst` messages. As tokens accumulate while
+    rendering and sending, that time is subtracted from the wait.
+
+    When a `cache` is given, the limit is shared with other processes using
+    that cache, by counting messages in windows of `burst` messages.
+    """
+
+    def __init__(self, rate, period=1, burst=1, cache=None,
+                 key='newsletter:rate-limit'):
+        self.burst = max(burst, 1)
+        self.interval = period / rate
+        self.cache = cache
+        self.key = key
+
+        self._lock = threading.Lock()
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+
+    @classmethod
+    def from_settings(cls):
+        """
+        Return a limiter for `NEWSLETTER_RATE_LIMIT`, falling back to one
+        message every `NEWSLETTER_EMAIL_DELAY` seconds, or None.
+        """
+        rate_limit = newsletter_settings.RATE_LIMIT
+
+        if rate_limit:
+            try:
+                rate, period = rate_limit.split('/')
+                rate, period = int(rate), RATE_PERIODS[period[0]]
+                if rate <= 0:
+                    raise ValueError(rate)
+            except (ValueError, KeyError, IndexError):
+                raise ImproperlyConfigured(
+                    "NEWSLETTER_RATE_LIMIT should be of the form "
+                    "'<messages>/<second|minute|hour|day>' with a positive "
+                    "number of messages, not %r." % rate_limit
+                )
+        elif getattr(settings, 'NEWSLETTER_EMAIL_DELAY', None):
+            rate, period = 1, settings.NEWSLETTER_EMAIL_DELAY
+        else:
+            return None
+
+        cache = newsletter_settings.RATE_LIMIT_CACHE
+
+        return cls(
+            rate, period, burst=newsletter_settings.RATE_LIMIT_BURST,
+            cache=caches[cache] if cache else None
+        )
+
+    def acquire(self):
+        """ Block until the next message may be sent. """
+        if self.cache is not None:
+            return self._acquire_shared()
+
+        with self._lock:
+            current = time.monotonic()
+            self._tokens = min(
+                self.burst,
+                self._tokens + (current - self._updated) / self.interval
+            )
+            self._updated = current
+
+            # Claim a token, possibly ahead of time so concurrent callers
+            # wait in turn.
+            self._tokens -= 1
+            wait = -self._tokens * self.interval
+
+        if wait > 0:
+            time.sleep(wait)
+
+    def _acquire_shared(self):
+        window = self.burst * self.interval
+
+        while True:
+            current = time.time()
+            index = int(current / window)
+            key = '%s:%d' % (self.key, index)
+
+            self.cache.add(key, 0, timeout=int(window) + 1)
+            try:
+                count = self.cache.incr(key)
+            except ValueError:
+                # Key expired in between
+                continue
+
+            if count <= self.burst:
+                return
+
+            # Wait for the next window
+            time.sleep((index + 1) * window - current)
+
+
+class SharedIterator:
+    """ Thread-safe iterator, allowing workers to consume a common iterable. """
+
+    def __init__(self, iterable):
+        self._iterator = iter(iterable)
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        with self._lock:
+            return next(self._iterator)
+
+
+def run_workers(target, iterable, workers):
+    """
+    Run `target` in `workers` threads, each being passed a shared iterator
+    over `iterable`. Every thread uses its own database connection, which is
+    closed when the thread is done.
+
+    Returns a (results, errors) tuple once all workers have finished, with
+    errors containing the exceptions raised by failing workers.
+    """
+
+    shared = SharedIterator(iterable)
+
+    def work():
+        try:
+            return target(shared)
+        finally:
+            connections.close_all()
+
+    with ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix='newsletter'
+    ) as executor:
+        futures = [executor.submit(work) for _ in range(workers)]
+
+    results = []
+    errors = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            logger.error('Sending worker failed with error: %s', e)
+            errors.append(e)
+
+    return results, errors
+
+
+def send_async(messages, concurrency, timeout=None, on_result=None):
+    """
+    Send (key, message) pairs from the iterable `messages` using asyncio.
+
+    At most `concurrency` SMTP transactions are in flight at any time, each
+    over its own persistent connection to Django's configured e-mail host.
+    The iterable is consumed (i.e. messages are rendered) in a separate
+    thread, so it can safely touch the database. Every message is given
+    `timeout` seconds to be sent, after which it is considered failed.
+
+    If given, `on_result(key, error)` is called from that same thread after
+    every message, with error being None when sending succeeded.
+
+    Returns a dictionary with the amount of messages sent, connections
+    opened and a list of keys for which sending failed.
+
+    Requires aiosmtplib.
+    """
+    import aiosmtplib
+
+    result = {'sent': 0, 'connections': 0, 'failed': []}
+
+    def render(iterator):
+        try:
+            return next(iterator)
+        except StopIteration:
+            return None
+
+    async def produce(queue, executor):
+        loop = asyncio.get_running_loop()
+        iterator = iter(messages)
+
+        try:
+            while True:
+                item = await loop.run_in_executor(executor, render, iterator)
+                if item is None:
+                    break
+                await queue.put(item)
+        finally:
+            for _ in range(concurrency):
+                await queue.put(None)
+
+    async def connect():
+        smtp = aiosmtplib.SMTP(
+            hostname=settings.EMAIL_HOST,
+            port=settings.EMAIL_PORT,
+            username=settings.EMAIL_HOST_USER or None,
+            password=settings.EMAIL_HOST_PASSWORD or None,
+            use_tls=settings.EMAIL_USE_SSL,
+            start_tls=settings.EMAIL_USE_TLS,
+            timeout=timeout,
+        )
+        await smtp.connect()
+        result['connections'] += 1
+        return smtp
+
+    async def deliver(smtp, message):
+        encoding = message.encoding or settings.DEFAULT_CHARSET
+        await smtp.sendmail(
+            sanitize_address(message.from_email, encoding),
+            [sanitize_address(addr, encoding)
+             for addr in message.recipients()],
+            message.message().as_bytes(linesep='\r\n'),
+        )
+
+    async def consume(queue, executor):
+        loop = asyncio.get_running_loop()
+        smtp = None
+        try:
+            while (item := await queue.get()) is not None:
+                key, message = item
+                error = None
+                try:
+                    if smtp is None:
+                        smtp = await asyncio.wait_for(connect(), timeout)
+                    await asyncio.wait_for(deliver(smtp, message), timeout)
+                except Exception as e:
+                    # Keys may not be used from the event loop, as their
+                    # representation could query the database.
+                    logger.error(
+                        'Message to %s failed with error: %s',
+                        ', '.join(message.to), e
+                    )
+                    result['failed'].append(key)
+                    error = e
+
+                    # The connection is in an unknown state, start afresh.
+                    if smtp is not None:
+                        smtp.close()
+                        smtp = None
+                else:
+                    result['sent'] += 1
+
+                if on_result is not None:
+                    await loop.run_in_executor(
+                        executor, on_result, key, error
+                    )
+        finally:
+            if smtp is not None and smtp.is_connected:
+                try:
+                    await smtp.quit()
+                except aiosmtplib.SMTPException:
+                    smtp.close()
+
+    async def run():
+        queue = asyncio.Queue(maxsize=concurrency * 2)
+
+        with ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='newsletter-render'
+        ) as executor:
+            try:
+                await asyncio.gather(
+                    produce(queue, executor),
+                    *(consume(queue, executor) for _ in range(concurrency))
+                )
+            finally:
+                await asyncio.get_running_loop().run_in_executor(
+                    executor, connections.close_all
+                )
+
+    asyncio.run(run())
+
+    return result
@@ -0,0 +1,71 @@
+"""
+import subscriptions from a file
+"""
+import os
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.translation import gettext as _
+
+from newsletter.models import Newsletter, SubscriptionImport
+
+
+class Command(BaseCommand):
+    help = _(
+        "Subscribe the addresses in a CSV, vCard or LDIF file to a "
+        "newsletter."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'newsletter_slug',
+            help=_('Slug of the newsletter to subscribe the addresses to.')
+        )
+        parser.add_argument(
+            'path', help=_('File with a .csv, .vcf or .ldif extension.')
+        )
+        parser.add_argument(
+            '--ignore-errors', action='store_true',
+            help=_('Skip invalid entries instead of stopping the import.')
+        )
+
+    def handle(self, *args, **options):
+        try:
+            newsletter = Newsletter.objects.get(
+                slug=options['newsletter_slug']
+            )
+        except Newsletter.DoesNotExist:
+            raise CommandError(
+                _('Newsletter "%s" does not exist.')
+                % options['newsletter_slug']
+            )
+
+        ext = os.path.splitext(options['path'])[1].lstrip('.').lower()
+
+        try:
+            myfile = open(options['path'], 'rb')
+        except OSError as e:
+            raise CommandError(e)
+
+        try:
+            # Errors roll back staging, like in the admin
+            with myfile, transaction.atomic():
+                subscription_import = SubscriptionImport.objects.create(
+                    newsletter=newsletter,
+                    ignore_errors=options['ignore_errors']
+                )
+                subscription_import.stage(myfile, ext)
+        except ValidationError as e:
+            raise CommandError('; '.join(e.messages))
+
+        inserted = subscription_import.confirm()
+
+        self.stdout.write(
+            _('%(rows)d rows parsed, %(rejected)d rejected, '
+              '%(inserted)d subscriptions created.') % {
+                'rows': subscription_import.rows,
+                'rejected': subscription_import.rejected,
+                'inserted': inserted,
+            }
+        )
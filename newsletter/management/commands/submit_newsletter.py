@@ -1,17 +1,100 @@
 """
 actual sending of the submissions
 """
+import functools
 import logging
+import select
+import signal
+import time
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, close_old_connections, connections
 from django.utils.translation import gettext as _
 
-from newsletter.models import Submission
+from newsletter.delivery import SendingLimit
+from newsletter.models import (
+    Newsletter, Submission, SubscriptionImport, SubscriptionJob,
+    SUBMISSION_CHANNEL
+)
+
+logger = logging.getLogger(__name__)
+
+
+class SubmissionListener:
+    """
+    Waits for notifications of submissions ready for sending, using
+    PostgreSQL's LISTEN on a dedicated database connection.
+    """
+
+    def __init__(self, alias=DEFAULT_DB_ALIAS):
+        self.connection = connections.create_connection(alias)
+        self.connection.ensure_connection()
+        self.connection.set_autocommit(True)
+
+        with self.connection.cursor() as cursor:
+            cursor.execute('LISTEN %s' % SUBMISSION_CHANNEL)
+
+    @classmethod
+    def create(cls):
+        """ Return a listener when using PostgreSQL, or None. """
+        if connections[DEFAULT_DB_ALIAS].vendor != 'postgresql':
+            return None
+
+        return cls()
+
+    def wait(self, timeout):
+        """ Wait up to timeout seconds, returning whether notified. """
+        raw = self.connection.connection
+
+        if not select.select([raw], [], [], timeout)[0]:
+            return False
+
+        # Receive and discard the notifications
+        with self.connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        if isinstance(getattr(raw, 'notifies', None), list):
+            raw.notifies.clear()
+
+        return True
+
+    def close(self):
+        self.connection.close()
 
 
 class Command(BaseCommand):
     help = _("Submit pending messages.")
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--daemon', action='store_true',
+            help=_('Keep running, submitting messages as they become due.')
+        )
+        parser.add_argument(
+            '--poll-interval', type=float, default=60,
+            help=_('Seconds between checks for due messages in daemon mode.')
+        )
+        parser.add_argument(
+            '--max-messages', type=int,
+            help=_('Stop after sending this many messages.')
+        )
+        parser.add_argument(
+            '--time-limit', type=float,
+            help=_('Stop sending after this many seconds.')
+        )
+        parser.add_argument(
+            '--submission', type=int, dest='submission_id',
+            help=_('Only send the submission with this id.')
+        )
+        parser.add_argument(
+            '--newsletter', dest='newsletter_slug',
+            help=_('Only send submissions of the newsletter with this slug.')
+        )
+        parser.add_argument(
+            '--jobs', action='store_true',
+            help=_('Run bulk subscription actions and imports queued from '
+                   'the admin, instead of sending messages.')
+        )
+
     def handle(self, *args, **options):
         # Setup logging based on verbosity: 1 -> INFO, >1 -> DEBUG
         verbosity = int(options['verbosity'])
@@ -26,7 +109,113 @@ class Command(BaseCommand):
             logger = logging.getLogger()
             logger.setLevel(logging.DEBUG)
 
-        logger.info(_('Submitting queued newsletter mailings'))
+        if options['jobs']:
+            if any(options[option] is not None for option in (
+                'submission_id', 'newsletter_slug', 'max_messages',
+                'time_limit'
+            )):
+                raise CommandError(
+                    _('--jobs cannot be combined with options for sending.')
+                )
+
+            if options['daemon']:
+                self.run_daemon(
+                    options['poll_interval'], SendingLimit(), self.run_jobs
+                )
+            else:
+                self.run_jobs()
+            return
+
+        queryset = Submission.objects.all()
+        if options['submission_id'] is not None:
+            queryset = queryset.filter(pk=options['submission_id'])
+        if options['newsletter_slug'] is not None:
+            if not Newsletter.objects.filter(
+                slug=options['newsletter_slug']
+            ).exists():
+                raise CommandError(
+                    _('Newsletter "%s" does not exist.')
+                    % options['newsletter_slug']
+                )
+            queryset = queryset.filter(
+                newsletter__slug=options['newsletter_slug']
+            )
+
+        limit = SendingLimit(
+            max_messages=options['max_messages'],
+            time_limit=options['time_limit']
+        )
+
+        if options['daemon']:
+            self.run_daemon(
+                options['poll_interval'], limit,
+                functools.partial(Submission.submit_queue, limit, queryset)
+            )
+        else:
+            logger.info(_('Submitting queued newsletter mailings'))
+
+            # Call submission
+            Submission.submit_queue(limit, queryset)
+
+        if limit.is_set():
+            logger.info(
+                _('Stopped after %d messages.'), limit.messages
+            )
+
+    def run_jobs(self):
+        """ Run queued bulk subscription actions and imports. """
+        logger.info(_('Running queued subscription jobs and imports'))
+
+        SubscriptionJob.run_queue()
+        SubscriptionImport.run_queue()
+
+    def run_daemon(self, poll_interval, limit, work):
+        """
+        Call work, e.g. submitting messages as they become due, until the
+        limit is reached or SIGTERM or SIGINT is received, which stop
+        sending once the messages in flight are done.
+        """
+        def handle_signal(signum, frame):
+            logger.info(_('Stopping after the messages being sent.'))
+            limit.set()
+
+        handlers = {
+            signum: signal.signal(signum, handle_signal)
+            for signum in (signal.SIGTERM, signal.SIGINT)
+        }
+        listener = SubmissionListener.create()
+
+        logger.info(_('Waiting for newsletter mailings to submit'))
+
+        try:
+            while not limit.is_set():
+                # Keep connections unless these expired or broke
+                close_old_connections()
+
+                try:
+                    work()
+                except Exception:
+                    logger.exception(_('Submitting mailings failed'))
+
+                self.wait(poll_interval, limit, listener)
+
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+            if listener is not None:
+                listener.close()
+            close_old_connections()
+
+    def wait(self, timeout, limit, listener):
+        """ Wait for timeout seconds, a notification or the limit. """
+        deadline = time.monotonic() + timeout
+
+        while not limit.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
 
-        # Call submission
-        Submission.submit_queue()
+            if listener is None:
+                limit.wait(remaining)
+            elif listener.wait(min(remaining, 1)):
+                return
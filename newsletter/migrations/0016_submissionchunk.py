@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0015_article_image_use_original'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubmissionChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField(verbose_name='number')),
+                ('first_subscription_id', models.BigIntegerField(blank=True, null=True)),
+                ('last_subscription_id', models.BigIntegerField(blank=True, null=True)),
+                ('dynamic', models.BooleanField(default=False, help_text='Contains the dynamically generated recipients.', verbose_name='dynamic')),
+                ('claimed_by', models.CharField(blank=True, max_length=200, null=True, verbose_name='claimed by')),
+                ('claimed_at', models.DateTimeField(blank=True, null=True, verbose_name='claimed at')),
+                ('sent', models.BooleanField(db_index=True, default=False, verbose_name='sent')),
+                ('submission', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='newsletter.submission', verbose_name='submission')),
+            ],
+            options={
+                'verbose_name': 'submission chunk',
+                'verbose_name_plural': 'submission chunks',
+                'ordering': ('number',),
+                'unique_together': {('submission', 'number')},
+            },
+        ),
+    ]
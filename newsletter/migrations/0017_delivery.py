@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0016_submissionchunk'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Delivery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.EmailField(max_length=254, verbose_name='e-mail')),
+                ('status', models.CharField(choices=[('sent', 'sent'), ('failed', 'failed')], max_length=10, verbose_name='status')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='attempts')),
+                ('error', models.TextField(blank=True, verbose_name='error')),
+                ('first_attempt', models.DateTimeField(default=django.utils.timezone.now, verbose_name='first attempt')),
+                ('last_attempt', models.DateTimeField(default=django.utils.timezone.now, verbose_name='last attempt')),
+                ('submission', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='newsletter.submission', verbose_name='submission')),
+                ('subscription', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='newsletter.subscription', verbose_name='subscription')),
+            ],
+            options={
+                'verbose_name': 'delivery',
+                'verbose_name_plural': 'deliveries',
+                'indexes': [models.Index(fields=['submission', 'status'], name='newsletter__submiss_d5e615_idx')],
+                'unique_together': {('submission', 'email')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0017_delivery'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='newsletter',
+            name='personalized',
+            field=models.BooleanField(blank=True, default=None, help_text='Whether messages contain content specific to each subscriber. When unknown, this is detected while sending.', null=True, verbose_name='personalized'),
+        ),
+    ]
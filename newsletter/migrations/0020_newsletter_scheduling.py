@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:19
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0019_submission_claim'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='newsletter',
+            name='max_concurrent_chunks',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Maximum number of chunks of submissions sent at the same time, when these are split into chunks.', null=True, verbose_name='maximum concurrent chunks'),
+        ),
+        migrations.AddField(
+            model_name='newsletter',
+            name='weight',
+            field=models.PositiveSmallIntegerField(default=1, help_text='Share in sending, relative to other newsletters with submissions being sent at the same time.', validators=[django.core.validators.MinValueValidator(1)], verbose_name='weight'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sites', '0002_alter_domain_unique'),
+        ('newsletter', '0020_newsletter_scheduling'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivationEmail',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.CharField(choices=[('subscribe', 'subscribe'), ('unsubscribe', 'unsubscribe'), ('update', 'update')], max_length=20, verbose_name='action')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now, verbose_name='created')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='attempts')),
+                ('error', models.TextField(blank=True, verbose_name='error')),
+                ('site', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='sites.site', verbose_name='site')),
+                ('subscription', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='activation_emails', to='newsletter.subscription', verbose_name='subscription')),
+            ],
+            options={
+                'verbose_name': 'activation email',
+                'verbose_name_plural': 'activation emails',
+                'ordering': ('pk',),
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:26
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0021_activationemail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubscriptionJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('action', models.CharField(choices=[('subscribe', 'subscribe'), ('unsubscribe', 'unsubscribe')], max_length=20, verbose_name='action')),
+                ('subscription_ids', models.JSONField(default=list, editable=False)),
+                ('status', models.CharField(choices=[('pending', 'pending'), ('running', 'running'), ('done', 'done'), ('failed', 'failed')], db_index=True, default='pending', max_length=10, verbose_name='status')),
+                ('total', models.PositiveIntegerField(default=0, verbose_name='total')),
+                ('processed', models.PositiveIntegerField(default=0, verbose_name='processed')),
+                ('error', models.TextField(blank=True, verbose_name='error')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now, verbose_name='created')),
+                ('updated', models.DateTimeField(default=django.utils.timezone.now, verbose_name='updated')),
+            ],
+            options={
+                'verbose_name': 'subscription job',
+                'verbose_name_plural': 'subscription jobs',
+                'ordering': ('-pk',),
+            },
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import newsletter.utils
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0022_subscriptionjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubscriptionImport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(default=django.utils.timezone.now, verbose_name='created')),
+                ('rows', models.PositiveIntegerField(default=0, verbose_name='rows')),
+                ('rejected', models.PositiveIntegerField(default=0, verbose_name='rejected')),
+                ('newsletter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='newsletter.newsletter', verbose_name='newsletter')),
+            ],
+            options={
+                'verbose_name': 'subscription import',
+                'verbose_name_plural': 'subscription imports',
+            },
+        ),
+        migrations.CreateModel(
+            name='ImportedAddress',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.EmailField(max_length=254, verbose_name='e-mail')),
+                ('name', models.CharField(blank=True, max_length=200, null=True, verbose_name='name')),
+                ('activation_code', models.CharField(default=newsletter.utils.make_activation_code, max_length=40, verbose_name='activation code')),
+                ('subscription_import', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='addresses', to='newsletter.subscriptionimport', verbose_name='subscription import')),
+            ],
+            options={
+                'verbose_name': 'imported address',
+                'verbose_name_plural': 'imported addresses',
+                'ordering': ('pk',),
+                'unique_together': {('subscription_import', 'email')},
+            },
+        ),
+    ]
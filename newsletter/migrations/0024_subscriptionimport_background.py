@@ -0,0 +1,50 @@
+# Generated by Django 4.2.30 on 2026-10-18 17:42
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def mark_existing_staged(apps, schema_editor):
+    """ Imports created before were staged when uploaded. """
+    SubscriptionImport = apps.get_model('newsletter', 'SubscriptionImport')
+    SubscriptionImport.objects.update(status='staged')
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0023_subscriptionimport'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subscriptionimport',
+            name='address_file',
+            field=models.FileField(blank=True, upload_to='newsletter/imports/%Y/%m/%d/', verbose_name='address file'),
+        ),
+        migrations.AddField(
+            model_name='subscriptionimport',
+            name='error',
+            field=models.TextField(blank=True, verbose_name='error'),
+        ),
+        migrations.AddField(
+            model_name='subscriptionimport',
+            name='ignore_errors',
+            field=models.BooleanField(default=False, verbose_name='ignore non-fatal errors'),
+        ),
+        migrations.AddField(
+            model_name='subscriptionimport',
+            name='inserted',
+            field=models.PositiveIntegerField(default=0, verbose_name='inserted'),
+        ),
+        migrations.AddField(
+            model_name='subscriptionimport',
+            name='status',
+            field=models.CharField(choices=[('pending', 'waiting to be parsed'), ('parsing', 'parsing'), ('staged', 'waiting for confirmation'), ('confirmed', 'waiting to be imported'), ('inserting', 'importing'), ('done', 'done'), ('failed', 'failed')], db_index=True, default='pending', max_length=10, verbose_name='status'),
+        ),
+        migrations.AddField(
+            model_name='subscriptionimport',
+            name='updated',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='updated'),
+        ),
+        migrations.RunPython(mark_existing_staged, migrations.RunPython.noop),
+    ]
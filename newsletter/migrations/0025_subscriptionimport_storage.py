@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:28
+
+from django.db import migrations, models
+import newsletter.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0024_subscriptionimport_background'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='subscriptionimport',
+            name='address_file',
+            field=models.FileField(blank=True, storage=newsletter.models.get_import_storage, upload_to='newsletter/imports/%Y/%m/%d/', verbose_name='address file'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 18:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('newsletter', '0025_subscriptionimport_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subscriptionimport',
+            name='rejections',
+            field=models.JSONField(default=list, editable=False, verbose_name='rejections'),
+        ),
+    ]
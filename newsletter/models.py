@@ -1,16 +1,23 @@
+import functools
 import logging
 import os
+import tempfile
+import threading
 import time
 import importlib
-from datetime import datetime
+import itertools
+from datetime import datetime, timedelta
 from abc import abstractmethod, ABC
 
 from email.utils import formataddr
 from django.conf import settings
+from django.contrib.auth import get_user_model
 from django.contrib.sites.models import Site
 from django.core.exceptions import ValidationError
+from django.core.files.storage import FileSystemStorage, storages
 from django.core.mail import EmailMultiAlternatives
-from django.db import models
+from django.core.validators import MinValueValidator
+from django.db import IntegrityError, connections, models, transaction
 from django.template.loader import select_template
 from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
@@ -18,10 +25,16 @@ from django.utils.translation import gettext
 from django.utils.timezone import now
 from django.urls import reverse
 
+from .delivery import (
+    AttachmentCache, ClaimLost, RateLimiter, ReusableConnection,
+    SendingStopped,
+    run_workers, send_async
+)
 from .fields import DynamicImageField
 from .settings import newsletter_settings, SUPPORTED_THUMBNAILERS
 from .utils import (
-    make_activation_code, get_default_sites, ACTIONS
+    make_activation_code, get_default_sites, get_worker_id, batches_by_pk,
+    ACTIONS
 )
 
 logger = logging.getLogger(__name__)
@@ -64,6 +77,26 @@ class Newsletter(models.Model):
         help_text = _('Enable unsubscribe links in e-mails.')
     )
 
+    weight = models.PositiveSmallIntegerField(
+        default=1, validators=[MinValueValidator(1)],
+        verbose_name=_('weight'),
+        help_text=_('Share in sending, relative to other newsletters with '
+                    'submissions being sent at the same time.')
+    )
+    max_concurrent_chunks = models.PositiveSmallIntegerField(
+        blank=True, null=True, verbose_name=_('maximum concurrent chunks'),
+        help_text=_('Maximum number of chunks of submissions sent at the '
+                    'same time, when these are split into chunks.')
+    )
+
+    personalized = models.BooleanField(
+        null=True, blank=True, default=None,
+        verbose_name=_('personalized'),
+        help_text=_('Whether messages contain content specific to each '
+                    'subscriber. When unknown, this is detected while '
+                    'sending.')
+    )
+
     objects = models.Manager()
 
     def get_templates(self, action):
@@ -242,6 +275,26 @@ class Subscription(models.Model):
         # care of stuff like maintaining the (un)subscribe date.
         self.save()
 
+    @classmethod
+    def update_queryset(cls, queryset, action):
+        """
+        Like `update()` for all subscriptions in queryset, using a single
+        UPDATE statement. Returns the number of subscriptions changed.
+        """
+        assert action in ('subscribe', 'update', 'unsubscribe')
+
+        # Drop joins, ordering and the like of (admin) querysets
+        queryset = cls.objects.filter(pk__in=queryset.values('pk'))
+
+        if action == 'subscribe' or action == 'update':
+            return queryset.filter(
+                models.Q(subscribed=False) | models.Q(unsubscribed=True)
+            ).update(subscribed=True, unsubscribed=False, subscribe_date=now())
+
+        return queryset.filter(
+            models.Q(unsubscribed=False) | models.Q(subscribed=True)
+        ).update(subscribed=False, unsubscribed=True, unsubscribe_date=now())
+
     def _subscribe(self):
         """
         Internal helper method for managing subscription state
@@ -271,26 +324,27 @@ class Subscription(models.Model):
         cleanup the code. Refer to comment below and
         https://docs.djangoproject.com/en/dev/ref/models/instances/#django.db.models.Model.clean
         """
-        assert self.user or self.email_field, \
+        assert self.user_id or self.email_field, \
             _('Neither an email nor a username is set. This asks for '
               'inconsistency!')
-        assert ((self.user and not self.email_field) or
-                (self.email_field and not self.user)), \
+        assert ((self.user_id and not self.email_field) or
+                (self.email_field and not self.user_id)), \
             _('If user is set, email must be null and vice versa.')
 
-        # This is a lame way to find out if we have changed but using Django
-        # API internals is bad practice. This is necessary to discriminate
-        # from a state where we have never been subscribed but is mostly for
-        # backward compatibility. It might be very useful to make this just
-        # one attribute 'subscribe' later. In this case unsubscribed can be
-        # replaced by a method property.
-
-        if self.pk:
-            assert(Subscription.objects.filter(pk=self.pk).count() == 1)
-
-            subscription = Subscription.objects.get(pk=self.pk)
-            old_subscribed = subscription.subscribed
-            old_unsubscribed = subscription.unsubscribed
+        # Compare with the state as loaded from the database, to
+        # discriminate from a state where we have never been subscribed.
+        # This is mostly for backward compatibility. It might be very useful
+        # to make this just one attribute 'subscribe' later. In this case
+        # unsubscribed can be replaced by a method property.
+        stored_state = self._stored_state
+        if self.pk and stored_state is None:
+            # Not loaded from the database, or with the state deferred
+            stored_state = Subscription.objects.filter(pk=self.pk).values_list(
+                'subscribed', 'unsubscribed'
+            ).first()
+
+        if stored_state is not None:
+            old_subscribed, old_unsubscribed = stored_state
 
             # If we are subscribed now and we used not to be so, subscribe.
             # If we user to be unsubscribed but are not so anymore, subscribe.
@@ -317,6 +371,30 @@ class Subscription(models.Model):
                 self._unsubscribe()
 
         super().save(*args, **kwargs)
+        self._remember_state()
+
+    # Subscription state as stored in the database, None when unknown
+    _stored_state = None
+
+    def _remember_state(self):
+        deferred = self.get_deferred_fields()
+        if 'subscribed' in deferred or 'unsubscribed' in deferred:
+            self._stored_state = None
+        else:
+            self._stored_state = (self.subscribed, self.unsubscribed)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_state()
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None, **kwargs):
+        super().refresh_from_db(using=using, fields=fields, **kwargs)
+
+        if fields is None or {'subscribed', 'unsubscribed'} & set(fields):
+            self._stored_state = None
+            self._remember_state()
 
     ip = models.GenericIPAddressField(_("IP address"), blank=True, null=True)
 
@@ -427,6 +505,623 @@ class Subscription(models.Model):
             'activation_code': self.activation_code
         })
 
+    def queue_activation_email(self, action, site=None):
+        """
+        Queue the activation email for sending by `submit_newsletter`,
+        ahead of any submissions.
+        """
+        assert action in ACTIONS, 'Unknown action: %s' % action
+
+        return ActivationEmail.objects.create(
+            subscription=self, action=action,
+            site=site or Site.objects.get_current()
+        )
+
+
+class ActivationEmail(models.Model):
+    """
+    Activation email waiting to be sent, when these are queued through
+    `NEWSLETTER_QUEUE_ACTIVATION_EMAILS`. Rows are removed once sent.
+    """
+    # Attempts after which sending an activation email is given up
+    MAX_ATTEMPTS = 5
+
+    class Meta:
+        verbose_name = _('activation email')
+        verbose_name_plural = _('activation emails')
+        ordering = ('pk',)
+
+    def __str__(self):
+        return _("%(action)s email to %(subscription)s") % {
+            'action': self.action,
+            'subscription': self.subscription
+        }
+
+    subscription = models.ForeignKey(
+        Subscription, verbose_name=_('subscription'),
+        related_name='activation_emails', on_delete=models.CASCADE
+    )
+    action = models.CharField(
+        max_length=20, verbose_name=_('action'),
+        choices=[(action, action) for action in ACTIONS]
+    )
+    site = models.ForeignKey(
+        Site, verbose_name=_('site'), blank=True, null=True,
+        on_delete=models.CASCADE
+    )
+    created = models.DateTimeField(default=now, verbose_name=_('created'))
+
+    attempts = models.PositiveIntegerField(
+        default=0, verbose_name=_('attempts')
+    )
+    error = models.TextField(blank=True, verbose_name=_('error'))
+
+    @classmethod
+    def send_queue(cls):
+        """
+        Send queued activation emails, oldest first, returning the number
+        sent. Emails being sent by other workers are skipped where the
+        database supports it, failed ones are tried again on the next run.
+        """
+        pending = cls.objects.filter(attempts__lt=cls.MAX_ATTEMPTS)
+        sent = 0
+        last = 0
+
+        while True:
+            with transaction.atomic():
+                email = pending.select_for_update(
+                    skip_locked=True
+                ).filter(pk__gt=last).first()
+
+                if email is None:
+                    return sent
+                last = email.pk
+
+                try:
+                    email.subscription.send_activation_email(
+                        email.action, site=email.site
+                    )
+                except Exception as e:
+                    logger.exception(
+                        'Error %s while submitting email to %s.',
+                        e, email.subscription.email
+                    )
+                    email.attempts += 1
+                    email.error = str(e)
+                    email.save(update_fields=['attempts', 'error'])
+                else:
+                    email.delete()
+                    sent += 1
+
+
+class SubscriptionJob(models.Model):
+    """
+    Bulk (un)subscription too large for handling within a request, run in
+    the background by `submit_newsletter --jobs`.
+    """
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, _('pending')),
+        (RUNNING, _('running')),
+        (DONE, _('done')),
+        (FAILED, _('failed')),
+    )
+
+    class Meta:
+        verbose_name = _('subscription job')
+        verbose_name_plural = _('subscription jobs')
+        ordering = ('-pk',)
+
+    def __str__(self):
+        return _("%(action)s %(total)d subscriptions") % {
+            'action': self.get_action_display(),
+            'total': self.total
+        }
+
+    action = models.CharField(
+        max_length=20, verbose_name=_('action'), choices=(
+            ('subscribe', _('subscribe')),
+            ('unsubscribe', _('unsubscribe')),
+        )
+    )
+    subscription_ids = models.JSONField(default=list, editable=False)
+
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=PENDING,
+        verbose_name=_('status'), db_index=True
+    )
+    total = models.PositiveIntegerField(default=0, verbose_name=_('total'))
+    processed = models.PositiveIntegerField(
+        default=0, verbose_name=_('processed')
+    )
+    error = models.TextField(blank=True, verbose_name=_('error'))
+
+    created = models.DateTimeField(default=now, verbose_name=_('created'))
+    updated = models.DateTimeField(default=now, verbose_name=_('updated'))
+
+    @classmethod
+    def create(cls, queryset, action):
+        """ Queue a job applying action to the subscriptions in queryset. """
+        ids = list(queryset.order_by('pk').values_list('pk', flat=True))
+
+        return cls.objects.create(
+            action=action, subscription_ids=ids, total=len(ids)
+        )
+
+    @classmethod
+    def run_queue(cls):
+        """
+        Run pending jobs, as well as jobs of workers which stopped updating
+        them for `NEWSLETTER_SUBMISSION_LEASE` seconds. Jobs are resumed
+        where they were left, returning the number of jobs run.
+        """
+        expired = now() - timedelta(
+            seconds=newsletter_settings.SUBMISSION_LEASE
+        )
+        claimable = cls.objects.filter(
+            models.Q(status=cls.PENDING) |
+            models.Q(status=cls.RUNNING, updated__lt=expired)
+        ).order_by('pk')
+        count = 0
+
+        while True:
+            with transaction.atomic():
+                job = claimable.select_for_update(skip_locked=True).first()
+                if job is None:
+                    return count
+
+                job.status = cls.RUNNING
+                job.updated = now()
+                job.save(update_fields=['status', 'updated'])
+
+            job.run()
+            count += 1
+
+    def run(self):
+        """
+        Apply the action to the subscriptions in batches of
+        `NEWSLETTER_SUBSCRIPTION_FETCH_SIZE`, recording the progress.
+        """
+        batch_size = newsletter_settings.SUBSCRIPTION_FETCH_SIZE
+
+        logger.info(gettext("Running %s"), self)
+
+        try:
+            for start in range(self.processed, self.total, batch_size):
+                ids = self.subscription_ids[start:start + batch_size]
+
+                with transaction.atomic():
+                    Subscription.update_queryset(
+                        Subscription.objects.filter(pk__in=ids), self.action
+                    )
+
+                    self.processed = start + len(ids)
+                    self.updated = now()
+                    self.save(update_fields=['processed', 'updated'])
+
+        except Exception as e:
+            logger.exception(gettext("%s failed"), self)
+
+            self.status = self.FAILED
+            self.error = str(e)
+        else:
+            self.status = self.DONE
+
+        self.updated = now()
+        self.save(update_fields=['status', 'error', 'updated'])
+
+
+class ImportTakenOver(Exception):
+    """ Another process changed the import being worked on. """
+
+
+def get_import_storage():
+    """
+    Storage of uploaded import files, which must not be served: the
+    `STORAGES` alias in `NEWSLETTER_IMPORT_STORAGE`, or else a directory
+    in the system's temporary directory.
+    """
+    alias = newsletter_settings.IMPORT_STORAGE
+    if alias:
+        return storages[alias]
+
+    return FileSystemStorage(
+        location=os.path.join(tempfile.gettempdir(), 'newsletter-imports')
+    )
+
+
+class SubscriptionImport(models.Model):
+    """
+    Addresses imported from a file, staged in the database until the
+    import is confirmed. With `NEWSLETTER_IMPORT_IN_BACKGROUND`, parsing the
+    file and creating the subscriptions is left to
+    `submit_newsletter --jobs`.
+    """
+    PENDING = 'pending'
+    PARSING = 'parsing'
+    STAGED = 'staged'
+    CONFIRMED = 'confirmed'
+    INSERTING = 'inserting'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (PENDING, _('waiting to be parsed')),
+        (PARSING, _('parsing')),
+        (STAGED, _('waiting for confirmation')),
+        (CONFIRMED, _('waiting to be imported')),
+        (INSERTING, _('importing')),
+        (DONE, _('done')),
+        (FAILED, _('failed')),
+    )
+
+    MAX_REJECTIONS = 100
+
+    class Meta:
+        verbose_name = _('subscription import')
+        verbose_name_plural = _('subscription imports')
+
+    def __str__(self):
+        return _("Import of %(rows)d rows into %(newsletter)s") % {
+            'rows': self.rows,
+            'newsletter': self.newsletter
+        }
+
+    newsletter = models.ForeignKey(
+        Newsletter, verbose_name=_('newsletter'), on_delete=models.CASCADE
+    )
+    created = models.DateTimeField(default=now, verbose_name=_('created'))
+    updated = models.DateTimeField(default=now, verbose_name=_('updated'))
+
+    # Uploaded file, kept until parsed in the background
+    address_file = models.FileField(
+        upload_to='newsletter/imports/%Y/%m/%d/', blank=True,
+        storage=get_import_storage, verbose_name=_('address file')
+    )
+    ignore_errors = models.BooleanField(
+        default=False, verbose_name=_('ignore non-fatal errors')
+    )
+
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, default=PENDING,
+        verbose_name=_('status'), db_index=True
+    )
+    error = models.TextField(blank=True, verbose_name=_('error'))
+
+    rows = models.PositiveIntegerField(default=0, verbose_name=_('rows'))
+    rejected = models.PositiveIntegerField(
+        default=0, verbose_name=_('rejected')
+    )
+    # Reasons for rejecting the first MAX_REJECTIONS rows, for display
+    rejections = models.JSONField(
+        default=list, editable=False, verbose_name=_('rejections')
+    )
+    inserted = models.PositiveIntegerField(
+        default=0, verbose_name=_('inserted')
+    )
+
+    def stage(self, myfile, ext):
+        """
+        Parse addresses from file-object with extension ext into the staging
+        table, after which the import awaits confirmation.
+        """
+        from .addressimport.parsers import stage_addresses
+
+        stage_addresses(self, myfile, ext, self.ignore_errors)
+
+        self.save_state(status=self.STAGED)
+
+    def stage_file(self):
+        """ Stage the addresses of the uploaded file, then remove it. """
+        # Start over when resuming after a crash
+        self.addresses.all().delete()
+        self.rows = self.rejected = 0
+        self.rejections = []
+
+        ext = self.address_file.name.rsplit('.', 1)[-1].lower()
+
+        with self.address_file.open('rb') as myfile:
+            self.stage(myfile, ext)
+
+        self.address_file.delete(save=False)
+        self.save_state(address_file='')
+
+    def save_state(self, **fields):
+        """
+        Save fields, along with the time of this update, unless another
+        process changed the status or updated this import since, e.g. after
+        taking it over as its lease expired. Raises ImportTakenOver then.
+        """
+        fields['updated'] = now()
+
+        if not SubscriptionImport.objects.filter(
+            pk=self.pk, status=self.status, updated=self.updated
+        ).update(**fields):
+            raise ImportTakenOver(self.pk)
+
+        for name, value in fields.items():
+            setattr(self, name, value)
+
+    @classmethod
+    def run_queue(cls):
+        """
+        Stage uploaded files and create subscriptions for confirmed imports,
+        as well as resume imports of workers which stopped updating them
+        for `NEWSLETTER_SUBMISSION_LEASE` seconds. Returns the number of
+        imports worked on.
+        """
+        expired = now() - timedelta(
+            seconds=newsletter_settings.SUBMISSION_LEASE
+        )
+        claimable = cls.objects.filter(
+            models.Q(status__in=(cls.PENDING, cls.CONFIRMED)) |
+            models.Q(status__in=(cls.PARSING, cls.INSERTING),
+                     updated__lt=expired)
+        ).exclude(
+            # Staged right away, e.g. by import_subscribers
+            status=cls.PENDING, address_file=''
+        ).order_by('pk')
+        count = 0
+
+        while True:
+            with transaction.atomic():
+                subscription_import = claimable.select_for_update(
+                    skip_locked=True
+                ).first()
+                if subscription_import is None:
+                    return count
+
+                if subscription_import.status in (cls.PENDING, cls.PARSING):
+                    subscription_import.status = cls.PARSING
+                else:
+                    subscription_import.status = cls.INSERTING
+                subscription_import.updated = now()
+                subscription_import.save(update_fields=['status', 'updated'])
+
+            subscription_import.run()
+            count += 1
+
+    def run(self):
+        """ Parse or insert the addresses, recording any failure. """
+        logger.info(gettext("Running %s"), self)
+
+        try:
+            if self.status == self.PARSING:
+                self.stage_file()
+            else:
+                self.confirm()
+
+        except ImportTakenOver:
+            logger.warning(
+                gettext("%s was taken over by another worker"), self
+            )
+        except ValidationError as e:
+            self.fail('; '.join(e.messages))
+        except Exception as e:
+            logger.exception(gettext("%s failed"), self)
+            self.fail(str(e))
+
+    def fail(self, error):
+        """ Mark the import failed, unless another process took it over. """
+        try:
+            self.save_state(status=self.FAILED, error=error)
+        except ImportTakenOver:
+            return
+
+        self.addresses.all().delete()
+        if self.address_file:
+            self.address_file.delete(save=False)
+            self.save_state(address_file='')
+
+    def add_addresses(self, addresses):
+        """
+        Stage (email, name) pairs in addresses, writing batches of
+        `NEWSLETTER_IMPORT_BATCH_SIZE`. Addresses staged before are
+        ignored.
+        """
+        batch_size = newsletter_settings.IMPORT_BATCH_SIZE
+        addresses = iter(addresses)
+
+        while batch := list(itertools.islice(addresses, batch_size)):
+            ImportedAddress.objects.bulk_create([
+                ImportedAddress(
+                    subscription_import=self, email=email, name=name
+                ) for email, name in batch
+            ], ignore_conflicts=True)
+
+    def get_staged_emails(self, emails):
+        """ Return the set of emails which have been staged already. """
+        return set(self.addresses.filter(
+            email__in=list(emails)
+        ).values_list('email', flat=True))
+
+    def confirm(self):
+        """
+        Create subscriptions for the staged addresses which are not
+        subscribed to the newsletter yet, using a single INSERT ... SELECT
+        statement, and remove the staged addresses. Returns the number of
+        subscriptions created.
+        """
+        connection = connections[ImportedAddress.objects.db]
+        qn = connection.ops.quote_name
+
+        def column(model, name):
+            return qn(model._meta.get_field(name).column)
+
+        subscription_table = qn(Subscription._meta.db_table)
+        address_table = qn(ImportedAddress._meta.db_table)
+        created = now()
+
+        sql = (
+            'INSERT INTO {subscription_table} ({newsletter}, {email}, '
+            '{name}, {activation_code}, {subscribed}, {unsubscribed}, '
+            '{subscribe_date}, {create_date}) '
+            'SELECT %s, address.{address_email}, address.{address_name}, '
+            'address.{address_activation_code}, %s, %s, %s, %s '
+            'FROM {address_table} address '
+            'WHERE address.{address_import} = %s AND NOT EXISTS ('
+            'SELECT 1 FROM {subscription_table} existing '
+            'WHERE existing.{newsletter} = %s '
+            'AND existing.{email} = address.{address_email} '
+            'AND existing.{subscribed} = %s) '
+            'ORDER BY address.{address_id}'
+        ).format(
+            subscription_table=subscription_table,
+            address_table=address_table,
+            newsletter=column(Subscription, 'newsletter'),
+            email=column(Subscription, 'email_field'),
+            name=column(Subscription, 'name_field'),
+            activation_code=column(Subscription, 'activation_code'),
+            subscribed=column(Subscription, 'subscribed'),
+            unsubscribed=column(Subscription, 'unsubscribed'),
+            subscribe_date=column(Subscription, 'subscribe_date'),
+            create_date=column(Subscription, 'create_date'),
+            address_id=column(ImportedAddress, 'id'),
+            address_email=column(ImportedAddress, 'email'),
+            address_name=column(ImportedAddress, 'name'),
+            address_activation_code=column(ImportedAddress, 'activation_code'),
+            address_import=column(ImportedAddress, 'subscription_import'),
+        )
+
+        with transaction.atomic(using=connection.alias):
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [
+                    self.newsletter_id, True, False, created, created,
+                    self.pk, self.newsletter_id, True
+                ])
+                count = cursor.rowcount
+
+            self.addresses.all().delete()
+
+            # Rolls back the subscriptions when taken over
+            self.save_state(inserted=count, status=self.DONE)
+
+        return count
+
+    def request_confirmation(self):
+        """
+        Leave creating the subscriptions to `submit_newsletter --jobs`,
+        returning whether the import was waiting for confirmation.
+        """
+        if not SubscriptionImport.objects.filter(
+            pk=self.pk, status=self.STAGED
+        ).update(status=self.CONFIRMED, updated=now()):
+            return False
+
+        self.status = self.CONFIRMED
+        notify_submitters(SubscriptionImport.objects.db)
+        return True
+
+    @classmethod
+    def delete_expired(cls):
+        """
+        Remove imports which haven't been confirmed, or finished, within a
+        day.
+        """
+        expired = cls.objects.filter(
+            created__lt=now() - timedelta(days=1),
+            status__in=(cls.STAGED, cls.DONE, cls.FAILED)
+        )
+
+        for subscription_import in expired:
+            if subscription_import.address_file:
+                subscription_import.address_file.delete(save=False)
+            subscription_import.delete()
+
+
+class ImportedAddress(models.Model):
+    """ Address staged by a SubscriptionImport. """
+    class Meta:
+        verbose_name = _('imported address')
+        verbose_name_plural = _('imported addresses')
+        unique_together = ('subscription_import', 'email')
+        ordering = ('pk',)
+
+    def __str__(self):
+        return get_address(self.name, self.email)
+
+    subscription_import = models.ForeignKey(
+        SubscriptionImport, verbose_name=_('subscription import'),
+        related_name='addresses', on_delete=models.CASCADE
+    )
+    email = models.EmailField(verbose_name=_('e-mail'))
+    name = models.CharField(
+        max_length=200, blank=True, null=True, verbose_name=_('name')
+    )
+    # Taken over by the subscription
+    activation_code = models.CharField(
+        verbose_name=_('activation code'), max_length=40,
+        default=make_activation_code
+    )
+
+
+class Recipient:
+    """
+    Read-only recipient of a submission, holding just what is needed to
+    send and render a message, in place of a full Subscription.
+    """
+
+    __slots__ = ('pk', 'name', 'email', 'activation_code', 'newsletter')
+
+    def __init__(self, pk, name, email, activation_code, newsletter):
+        for attr, value in zip(
+            self.__slots__, (pk, name, email, activation_code, newsletter)
+        ):
+            object.__setattr__(self, attr, value)
+
+    def __setattr__(self, attr, value):
+        raise AttributeError('Recipients are read-only.')
+
+    @property
+    def id(self):
+        return self.pk
+
+    @classmethod
+    def from_subscription(cls, subscription):
+        return cls(
+            subscription.pk, subscription.name, subscription.email,
+            subscription.activation_code, subscription.newsletter
+        )
+
+    @classmethod
+    def from_queryset(cls, subscriptions, newsletter=None):
+        """
+        Yield recipients for subscriptions, fetching only the required
+        columns `NEWSLETTER_SUBSCRIPTION_FETCH_SIZE` rows at a time.
+        Subscriptions are expected to mostly belong to `newsletter`.
+        """
+        newsletters = {newsletter.pk: newsletter} if newsletter else {}
+        rows = subscriptions.values_list(
+            'pk', 'name_field', 'email_field', 'activation_code',
+            'newsletter_id', 'user_id'
+        )
+
+        for batch in batches_by_pk(
+            rows, newsletter_settings.SUBSCRIPTION_FETCH_SIZE
+        ):
+            # Names of users depend on the user model
+            users = get_user_model().objects.in_bulk(
+                {row[5] for row in batch if row[5] is not None}
+            )
+            missing = {row[4] for row in batch} - newsletters.keys()
+            if missing:
+                newsletters.update(Newsletter.objects.in_bulk(missing))
+
+            for pk, name, email, code, newsletter_id, user_id in batch:
+                if user_id is not None:
+                    user = users[user_id]
+                    name, email = user.get_full_name(), user.email
+
+                yield cls(pk, name, email, code, newsletters[newsletter_id])
+
+    __str__ = Subscription.__str__
+    get_recipient = Subscription.get_recipient
+    subscribe_activate_url = Subscription.subscribe_activate_url
+    unsubscribe_activate_url = Subscription.unsubscribe_activate_url
+    update_activate_url = Subscription.update_activate_url
+
 
 class Article(models.Model):
     """
@@ -626,7 +1321,7 @@ class SubscriptionGenerator(ABC):
 
 
 def get_render_context(message=None, date=None, site=None, newsletter=None, submission=None, subscription=None,
-                       attachment_links=False):
+                       attachment_links=False, fragments=None):
     site = site or (submission and submission.get_site()) or Site.objects.get_current()
     site_http = 'https' if newsletter_settings.USE_HTTPS else 'http'
     return {
@@ -643,17 +1338,58 @@ def get_render_context(message=None, date=None, site=None, newsletter=None, subm
         'MEDIA_URL': settings.MEDIA_URL,
         'thumbnail_template': newsletter_settings.THUMBNAIL_TEMPLATE,
         'thumbnail_quality': newsletter_settings.THUMBNAIL_QUALITY,
+        'shared_fragments': fragments,
     }
 
 
-def render_message(message, date=None, site=None, submission=None, subscription=None, attachment_links=False):
+class _SubscriptionProbe:
+    """
+    Stand-in for a subscription while rendering, recording whether the
+    templates used it in any way.
+    """
+
+    def __init__(self):
+        self.used = False
+
+    def _use(self, *args, **kwargs):
+        self.used = True
+        return self
+
+    __getattr__ = __getitem__ = __call__ = _use
+
+    def __str__(self):
+        self.used = True
+        return ''
+
+    def __bool__(self):
+        self.used = True
+        return True
+
+    def __eq__(self, other):
+        self.used = True
+        return False
+
+    __hash__ = object.__hash__
+
+    def __iter__(self):
+        self.used = True
+        return iter(())
+
+    def __len__(self):
+        self.used = True
+        return 0
+
+
+def render_message(message, date=None, site=None, submission=None, subscription=None, attachment_links=False,
+                   fragments=None):
     context = get_render_context(
         message=message,
         date=date,
         site=site,
         submission=submission,
         subscription=subscription,
-        attachment_links=attachment_links
+        attachment_links=attachment_links,
+        fragments=fragments
     )
     subject = message.subject_template.render(context)
     text = message.text_template.render(context)
@@ -692,60 +1428,647 @@ class Submission(models.Model):
             ),
         }
 
-    def get_subscriptions(self) -> list[Subscription]:
-        subscriptions = list(self.subscriptions.filter(subscribed=True).all())
-        if subscription_generator := self.newsletter.get_subscription_generator():
-            already_subscribed = {s.email for s in subscriptions}
-            unsubscribed = {s.email for s in self.newsletter.subscription_set.filter(unsubscribed=True).all()}
-            dynamic_subscriptions = subscription_generator.generate_subscriptions(self.newsletter)
-            logger.info(
-                gettext("Dynamically generated %(count)d subscriptions"),
-                {'count': len(dynamic_subscriptions)}
-            )
-            for name, email in dynamic_subscriptions:
-                if email in already_subscribed or email in unsubscribed:
+    def iter_recipients(self):
+        """
+        Yield recipients for subscribed and dynamically generated
+        subscriptions, fetching them from the database
+        `NEWSLETTER_SUBSCRIPTION_FETCH_SIZE` at a time, so they are never
+        all kept in memory.
+        """
+        subscriptions = self.subscriptions.filter(subscribed=True)
+
+        yield from Recipient.from_queryset(subscriptions, self.newsletter)
+        for subscription in self.get_dynamic_subscriptions(subscriptions):
+            yield Recipient.from_subscription(subscription)
+
+    def get_dynamic_subscriptions(self, already_subscribed):
+        """
+        Yield unsaved subscriptions from the newsletter's subscription
+        generator, skipping those in the `already_subscribed` queryset as
+        well as unsubscribed ones. These are looked up in the database for
+        every batch of generated subscriptions.
+        """
+        subscription_generator = self.newsletter.get_subscription_generator()
+        if not subscription_generator:
+            return
+
+        unsubscribed = self.newsletter.subscription_set.filter(unsubscribed=True)
+        dynamic_subscriptions = iter(
+            subscription_generator.generate_subscriptions(self.newsletter)
+        )
+
+        # Only generated emails are remembered, to skip duplicates
+        generated = set()
+        while batch := list(itertools.islice(
+            dynamic_subscriptions, newsletter_settings.SUBSCRIPTION_FETCH_SIZE
+        )):
+            emails = [email for _, email in batch]
+            skipped = _get_existing_emails(already_subscribed, emails) | \
+                _get_existing_emails(unsubscribed, emails)
+
+            for name, email in batch:
+                if email in skipped or email in generated:
                     continue
-                subscriptions.append(
-                    Subscription(newsletter=self.newsletter, name=name, email=email, subscribed=True)
+                generated.add(email)
+                yield Subscription(
+                    newsletter=self.newsletter, name=name, email=email,
+                    subscribed=True
                 )
-                already_subscribed.add(email)
-        return subscriptions
 
-    def submit(self):
-        subscriptions = self.get_subscriptions()
         logger.info(
-            gettext("Submitting %(submission)s to %(count)d people"),
-            {'submission': self, 'count': len(subscriptions)}
+            gettext("Dynamically generated %(count)d subscriptions"),
+            {'count': len(generated)}
+        )
+
+    @classmethod
+    def claimable(cls):
+        """
+        Unsent submissions not being sent, or whose claim was not renewed
+        within `NEWSLETTER_SUBMISSION_LEASE` seconds.
+        """
+        expired = now() - timedelta(
+            seconds=newsletter_settings.SUBMISSION_LEASE
         )
+        return cls.objects.filter(sent=False).filter(
+            models.Q(sending=False) | models.Q(claimed_at__lt=expired)
+        )
+
+    def claim(self, worker):
+        """
+        Claim this submission for sending by worker. The conditional update
+        assures only a single worker succeeds. Returns whether it did.
+        """
+        claimed_at = now()
 
+        if not Submission.claimable().filter(pk=self.pk).update(
+            sending=True, claimed_by=worker, claimed_at=claimed_at
+        ):
+            return False
+
+        self.sending = True
+        self.claimed_by = worker
+        self.claimed_at = claimed_at
+        return True
+
+    def heartbeat(self):
+        """
+        Renew the claim on this submission, or on the chunk being sent,
+        while sending, at most every third of `NEWSLETTER_SUBMISSION_LEASE`
+        or `NEWSLETTER_CHUNK_LEASE`. Returns False when another worker took
+        over the claim, after which sending stops.
+        """
+        if self._claim_lost:
+            return False
+
+        if self._chunk is not None:
+            claim, claims, lease = (
+                self._chunk, SubmissionChunk.objects.filter(pk=self._chunk.pk),
+                newsletter_settings.CHUNK_LEASE
+            )
+        elif self.claimed_at is not None:
+            claim, claims, lease = (
+                self, Submission.objects.filter(pk=self.pk),
+                newsletter_settings.SUBMISSION_LEASE
+            )
+        else:
+            return True
+
+        current = now()
+        if current - claim.claimed_at < timedelta(seconds=lease / 3):
+            return True
+
+        claim.claimed_at = current
+        if not claims.filter(claimed_by=claim.claimed_by).update(
+            claimed_at=current
+        ):
+            self._claim_lost = self._interrupted = True
+            return False
+
+        return True
+
+    # Seconds between checks for queued activation emails while sending
+    ACTIVATION_EMAIL_INTERVAL = 1
+    _activation_emails_checked = 0
+
+    def send_activation_emails(self):
+        """
+        Send queued activation emails ahead of the rest of this submission,
+        checking for these at most every `ACTIVATION_EMAIL_INTERVAL`.
+        """
+        if not newsletter_settings.QUEUE_ACTIVATION_EMAILS:
+            return
+
+        current = time.monotonic()
+        if current - self._activation_emails_checked < \
+                self.ACTIVATION_EMAIL_INTERVAL:
+            return
+
+        self._activation_emails_checked = current
+        try:
+            ActivationEmail.send_queue()
+        except Exception:
+            # Don't let activation emails stop sending the submission
+            logger.exception(gettext('Sending activation emails failed'))
+
+    def release(self, sent):
+        """ Release the claim on this submission, marking it sent or not. """
+        submissions = Submission.objects.filter(pk=self.pk)
+        if not sent:
+            # Leave submissions taken over by other workers alone
+            submissions = submissions.filter(claimed_by=self.claimed_by)
+
+        submissions.update(
+            sent=sent, sending=False, claimed_by=None, claimed_at=None
+        )
+
+        self.sent = sent
+        self.sending = False
+        self.claimed_by = self.claimed_at = None
+
+    def submit(self, limit=None):
+        """
+        Send the submission to all recipients. When the optional
+        SendingLimit is reached, sending stops after the messages in flight
+        and SendingStopped is raised; the rest is sent on a next run.
+        """
         assert self.publish_date < now(), \
             'Something smells fishy; submission time in future.'
 
-        self.sending = True
-        self.save()
+        self._limit = limit
+
+        if not self.claim(get_worker_id()):
+            logger.info(
+                gettext("%(submission)s is already being sent"),
+                {'submission': self}
+            )
+            return
+
+        # Generated subscriptions are only known once sent to
+        if self.newsletter.subscription_generator_class:
+            log_message = gettext(
+                "Submitting %(submission)s to %(count)d subscribers and "
+                "generated subscriptions"
+            )
+        else:
+            log_message = gettext(
+                "Submitting %(submission)s to %(count)d subscribers"
+            )
+        logger.info(
+            log_message,
+            {'submission': self,
+             'count': self.subscriptions.filter(subscribed=True).count()}
+        )
+
+        sent = False
+        try:
+            results = self._send(self.iter_recipients())
+            sent = True
+
+        except ClaimLost:
+            logger.warning(
+                gettext("%(submission)s was taken over by another worker"),
+                {'submission': self}
+            )
+            return
+
+        finally:
+            self.release(sent)
+
+        self._log_results(results)
+
+    def create_chunks(self):
+        """
+        Split the recipients into chunks of `NEWSLETTER_CHUNK_SIZE`
+        subscriptions, unless this has been done already. Dynamically
+        generated recipients are kept in a single, separate chunk.
+        """
+        chunk_size = newsletter_settings.CHUNK_SIZE
+
+        try:
+            with transaction.atomic():
+                # Lock the submission, so chunks are only created once
+                Submission.objects.select_for_update().get(pk=self.pk)
+
+                if self.chunks.exists():
+                    return
+
+                chunks = []
+                first_id = last_id = None
+                subscription_ids = self.subscriptions.filter(
+                    subscribed=True
+                ).order_by('pk').values_list('pk', flat=True)
+
+                for idx, subscription_id in enumerate(subscription_ids.iterator()):
+                    if idx % chunk_size == 0 and first_id is not None:
+                        chunks.append(SubmissionChunk(
+                            submission=self, number=len(chunks),
+                            first_subscription_id=first_id,
+                            last_subscription_id=last_id
+                        ))
+                        first_id = None
+
+                    if first_id is None:
+                        first_id = subscription_id
+                    last_id = subscription_id
+
+                if first_id is not None:
+                    chunks.append(SubmissionChunk(
+                        submission=self, number=len(chunks),
+                        first_subscription_id=first_id,
+                        last_subscription_id=last_id
+                    ))
+
+                if self.newsletter.subscription_generator_class:
+                    chunks.append(SubmissionChunk(
+                        submission=self, number=len(chunks), dynamic=True
+                    ))
+
+                SubmissionChunk.objects.bulk_create(chunks)
+
+        except IntegrityError:
+            # Another worker created the chunks concurrently
+            logger.debug('Chunks for %s already created.', self)
+            return
+
+        logger.info(
+            gettext("Split %(submission)s into %(count)d chunks"),
+            {'submission': self, 'count': len(chunks)}
+        )
+
+    def claim_chunk(self, worker):
+        """
+        Claim the next unsent chunk, or one whose claim has expired after
+        `NEWSLETTER_CHUNK_LEASE` seconds. Returns None when no chunk is left,
+        or when the newsletter's `max_concurrent_chunks` are being sent.
+
+        Rows locked by other workers are skipped where the database supports
+        it; the conditional update assures no chunk is ever claimed twice.
+        """
+        expired = now() - timedelta(seconds=newsletter_settings.CHUNK_LEASE)
+        claimable = self.chunks.filter(sent=False).filter(
+            models.Q(claimed_at__isnull=True) | models.Q(claimed_at__lt=expired)
+        )
+        max_concurrent = self.newsletter.max_concurrent_chunks
+
+        while True:
+            with transaction.atomic():
+                if max_concurrent:
+                    # Count claims for the newsletter one worker at a time
+                    Newsletter.objects.select_for_update().filter(
+                        pk=self.newsletter_id
+                    ).exists()
+
+                    if SubmissionChunk.objects.filter(
+                        submission__newsletter_id=self.newsletter_id,
+                        sent=False, claimed_at__gte=expired
+                    ).count() >= max_concurrent:
+                        return None
+
+                chunk = claimable.select_for_update(
+                    skip_locked=True
+                ).order_by('number').first()
+
+                if chunk is None:
+                    return None
+
+                chunk.claimed_at = now()
+                chunk.claimed_by = worker
+
+                if claimable.filter(pk=chunk.pk).update(
+                    claimed_at=chunk.claimed_at, claimed_by=worker
+                ):
+                    return chunk
+
+    def submit_chunks(self, limit=None):
+        """
+        Claim and send chunks of this submission until none are left. Any
+        number of workers, possibly on different hosts, may do so at the
+        same time. Like `submit()`, sending ends with SendingStopped once
+        the optional SendingLimit is reached.
+        """
+        Submission.submit_interleaved([self], limit)
+
+    @classmethod
+    def submit_interleaved(cls, submissions, limit=None):
+        """
+        Like `submit_chunks()` for several submissions, taking turns between
+        them so large submissions don't hold up smaller ones. Every turn, a
+        chunk is sent for one of the submissions, chosen by smooth weighted
+        round-robin using the `weight` of their newsletters.
+        """
+        worker = get_worker_id()
+        results = {}
+        turns = []
+
+        for submission in submissions:
+            assert submission.publish_date < now(), \
+                'Something smells fishy; submission time in future.'
+
+            submission._limit = limit
+            submission.create_chunks()
+            Submission.objects.filter(pk=submission.pk).update(sending=True)
+
+            results[submission.pk] = []
+            turns.append([0, submission])
+
+        try:
+            while turns and not (limit is not None and limit.is_set()):
+                total = 0
+                for turn in turns:
+                    turn[0] += turn[1].newsletter.weight
+                    total += turn[1].newsletter.weight
+
+                turn = max(turns, key=lambda turn: turn[0])
+                turn[0] -= total
+                submission = turn[1]
+
+                chunk = submission.claim_chunk(worker)
+                if chunk is None:
+                    turns.remove(turn)
+                    continue
+
+                try:
+                    results[submission.pk].extend(
+                        submission._send_chunk(chunk, worker)
+                    )
+                except ClaimLost:
+                    logger.warning(
+                        gettext("Chunk %(number)d of %(submission)s was "
+                                "taken over by another worker"),
+                        {'number': chunk.number, 'submission': submission}
+                    )
+
+        finally:
+            for submission in submissions:
+                submission._log_results(results[submission.pk])
+
+        stopped = False
+        for submission in submissions:
+            if not submission.chunks.filter(sent=False).exists():
+                Submission.objects.filter(pk=submission.pk).update(
+                    sent=True, sending=False
+                )
+                submission.sent = True
+                submission.sending = False
+            elif submission._limit_reached():
+                stopped = True
+
+        if stopped:
+            raise SendingStopped
+
+    def _send_chunk(self, chunk, worker):
+        """ Send a claimed chunk, returning the results of `_send()`. """
+        logger.info(
+            gettext("Submitting chunk %(number)d of %(submission)s"),
+            {'number': chunk.number, 'submission': self}
+        )
+
+        self._chunk = chunk
+        try:
+            results = self._send(chunk.get_recipients())
+        except SendingStopped:
+            # Leave the rest of the chunk to any worker
+            SubmissionChunk.objects.filter(
+                pk=chunk.pk, claimed_by=worker
+            ).update(claimed_by=None, claimed_at=None)
+            raise
+        finally:
+            self._chunk = None
+
+        # Unless taken over, in which case the new owner marks it sent
+        SubmissionChunk.objects.filter(
+            pk=chunk.pk, claimed_by=worker
+        ).update(sent=True)
+
+        return results
+
+    @cached_property
+    def attachment_cache(self):
+        """
+        Attachments of the message, read from storage and encoded once for
+        all recipients.
+        """
+        cache = AttachmentCache(newsletter_settings.ATTACHMENT_MEMORY_LIMIT)
+
+        for attachment in self.message.attachments.all():
+            with attachment.file.open('rb') as f:
+                cache.add(attachment.file.name, f, attachment.file.size)
+
+        return cache
+
+    @cached_property
+    def shared_rendering(self):
+        """
+        Subject, text and HTML rendered once for all recipients, or None
+        when the message is personalized.
+
+        Unless the newsletter declares whether it is personalized, the
+        message is rendered with a stand-in subscription, which tells
+        whether the templates refer to the subscription at all.
+        """
+        personalized = self.newsletter.personalized
+        if personalized:
+            return None
+
+        probe = _SubscriptionProbe() if personalized is None else None
+        try:
+            rendered = render_message(
+                self.message,
+                date=self.publish_date,
+                submission=self,
+                subscription=probe,
+                fragments=self.shared_fragments
+            )
+        except Exception:
+            if probe is None:
+                raise
+
+            # Filters may fail on the stand-in, e.g. dates of the
+            # subscription; render for every recipient instead.
+            logger.debug(
+                'Message for %s could not be rendered without a '
+                'subscription.', self, exc_info=True
+            )
+            return None
+
+        if probe is not None and probe.used:
+            logger.debug('Message for %s is personalized.', self)
+            return None
+
+        return rendered
+
+    @cached_property
+    def shared_fragments(self):
+        """
+        Parts of the message enclosed in `{% shared %}` blocks, rendered
+        once for all recipients.
+        """
+        return {}
+
+    def _send(self, subscriptions):
+        """
+        Send messages to subscriptions in the configured way, returning a
+        list with results (see `_send_batch()`).
+        """
+        # Load articles, attachments and shared rendering before workers
+        # share them, so templates don't query them for every recipient.
+        models.prefetch_related_objects([self.message], 'articles', 'attachments')
 
+        self._interrupted = self._claim_lost = False
         try:
+            self.attachment_cache
+            self.shared_fragments
+            self.shared_rendering
+
+            results = self._dispatch(subscriptions)
+        finally:
+            attachment_cache = self.__dict__.pop('attachment_cache', None)
+            if attachment_cache is not None:
+                attachment_cache.close()
+            self.__dict__.pop('shared_rendering', None)
+            self.__dict__.pop('shared_fragments', None)
+
+        if self._interrupted:
+            self._log_results(results)
+            raise ClaimLost if self._claim_lost else SendingStopped
+        return results
+
+    _limit = None
+    _interrupted = False
+    _claim_lost = False
+    _chunk = None
+
+    def _limit_reached(self):
+        return self._limit is not None and self._limit.is_set()
+
+    def _may_send(self):
+        """
+        Whether another message may be sent within the sending limit,
+        counting it if so.
+        """
+        if self._limit is None or self._limit.take():
+            return True
+
+        self._interrupted = True
+        return False
+
+    def _dispatch(self, subscriptions):
+        workers = newsletter_settings.SEND_WORKERS
+
+        # A single limiter is shared by all workers
+        rate_limiter = RateLimiter.from_settings()
+
+        if newsletter_settings.ASYNC_CONCURRENCY:
+            return [self._send_async(subscriptions, rate_limiter)]
+
+        if workers > 1:
+            # Workers share a ledger, flushed even when one of them fails
+            with DeliveryLedger(self) as ledger:
+                results, errors = run_workers(
+                    functools.partial(
+                        self._send_batch,
+                        rate_limiter=rate_limiter, ledger=ledger
+                    ),
+                    ledger.pending(subscriptions), workers
+                )
+            if errors:
+                self._log_results(results)
+                raise errors[0]
+            return results
+
+        return [self._send_batch(subscriptions, rate_limiter)]
+
+    def _send_batch(self, subscriptions, rate_limiter=None, ledger=None):
+        """
+        Send messages to subscriptions over a single reusable connection,
+        at the pace allowed by the optional rate limiter. Deliveries are
+        recorded in the given ledger, which is expected to have filtered
+        subscriptions already, or in a ledger of its own.
+        Returns a dictionary with the amount of messages sent, connections
+        opened and a list of failed subscriptions.
+        """
+        connection = ReusableConnection(
+            max_messages=newsletter_settings.MAX_MESSAGES_PER_CONNECTION
+        )
+        if ledger is None:
+            ledger = DeliveryLedger(self)
+            subscriptions = ledger.pending(subscriptions)
+        failed = []
+
+        with connection, ledger:
             for idx, subscription in enumerate(subscriptions, start=1):
-                if hasattr(settings, 'NEWSLETTER_EMAIL_DELAY'):
-                    time.sleep(settings.NEWSLETTER_EMAIL_DELAY)
+                if not self.heartbeat() or not self._may_send():
+                    break
+                self.send_activation_emails()
+                if rate_limiter is not None:
+                    rate_limiter.acquire()
                 if hasattr(settings, 'NEWSLETTER_BATCH_SIZE') and settings.NEWSLETTER_BATCH_SIZE > 0:
                     if idx % settings.NEWSLETTER_BATCH_SIZE == 0:
+                        # Don't keep an idle connection open while waiting
+                        connection.close()
                         time.sleep(settings.NEWSLETTER_BATCH_DELAY)
-                self.send_message(subscription)
-            self.sent = True
+                if not self.send_message(
+                    subscription, connection=connection, ledger=ledger
+                ):
+                    failed.append(subscription)
 
-        finally:
-            self.sending = False
-            self.save()
+        return {
+            'sent': connection.messages_sent,
+            'connections': connection.connections_opened,
+            'failed': failed,
+        }
 
-    def get_message(self, subscription):
-        subject, text, html = render_message(
-            self.message,
-            date=self.publish_date,
-            submission=self,
-            subscription=subscription
+    def _send_async(self, subscriptions, rate_limiter=None):
+        """
+        Send messages to subscriptions from an asyncio event loop, keeping
+        up to `NEWSLETTER_ASYNC_CONCURRENCY` SMTP transactions in flight.
+        The optional rate limiter paces rendering, thereby sending.
+        """
+        def render(pending):
+            for subscription in pending:
+                if not self.heartbeat() or not self._may_send():
+                    break
+                self.send_activation_emails()
+                if rate_limiter is not None:
+                    rate_limiter.acquire()
+                yield subscription, self.get_message(subscription)
+
+        with DeliveryLedger(self) as ledger:
+            return send_async(
+                render(ledger.pending(subscriptions)),
+                concurrency=newsletter_settings.ASYNC_CONCURRENCY,
+                timeout=newsletter_settings.ASYNC_TIMEOUT,
+                on_result=ledger.record
+            )
+
+    def _log_results(self, results):
+        logger.info(
+            gettext("Sent %(sent)d messages for %(submission)s "
+                    "over %(connections)d connection(s)"),
+            {'sent': sum(result['sent'] for result in results),
+             'submission': self,
+             'connections': sum(result['connections'] for result in results)}
         )
 
+        failed = sum(len(result['failed']) for result in results)
+        if failed:
+            logger.error(
+                gettext("%(count)d messages for %(submission)s failed"),
+                {'count': failed, 'submission': self}
+            )
+
+    def get_message(self, subscription):
+        rendered = self.shared_rendering
+        if rendered is None:
+            rendered = render_message(
+                self.message,
+                date=self.publish_date,
+                submission=self,
+                subscription=subscription,
+                fragments=self.shared_fragments
+            )
+        subject, text, html = rendered
+
         message = EmailMultiAlternatives(
             subject, text,
             from_email=self.newsletter.get_sender(),
@@ -753,18 +2076,14 @@ class Submission(models.Model):
             headers=self.extra_headers,
         )
 
-        attachments = Attachment.objects.filter(message_id=self.message.id)
-
-        for attachment in attachments:
-            with attachment.file.open('rb') as f:
-                content = f.read()
-                message.attach(attachment.file.name, content)
+        for part in self.attachment_cache.parts():
+            message.attach(part)
 
         if html:
             message.attach_alternative(html, "text/html")
         return message
 
-    def send_message(self, subscription):
+    def send_message(self, subscription, connection=None, ledger=None):
         logger.debug(
             gettext('Submitting message to: %s.'),
             subscription
@@ -772,25 +2091,60 @@ class Submission(models.Model):
 
         message = self.get_message(subscription)
         try:
-            message.send()
+            if connection is None:
+                message.send()
+            else:
+                connection.send(message)
         except Exception as e:
-            # TODO: Test coverage for this branch.
             logger.error(
                 gettext('Message %(subscription)s failed '
                         'with error: %(error)s'),
                 {'subscription': subscription,
                  'error': e}
             )
+            if ledger is not None:
+                ledger.record(subscription, e)
+            return False
+
+        if ledger is not None:
+            ledger.record(subscription)
+        return True
 
     @classmethod
-    def submit_queue(cls):
-        todo = cls.objects.filter(
-            prepared=True, sent=False, sending=False,
+    def submit_queue(cls, limit=None, queryset=None):
+        """
+        Send all submissions which are due, or those in queryset, until the
+        optional SendingLimit is reached.
+        """
+        if queryset is None:
+            queryset = cls.objects.all()
+
+        todo = queryset.filter(
+            prepared=True, sent=False,
             publish_date__lt=now()
         )
 
-        for submission in todo:
-            submission.submit()
+        if newsletter_settings.QUEUE_ACTIVATION_EMAILS:
+            try:
+                ActivationEmail.send_queue()
+            except Exception:
+                logger.exception(gettext('Sending activation emails failed'))
+
+        try:
+            if newsletter_settings.CHUNK_SIZE:
+                # Chunks are claimed one by one, so join submissions which
+                # other workers are already sending.
+                cls.submit_interleaved(
+                    list(todo.select_related('newsletter')), limit
+                )
+            else:
+                for submission in todo & Submission.claimable():
+                    submission.submit(limit)
+
+        except SendingStopped:
+            logger.info(gettext(
+                "Sending stopped, remaining messages will be sent later"
+            ))
 
     @classmethod
     def from_message(cls, message, site=None):
@@ -895,6 +2249,266 @@ class Submission(models.Model):
         db_index=True, editable=False
     )
 
+    claimed_by = models.CharField(
+        max_length=200, blank=True, null=True, editable=False,
+        verbose_name=_('claimed by')
+    )
+    claimed_at = models.DateTimeField(
+        blank=True, null=True, editable=False, verbose_name=_('claimed at')
+    )
+
+
+# PostgreSQL channel notified when submissions, activation emails,
+# subscription jobs or imports are queued
+SUBMISSION_CHANNEL = 'newsletter_submission'
+
+
+def notify_submitters(using):
+    """ Wake up submit_newsletter daemons listening on PostgreSQL. """
+    connection = connections[using]
+
+    if connection.vendor == 'postgresql':
+        # Delivered when the transaction commits
+        with connection.cursor() as cursor:
+            cursor.execute('NOTIFY %s' % SUBMISSION_CHANNEL)
+
+
+def submission_postsave(sender, instance, using, **kwargs):
+    if instance.prepared and not instance.sent:
+        notify_submitters(using)
+
+
+def queued_postsave(sender, instance, created, using, **kwargs):
+    if created:
+        notify_submitters(using)
+
+
+models.signals.post_save.connect(submission_postsave, Submission)
+models.signals.post_save.connect(queued_postsave, ActivationEmail)
+models.signals.post_save.connect(queued_postsave, SubscriptionJob)
+models.signals.post_save.connect(queued_postsave, SubscriptionImport)
+
+
+class SubmissionChunk(models.Model):
+    """
+    Part of the recipients of a Submission, which is claimed and sent as a
+    whole by one of possibly several workers.
+    """
+    class Meta:
+        verbose_name = _('submission chunk')
+        verbose_name_plural = _('submission chunks')
+        unique_together = ('submission', 'number')
+        ordering = ('number',)
+
+    def __str__(self):
+        return _("Chunk %(number)d of %(submission)s") % {
+            'number': self.number,
+            'submission': self.submission
+        }
+
+    def get_recipients(self):
+        subscriptions = self.submission.subscriptions.filter(subscribed=True)
+
+        if self.dynamic:
+            return (
+                Recipient.from_subscription(subscription)
+                for subscription in
+                self.submission.get_dynamic_subscriptions(subscriptions)
+            )
+
+        return list(Recipient.from_queryset(subscriptions.filter(
+            pk__range=(self.first_subscription_id, self.last_subscription_id)
+        ), self.submission.newsletter))
+
+    submission = models.ForeignKey(
+        Submission, verbose_name=_('submission'), related_name='chunks',
+        on_delete=models.CASCADE
+    )
+    number = models.PositiveIntegerField(verbose_name=_('number'))
+
+    # Range of subscription id's (inclusive) within the submission
+    first_subscription_id = models.BigIntegerField(null=True, blank=True)
+    last_subscription_id = models.BigIntegerField(null=True, blank=True)
+
+    dynamic = models.BooleanField(
+        default=False, verbose_name=_('dynamic'),
+        help_text=_('Contains the dynamically generated recipients.')
+    )
+
+    claimed_by = models.CharField(
+        max_length=200, blank=True, null=True, verbose_name=_('claimed by')
+    )
+    claimed_at = models.DateTimeField(
+        blank=True, null=True, verbose_name=_('claimed at')
+    )
+    sent = models.BooleanField(
+        default=False, verbose_name=_('sent'), db_index=True
+    )
+
+
+class Delivery(models.Model):
+    """
+    Outcome of sending a Submission to a single recipient, allowing
+    interrupted submissions to be resumed without sending twice.
+    """
+    SENT = 'sent'
+    FAILED = 'failed'
+    STATUS_CHOICES = (
+        (SENT, _('sent')),
+        (FAILED, _('failed')),
+    )
+
+    class Meta:
+        verbose_name = _('delivery')
+        verbose_name_plural = _('deliveries')
+        unique_together = ('submission', 'email')
+        indexes = [
+            models.Index(fields=['submission', 'status']),
+        ]
+
+    def __str__(self):
+        return _("%(submission)s to %(email)s: %(status)s") % {
+            'submission': self.submission,
+            'email': self.email,
+            'status': self.get_status_display()
+        }
+
+    submission = models.ForeignKey(
+        Submission, verbose_name=_('submission'), related_name='deliveries',
+        on_delete=models.CASCADE
+    )
+    # Empty for dynamically generated recipients
+    subscription = models.ForeignKey(
+        Subscription, verbose_name=_('subscription'), blank=True, null=True,
+        on_delete=models.SET_NULL
+    )
+    email = models.EmailField(verbose_name=_('e-mail'))
+
+    status = models.CharField(
+        max_length=10, choices=STATUS_CHOICES, verbose_name=_('status')
+    )
+    attempts = models.PositiveIntegerField(
+        default=0, verbose_name=_('attempts')
+    )
+    error = models.TextField(blank=True, verbose_name=_('error'))
+
+    first_attempt = models.DateTimeField(
+        default=now, verbose_name=_('first attempt')
+    )
+    last_attempt = models.DateTimeField(
+        default=now, verbose_name=_('last attempt')
+    )
+
+
+class DeliveryLedger:
+    """
+    Keeps track of deliveries for a submission, writing them in batches of
+    `NEWSLETTER_DELIVERY_BATCH_SIZE`. Does nothing when
+    `NEWSLETTER_TRACK_DELIVERIES` is disabled.
+
+    Sending threads may share a ledger; lookups and writes are done one
+    at a time, as SQLite locks tables being written to.
+    """
+
+    def __init__(self, submission):
+        self.submission = submission
+        self.enabled = newsletter_settings.TRACK_DELIVERIES
+        self.batch_size = newsletter_settings.DELIVERY_BATCH_SIZE
+
+        self._previous = {}
+        self._pending = []
+        self._lock = threading.RLock()
+
+    def pending(self, subscriptions):
+        """
+        Yield subscriptions which have not been delivered to before,
+        looking up earlier deliveries a batch at a time.
+        """
+        if not self.enabled:
+            yield from subscriptions
+            return
+
+        iterator = iter(subscriptions)
+        while batch := list(itertools.islice(iterator, self.batch_size)):
+            with self._lock:
+                previous = {
+                    delivery.email: delivery
+                    for delivery in Delivery.objects.filter(
+                        submission=self.submission,
+                        email__in=[s.email for s in batch]
+                    ).only('email', 'status', 'attempts')
+                }
+
+            for subscription in batch:
+                delivery = previous.get(subscription.email)
+
+                if delivery is None:
+                    yield subscription
+                elif delivery.status == Delivery.SENT:
+                    logger.debug(
+                        'Skipping %s, already delivered.', subscription
+                    )
+                else:
+                    with self._lock:
+                        self._previous[subscription.email] = delivery
+                    yield subscription
+
+    def record(self, subscription, error=None):
+        """ Record sending a message to subscription, with optional error. """
+        if not self.enabled:
+            return
+
+        with self._lock:
+            delivery = self._previous.pop(subscription.email, None)
+        if delivery is None:
+            delivery = Delivery(
+                submission=self.submission,
+                subscription_id=subscription.pk,
+                email=subscription.email
+            )
+
+        delivery.status = Delivery.FAILED if error else Delivery.SENT
+        delivery.error = str(error) if error else ''
+        delivery.attempts += 1
+        delivery.last_attempt = now()
+
+        with self._lock:
+            self._pending.append(delivery)
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+
+    def flush(self):
+        """ Write recorded deliveries to the database. """
+        with self._lock:
+            if not self._pending:
+                return
+
+            Delivery.objects.bulk_create(
+                [d for d in self._pending if d.pk is None],
+                ignore_conflicts=True
+            )
+            Delivery.objects.bulk_update(
+                [d for d in self._pending if d.pk is not None],
+                ['status', 'error', 'attempts', 'last_attempt']
+            )
+
+            self._pending = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+
+
+def _get_existing_emails(subscriptions, emails):
+    """ Return the set of emails for which subscriptions has a match. """
+    matches = subscriptions.filter(
+        models.Q(email_field__in=emails) | models.Q(user__email__in=emails)
+    ).values_list('email_field', 'user__email')
+
+    return {user_email or email for email, user_email in matches}
+
 
 def get_address(name, email):
     return formataddr((name, email)) if name else email
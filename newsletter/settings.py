@@ -74,6 +74,25 @@ class NewsletterSettings(Settings):
     DEFAULT_CONFIRM_EMAIL = True
     DEFAULT_THUMBNAIL_QUALITY = 95
     DEFAULT_VALIDATE_NO_USER = True
+    DEFAULT_MAX_MESSAGES_PER_CONNECTION = None
+    DEFAULT_SEND_WORKERS = 1
+    DEFAULT_ASYNC_CONCURRENCY = None
+    DEFAULT_ASYNC_TIMEOUT = 60
+    DEFAULT_CHUNK_SIZE = None
+    DEFAULT_CHUNK_LEASE = 3600
+    DEFAULT_SUBMISSION_LEASE = 3600
+    DEFAULT_TRACK_DELIVERIES = True
+    DEFAULT_DELIVERY_BATCH_SIZE = 100
+    DEFAULT_RATE_LIMIT = None
+    DEFAULT_RATE_LIMIT_BURST = 1
+    DEFAULT_RATE_LIMIT_CACHE = None
+    DEFAULT_ATTACHMENT_MEMORY_LIMIT = 20 * 1024 * 1024
+    DEFAULT_SUBSCRIPTION_FETCH_SIZE = 1000
+    DEFAULT_QUEUE_ACTIVATION_EMAILS = False
+    DEFAULT_BULK_ACTION_THRESHOLD = None
+    DEFAULT_IMPORT_BATCH_SIZE = 1000
+    DEFAULT_IMPORT_IN_BACKGROUND = False
+    DEFAULT_IMPORT_STORAGE = None
 
     @property
     def DEFAULT_CONFIRM_EMAIL_SUBSCRIBE(self):
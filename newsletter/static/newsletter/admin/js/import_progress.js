@@ -0,0 +1,30 @@
+var ImportProgress = {
+    init: function(url, status) {
+        ImportProgress.url = url;
+        ImportProgress.status = status;
+        ImportProgress.poll();
+    },
+
+    poll: function() {
+        var request = new XMLHttpRequest();
+        request.open("GET", ImportProgress.url, true);
+        request.onreadystatechange = function() {
+            if (request.readyState == 4 && request.status == 200) {
+                var progress = JSON.parse(request.responseText);
+
+                if (progress.status != ImportProgress.status) {
+                    // Reload to show the actions for the new status.
+                    window.location.reload();
+                    return;
+                }
+
+                var fields = ['status_display', 'rows', 'rejected', 'staged', 'inserted'];
+                for (var i = 0; i < fields.length; i++) {
+                    document.getElementById('import_' + fields[i]).textContent = progress[fields[i]];
+                }
+                window.setTimeout(ImportProgress.poll, 2000);
+            }
+        };
+        request.send(null);
+    }
+};
@@ -0,0 +1,65 @@
+from django import template
+
+register = template.Library()
+
+# Variables of the message context which are the same for every recipient,
+# see newsletter.models.get_render_context().
+SHARED_CONTEXT = (
+    'message', 'newsletter', 'submission', 'site', 'site_http', 'site_url',
+    'date', 'attachment_links', 'STATIC_URL', 'MEDIA_URL',
+    'thumbnail_template', 'thumbnail_quality', 'shared_fragments',
+)
+
+
+class SharedNode(template.Node):
+    """
+    Renders its contents without the subscription, once for all messages
+    of a submission.
+    """
+
+    def __init__(self, nodelist):
+        self.nodelist = nodelist
+
+    def render(self, context):
+        fragments = context.get('shared_fragments')
+
+        # Within loops, every iteration renders differently.
+        if fragments is None or 'forloop' in context:
+            with context.push(subscription=None):
+                return self.nodelist.render(context)
+
+        key = (self.origin.name, self.token.position)
+        try:
+            return fragments[key]
+        except KeyError:
+            pass
+
+        # Variables set outside of the block, e.g. by {% with %}, may
+        # depend on the subscription; leave them out of the fragment.
+        shared_context = context.new({
+            name: context[name] for name in SHARED_CONTEXT if name in context
+        })
+        fragment = fragments[key] = self.nodelist.render(shared_context)
+        return fragment
+
+
+@register.tag
+def shared(parser, token):
+    """
+    Render the enclosed part of a message once per submission, instead of
+    once for every subscription. Within the block, only variables which
+    are the same for every subscription are available; not the
+    subscription, nor variables set outside of the block.
+
+    Usage::
+
+        {% load newsletter_tags %}
+        Dear {{ subscription.name }},
+        {% shared %}
+            {% for article in message.articles.all %}...{% endfor %}
+        {% endshared %}
+    """
+    nodelist = parser.parse(('endshared',))
+    parser.delete_first_token()
+
+    return SharedNode(nodelist)
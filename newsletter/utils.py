@@ -1,5 +1,8 @@
 """ Generic helper functions """
 
+import os
+import socket
+
 from django.contrib.sites.models import Site
 from django.utils.crypto import get_random_string
 
@@ -19,6 +22,29 @@ def get_default_sites():
     return [site.id for site in Site.objects.all()]
 
 
+def batches_by_pk(queryset, batch_size):
+    """
+    Yield lists of at most `batch_size` objects from queryset, ordered by
+    primary key. Every batch continues after the last primary key seen, so
+    no cursor is kept open while objects are used. For values_list()
+    querysets, the primary key should be the first field.
+    """
+    queryset = queryset.order_by('pk')
+    batch = list(queryset[:batch_size])
+
+    while batch:
+        yield batch
+
+        last = batch[-1]
+        last_pk = last[0] if isinstance(last, tuple) else last.pk
+        batch = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+
+
+def get_worker_id():
+    """ Identify the current process, across hosts. """
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+
 class Singleton(type):
     """
     Singleton metaclass.
@@ -432,8 +432,15 @@ class ActionRequestView(ActionFormView):
             # Confirmation email for this action was switched off in settings.
             return self.no_email_confirm(form)
 
+        site = get_current_site(self.request)
+
+        if newsletter_settings.QUEUE_ACTIVATION_EMAILS:
+            # Sent by submit_newsletter, ahead of any submissions
+            self.subscription.queue_activation_email(self.action, site=site)
+            return super().form_valid(form)
+
         try:
-            self.subscription.send_activation_email(self.action, site=get_current_site(self.request))
+            self.subscription.send_activation_email(self.action, site=site)
 
         except (SMTPException, OSError) as e:
             logger.exception(
@@ -1,5 +1,9 @@
+import codecs
+import io
 import os
+import shutil
 import sys
+import tempfile
 import django
 from importlib import reload
 from unittest.mock import patch, MagicMock, PropertyMock
@@ -8,12 +12,28 @@ from django.contrib import admin as django_admin
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Permission
 from django.contrib.sites.models import Site
-from django.test import TestCase
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files.storage import (
+    FileSystemStorage, default_storage, storages
+)
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils.timezone import now
 
 from newsletter import admin  # Triggers model admin registration
+from newsletter.addressimport.parsers import (
+    get_encoding, get_samples, is_utf8, iter_csv
+)
 from newsletter.admin_utils import make_subscription
-from newsletter.models import Message, Newsletter, Submission, Subscription, Attachment, attachment_upload_to
+from newsletter.models import (
+    Message, Newsletter, Submission, Subscription, SubscriptionJob, SubscriptionImport,
+    ImportedAddress, ImportTakenOver, Attachment, Delivery,
+    attachment_upload_to, get_import_storage
+)
 
 test_files_dir = os.path.join(os.path.dirname(__file__), 'files')
 
@@ -141,6 +161,42 @@ class AdminTestCase(AdminTestMixin, TestCase):
         })
         self.assertFalse(Subscription.objects.get(name_field='Sara').subscribed)
 
+    @override_settings(NEWSLETTER_BULK_ACTION_THRESHOLD=1)
+    def test_subscription_admin_background(self):
+        """ Large selections are (un)subscribed in the background. """
+        subscriptions = Subscription.objects.bulk_create([
+            Subscription(
+                newsletter=self.newsletter, email_field='%s@example.org' % name
+            ) for name in ('sara', 'bob')
+        ])
+
+        changelist_url = reverse('admin:newsletter_subscription_changelist')
+        response = self.client.post(changelist_url, data={
+            'index': 0,
+            'action': ['make_subscribed'],
+            '_selected_action': [str(s.pk) for s in subscriptions],
+        }, follow=True)
+
+        job = SubscriptionJob.objects.get()
+        self.assertContains(
+            response, '2 users will be subscribed in the background.'
+        )
+        self.assertContains(
+            response,
+            reverse('admin:newsletter_subscriptionjob_change', args=[job.pk])
+        )
+        self.assertFalse(Subscription.objects.filter(subscribed=True).exists())
+
+        SubscriptionJob.run_queue()
+
+        self.assertEqual(Subscription.objects.filter(subscribed=True).count(), 2)
+
+        response = self.client.get(
+            reverse('admin:newsletter_subscriptionjob_change', args=[job.pk])
+        )
+        self.assertContains(response, '2 of 2')
+        self.assertContains(response, 'done')
+
     def test_admin_import_get_form(self):
         """ Test Import form. """
 
@@ -157,6 +213,36 @@ class AdminTestCase(AdminTestMixin, TestCase):
         )
         self.assertEqual(self.newsletter.subscription_set.count(), 2)
 
+    @override_settings(NEWSLETTER_IMPORT_BATCH_SIZE=1)
+    def test_admin_import_subscribers_batches(self):
+        """
+        Imported addresses are staged in batches, and copied into
+        subscriptions at once.
+        """
+        with CaptureQueriesContext(connection) as queries:
+            self.admin_import_subscribers('addresses.csv')
+
+        def count_inserts(table):
+            return len([
+                q['sql'] for q in queries.captured_queries
+                if q['sql'].startswith('INSERT') and
+                'INTO %s ' % connection.ops.quote_name(table) in q['sql']
+            ])
+
+        self.assertEqual(count_inserts('newsletter_importedaddress'), 2)
+        self.assertEqual(count_inserts('newsletter_subscription'), 1)
+        self.assertFalse(ImportedAddress.objects.exists())
+
+        for subscription in self.newsletter.subscription_set.all():
+            self.assertTrue(subscription.subscribed)
+            self.assertFalse(subscription.unsubscribed)
+            self.assertTrue(subscription.subscribe_date)
+            self.assertEqual(len(subscription.activation_code), 40)
+
+        self.assertEqual(len(set(self.newsletter.subscription_set.values_list(
+            'activation_code', flat=True
+        ))), 2)
+
     def test_admin_import_subscribers_ldif(self):
         response = self.admin_import_subscribers('addresses.ldif')
 
@@ -190,6 +276,35 @@ class AdminTestCase(AdminTestMixin, TestCase):
         self.assertEqual(len(messages.output), 2)
         self.assertEqual(self.newsletter.subscription_set.count(), 2)
 
+    @patch.object(SubscriptionImport, 'MAX_REJECTIONS', 1)
+    def test_admin_import_subscribers_rejections(self):
+        """ The first reasons for skipping entries are shown. """
+        with self.assertLogs('newsletter.addressimport.parsers', 'WARNING'):
+            response = self.admin_import_file(
+                'addresses_duplicates.csv', ignore_errors='true'
+            )
+
+        subscription_import = SubscriptionImport.objects.get()
+        self.assertEqual(subscription_import.rejected, 2)
+        self.assertEqual(subscription_import.rejections, [
+            "The address file contains duplicate entries for "
+            "'john@example.org'."
+        ])
+
+        progress_response = self.client.get(reverse(
+            'admin:newsletter_subscription_import_progress',
+            args=[subscription_import.pk]
+        ))
+        for response in (response, progress_response):
+            self.assertContains(
+                response,
+                "<li>The address file contains duplicate entries for "
+                "&#x27;john@example.org&#x27;.</li>", html=True
+            )
+            self.assertContains(
+                response, "Only the first skipped entry is listed."
+            )
+
     def test_admin_import_subscribers_existing(self):
         """ Test importing already existing subscriptions. """
 
@@ -218,6 +333,221 @@ class AdminTestCase(AdminTestMixin, TestCase):
         self.assertEqual(len(messages.output), 1)
         self.assertEqual(self.newsletter.subscription_set.count(), 2)
 
+    def test_admin_import_subscribers_existing_queries(self):
+        """ Existing subscriptions are looked up once per batch. """
+        make_subscription(self.newsletter, 'john@example.org').save()
+
+        def count_lookups(**settings):
+            with override_settings(**settings), \
+                    CaptureQueriesContext(connection) as queries:
+                with self.assertLogs('newsletter.addressimport.parsers', 'WARNING'):
+                    self.admin_import_file('addresses.csv', ignore_errors='true')
+
+            return len([
+                q['sql'] for q in queries.captured_queries
+                if q['sql'].startswith('SELECT') and
+                connection.ops.quote_name('email') + ' IN' in q['sql'] and
+                connection.ops.quote_name('newsletter_subscription') in q['sql']
+            ])
+
+        self.assertEqual(count_lookups(), 1)
+        self.assertEqual(count_lookups(NEWSLETTER_IMPORT_BATCH_SIZE=1), 2)
+
+    def test_admin_import_subscribers_staged(self):
+        """ Addresses are staged in the database, not in the session. """
+        self.admin_import_file('addresses.csv')
+
+        subscription_import = SubscriptionImport.objects.get()
+        self.assertEqual(subscription_import.rows, 2)
+        self.assertEqual(
+            list(subscription_import.addresses.values_list('email', flat=True)),
+            ['john@example.org', 'jill@example.org']
+        )
+        self.assertEqual(
+            self.client.session['subscription_import_pk'],
+            subscription_import.pk
+        )
+        self.assertNotIn('addresses', self.client.session)
+
+        # Subscribed in the meantime
+        make_subscription(self.newsletter, 'john@example.org').save()
+
+        response = self.client.post(
+            reverse('admin:newsletter_subscription_import_confirm'),
+            {'confirm': True}, follow=True
+        )
+
+        self.assertContains(
+            response, "1 subscription has been successfully added."
+        )
+        self.assertEqual(self.newsletter.subscription_set.count(), 2)
+
+        subscription_import.refresh_from_db()
+        self.assertEqual(subscription_import.status, SubscriptionImport.DONE)
+        self.assertEqual(subscription_import.inserted, 1)
+        self.assertFalse(subscription_import.addresses.exists())
+
+    def test_admin_import_subscribers_confirm_page(self):
+        """ The confirmation shows counts and a page of addresses. """
+        with patch.object(admin.SubscriptionAdmin, 'list_per_page', 1):
+            response = self.admin_import_file('addresses.csv')
+
+            self.assertContains(
+                response, "2 addresses will be imported into Test Newsletter."
+            )
+            self.assertContains(
+                response, "<li>John Smith &lt;john@example.org&gt;</li>"
+            )
+            self.assertNotContains(response, "jill@example.org")
+
+            response = self.client.get(
+                reverse('admin:newsletter_subscription_import_confirm'),
+                {'page': 2}
+            )
+            self.assertContains(
+                response, "<li>Jill Martin &lt;jill@example.org&gt;</li>"
+            )
+            self.assertContains(response, "Page 2 of 2")
+
+    def patch_import_storage(self):
+        """ Store uploaded import files in a temporary directory. """
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+
+        patcher = patch.object(
+            SubscriptionImport._meta.get_field('address_file'), 'storage',
+            FileSystemStorage(location=location)
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        return location
+
+    def test_admin_import_subscribers_background(self):
+        """
+        Uploads are parsed and confirmed imports inserted by the worker,
+        reporting progress to the status view.
+        """
+        location = self.patch_import_storage()
+
+        with override_settings(NEWSLETTER_IMPORT_IN_BACKGROUND=True):
+            response = self.admin_import_file('addresses.csv')
+
+            subscription_import = SubscriptionImport.objects.get()
+            name = subscription_import.address_file.name
+            self.assertTrue(os.path.exists(os.path.join(location, name)))
+            self.assertFalse(default_storage.exists(name))
+
+            progress_url = reverse(
+                'admin:newsletter_subscription_import_progress',
+                args=[subscription_import.pk]
+            )
+            status_url = reverse(
+                'admin:newsletter_subscription_import_status',
+                args=[subscription_import.pk]
+            )
+            self.assertRedirects(response, progress_url)
+            self.assertContains(response, status_url)
+            self.assertEqual(
+                self.client.get(status_url).json()['status'],
+                SubscriptionImport.PENDING
+            )
+
+            self.assertEqual(SubscriptionImport.run_queue(), 1)
+
+            subscription_import.refresh_from_db()
+            self.assertFalse(subscription_import.address_file)
+            self.assertEqual(self.client.get(status_url).json(), {
+                'status': SubscriptionImport.STAGED,
+                'status_display': 'waiting for confirmation',
+                'rows': 2, 'rejected': 0, 'staged': 2, 'inserted': 0,
+                'error': '',
+            })
+
+            response = self.client.post(
+                reverse('admin:newsletter_subscription_import_confirm'),
+                {'confirm': True}, follow=True
+            )
+            self.assertRedirects(response, progress_url)
+            self.assertFalse(self.newsletter.subscription_set.exists())
+
+            self.assertEqual(SubscriptionImport.run_queue(), 1)
+            self.assertEqual(SubscriptionImport.run_queue(), 0)
+
+            self.assertEqual(self.newsletter.subscription_set.count(), 2)
+            progress = self.client.get(status_url).json()
+            self.assertEqual(progress['status'], SubscriptionImport.DONE)
+            self.assertEqual(progress['inserted'], 2)
+            self.assertEqual(progress['staged'], 0)
+
+    def test_admin_import_subscribers_background_failed(self):
+        """ Fatal parse errors are reported, and leave nothing staged. """
+        self.patch_import_storage()
+
+        with override_settings(NEWSLETTER_IMPORT_IN_BACKGROUND=True):
+            self.admin_import_file('addresses_duplicates.csv')
+            SubscriptionImport.run_queue()
+
+        subscription_import = SubscriptionImport.objects.get()
+        self.assertEqual(subscription_import.status, SubscriptionImport.FAILED)
+        self.assertTrue(subscription_import.error)
+        self.assertFalse(subscription_import.addresses.exists())
+
+        response = self.client.get(reverse(
+            'admin:newsletter_subscription_import_progress',
+            args=[subscription_import.pk]
+        ))
+        self.assertContains(response, 'contains duplicate entries')
+
+    def test_import_storage(self):
+        """ Uploads are kept out of MEDIA_ROOT, unless configured. """
+        self.assertEqual(
+            get_import_storage().location,
+            os.path.join(tempfile.gettempdir(), 'newsletter-imports')
+        )
+
+        with override_settings(
+            STORAGES={**settings.STORAGES, 'imports': {
+                'BACKEND': 'django.core.files.storage.InMemoryStorage'
+            }},
+            NEWSLETTER_IMPORT_STORAGE='imports'
+        ):
+            self.assertIs(get_import_storage(), storages['imports'])
+
+    def test_admin_import_subscribers_taken_over(self):
+        """ Imports changed by another process are left to it. """
+        self.admin_import_file('addresses.csv')
+        subscription_import = SubscriptionImport.objects.get()
+
+        # Confirmed, and claimed by a worker in the meantime
+        SubscriptionImport.objects.update(
+            status=SubscriptionImport.INSERTING, updated=now()
+        )
+
+        with self.assertRaises(ImportTakenOver):
+            subscription_import.confirm()
+        self.assertFalse(self.newsletter.subscription_set.exists())
+
+        subscription_import.fail('Broken')
+        subscription_import.refresh_from_db()
+        self.assertEqual(
+            subscription_import.status, SubscriptionImport.INSERTING
+        )
+        self.assertEqual(subscription_import.addresses.count(), 2)
+
+    def test_admin_import_subscribers_status_permission(self):
+        subscription_import = SubscriptionImport.objects.create(
+            newsletter=self.newsletter
+        )
+        self.admin_user.is_superuser = False
+        self.admin_user.save()
+
+        response = self.client.get(reverse(
+            'admin:newsletter_subscription_import_status',
+            args=[subscription_import.pk]
+        ))
+        self.assertEqual(response.status_code, 403)
+
     def test_admin_import_subscribers_permission(self):
         """
         To be able to import subscriptions, user must have the
@@ -326,6 +656,186 @@ class AdminTestCase(AdminTestMixin, TestCase):
         self.assertContains(response, '<a href="/tests/files/sample.txt">tests/files/sample.txt</a>', html=True)
 
 
+@override_settings(NEWSLETTER_IMPORT_BATCH_SIZE=2)
+class ImportCSVTestCase(AdminTestMixin, TestCase):
+    """ Parsing CSV files in batches. """
+
+    def test_import(self):
+        make_subscription(self.newsletter, 'existing@example.org').save()
+
+        myfile = io.BytesIO(
+            b'name;email\n'
+            b'Jill Martin;jill@example.org\n'
+            b'Invalid;invalid\n'
+            b'John Smith;john@example.org\n'
+            b'Jill Again;jill@example.org\n'
+            b'Existing;existing@example.org\n'
+            b'Nobody;\n'
+        )
+
+        subscription_import = SubscriptionImport.objects.create(
+            newsletter=self.newsletter
+        )
+        address_lists = []
+        with self.assertLogs('newsletter.addressimport.parsers', 'WARNING'):
+            for address_list in iter_csv(
+                myfile, self.newsletter, True,
+                subscription_import=subscription_import
+            ):
+                subscription_import.add_addresses(
+                    address_list.addresses.items()
+                )
+                address_lists.append(address_list)
+
+        self.assertEqual(
+            [(a.rows, list(a.addresses), len(a.errors)) for a in address_lists],
+            [(2, ['jill@example.org'], 1), (2, ['john@example.org'], 1),
+             (2, [], 2)]
+        )
+        self.assertIn('invalid', address_lists[0].errors[0].lower())
+
+    def test_errors(self):
+        myfile = io.BytesIO(
+            b'name;email\nJill Martin;jill@example.org\nInvalid;invalid\n'
+        )
+
+        with self.assertLogs('newsletter.addressimport.parsers', 'WARNING'):
+            with self.assertRaises(ValidationError):
+                list(iter_csv(myfile, self.newsletter))
+
+
+class ImportSubscribersCommandTestCase(AdminTestMixin, TestCase):
+    def import_subscribers(self, source_file, *args):
+        stdout = io.StringIO()
+        call_command(
+            'import_subscribers', self.newsletter.slug,
+            os.path.join(test_files_dir, source_file), *args, stdout=stdout
+        )
+        return stdout.getvalue()
+
+    def test_import(self):
+        output = self.import_subscribers('addresses.csv')
+
+        self.assertIn(
+            '2 rows parsed, 0 rejected, 2 subscriptions created.', output
+        )
+        self.assertEqual(self.newsletter.subscription_set.count(), 2)
+        self.assertEqual(
+            SubscriptionImport.objects.get().status, SubscriptionImport.DONE
+        )
+
+    @override_settings(NEWSLETTER_IMPORT_BATCH_SIZE=1)
+    def test_import_worker(self):
+        """ Workers leave imports staged by the command alone. """
+        add_addresses = SubscriptionImport.add_addresses
+        claimed = []
+
+        def side_effect(subscription_import, addresses):
+            add_addresses(subscription_import, addresses)
+            claimed.append(SubscriptionImport.run_queue())
+
+        with patch.object(
+            SubscriptionImport, 'add_addresses', autospec=True,
+            side_effect=side_effect
+        ):
+            output = self.import_subscribers('addresses.csv')
+
+        self.assertEqual(claimed, [0, 0])
+        self.assertIn(
+            '2 rows parsed, 0 rejected, 2 subscriptions created.', output
+        )
+        self.assertEqual(self.newsletter.subscription_set.count(), 2)
+
+    def test_ignore_errors(self):
+        with self.assertRaisesMessage(CommandError, 'duplicate entries'):
+            self.import_subscribers('addresses_duplicates.csv')
+        self.assertFalse(self.newsletter.subscription_set.exists())
+
+        with self.assertLogs('newsletter.addressimport.parsers', 'WARNING'):
+            output = self.import_subscribers(
+                'addresses_duplicates.csv', '--ignore-errors'
+            )
+        self.assertIn(
+            '4 rows parsed, 2 rejected, 2 subscriptions created.', output
+        )
+
+    def test_unknown_newsletter(self):
+        with self.assertRaisesMessage(CommandError, 'does not exist'):
+            call_command(
+                'import_subscribers', 'nonexistent',
+                os.path.join(test_files_dir, 'addresses.csv')
+            )
+
+
+class GetEncodingTestCase(TestCase):
+    """ Detecting the encoding of imported address files. """
+
+    def get_encoding(self, data):
+        myfile = io.BytesIO(data)
+        myfile.seek(3)
+
+        encoding = get_encoding(myfile)
+        self.assertEqual(myfile.tell(), 0)
+
+        return encoding
+
+    def test_bom(self):
+        text = 'name;email\nRené;rene@example.org\n'
+
+        self.assertEqual(
+            self.get_encoding(codecs.BOM_UTF8 + text.encode('utf-8')),
+            'utf-8-sig'
+        )
+        self.assertEqual(self.get_encoding(text.encode('utf-16')), 'utf-16')
+
+    def test_utf8(self):
+        self.assertEqual(
+            self.get_encoding('René;rene@example.org\n'.encode('utf-8')),
+            'utf-8'
+        )
+
+    @patch('newsletter.addressimport.parsers.ENCODING_SAMPLE_SIZE', 16)
+    def test_sampled(self):
+        """ Large files are sampled, with UTF-8 characters cut off. """
+        data = ('ø' * 100).encode('utf-8')
+
+        with patch('chardet.universaldetector.UniversalDetector') as detector:
+            self.assertEqual(self.get_encoding(b'x' + data), 'utf-8')
+        detector.assert_not_called()
+
+        myfile = MagicMock(wraps=io.BytesIO(data + 'Søren'.encode('latin-1')))
+        self.assertNotEqual(get_encoding(myfile), 'utf-8')
+
+        for call in myfile.read.call_args_list:
+            self.assertEqual(call.args, (16,))
+
+    @override_settings(NEWSLETTER_IMPORT_BATCH_SIZE=1000)
+    @patch('newsletter.addressimport.parsers.ENCODING_SAMPLE_SIZE', 16)
+    def test_not_sampled(self):
+        """ Characters outside of the samples are taken into account. """
+        rows = ['name;email'] + [
+            'Name %d;name%d@example.org' % (i, i) for i in range(100)
+        ]
+        rows[10] = 'Søren;soren@example.org'
+        data = '\n'.join(rows).encode('latin-1')
+
+        # Outside of the samples
+        self.assertTrue(all(
+            is_utf8(sample) for sample in get_samples(io.BytesIO(data))
+        ))
+
+        self.assertNotEqual(self.get_encoding(data), 'utf-8')
+
+        newsletter = Newsletter.objects.create(
+            title='Test', slug='test', email='test@test.com',
+            sender='Test Sender'
+        )
+        address_list, = iter_csv(io.BytesIO(data), newsletter)
+        self.assertEqual(
+            address_list.addresses['soren@example.org'], 'Søren'
+        )
+
+
 class MessageAdminTests(AdminTestMixin, TestCase):
     """ Tests for Message admin. """
 
@@ -372,6 +882,29 @@ class SubmissionAdminTests(AdminTestMixin, TestCase):
             '<td class="field-admin_status_text">Not sent.</td>'
         )
 
+    def test_changelist_deliveries(self):
+        """ Delivery counts are shown in the change list. """
+
+        submission = Submission.from_message(self.message, Site.objects.get_current())
+        Delivery.objects.bulk_create([
+            Delivery(submission=submission, email='a@test.com', status=Delivery.SENT),
+            Delivery(submission=submission, email='b@test.com', status=Delivery.SENT),
+            Delivery(submission=submission, email='c@test.com', status=Delivery.FAILED),
+        ])
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.changelist_url)
+        self.assertContains(
+            response,
+            '<td class="field-admin_deliveries">2 sent, 1 failed</td>'
+        )
+
+        # Only the deliveries of the listed page are counted
+        self.assertEqual(len([
+            q for q in queries.captured_queries
+            if 'newsletter_delivery' in q['sql']
+        ]), 1)
+
     def test_duplicate_fail(self):
         """ Test that a message cannot be published twice. """
 
@@ -516,6 +1049,7 @@ class ArticleInlineTests(TestCase):
         django_admin.site.unregister(Submission)
         django_admin.site.unregister(Message)
         django_admin.site.unregister(Subscription)
+        django_admin.site.unregister(SubscriptionJob)
 
     def tearDown(self):
         self.clear_imports()
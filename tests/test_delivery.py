@@ -0,0 +1,137 @@
+from unittest import mock
+
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from newsletter.delivery import RateLimiter, SendingLimit
+
+
+class FakeClock:
+    """ Replacement for time.monotonic/time.time and time.sleep. """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(round(seconds, 6))
+        self.now += seconds
+
+
+class FakeClockMixin:
+    def setUp(self):
+        super().setUp()
+
+        self.clock = FakeClock()
+
+        for name, replacement in (
+            ('monotonic', self.clock.time),
+            ('time', self.clock.time),
+            ('sleep', self.clock.sleep),
+        ):
+            patcher = mock.patch('time.' + name, replacement)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class RateLimiterTestCase(FakeClockMixin, TestCase):
+    def test_rate(self):
+        limiter = RateLimiter(10, 1)
+
+        for _ in range(3):
+            limiter.acquire()
+
+        self.assertEqual(self.clock.sleeps, [0.1, 0.1])
+
+    def test_elapsed_time_subtracted(self):
+        limiter = RateLimiter(10, 1)
+
+        limiter.acquire()
+        # Rendering and sending took 60ms
+        self.clock.now += 0.06
+        limiter.acquire()
+
+        self.assertEqual(self.clock.sleeps, [0.04])
+
+    def test_burst(self):
+        limiter = RateLimiter(1, 1, burst=3)
+
+        for _ in range(4):
+            limiter.acquire()
+
+        self.assertEqual(self.clock.sleeps, [1.0])
+
+    def test_shared(self):
+        cache = caches['default']
+        cache.clear()
+
+        limiter = RateLimiter(10, 1, burst=2, cache=cache)
+        other = RateLimiter(10, 1, burst=2, cache=cache)
+
+        limiter.acquire()
+        other.acquire()
+        self.assertEqual(self.clock.sleeps, [])
+
+        # Both share a window of 2 messages per 200ms
+        limiter.acquire()
+        self.assertEqual(self.clock.sleeps, [0.2])
+
+    @override_settings(NEWSLETTER_RATE_LIMIT='3600/hour')
+    def test_from_settings(self):
+        limiter = RateLimiter.from_settings()
+
+        self.assertEqual(limiter.interval, 1)
+        self.assertIsNone(limiter.cache)
+
+    @override_settings(NEWSLETTER_EMAIL_DELAY=0.5)
+    def test_from_settings_email_delay(self):
+        self.assertEqual(RateLimiter.from_settings().interval, 0.5)
+
+    def test_from_settings_none(self):
+        self.assertIsNone(RateLimiter.from_settings())
+
+    @override_settings(NEWSLETTER_RATE_LIMIT='many')
+    def test_from_settings_invalid(self):
+        with self.assertRaises(ImproperlyConfigured):
+            RateLimiter.from_settings()
+
+    @override_settings(NEWSLETTER_RATE_LIMIT='0/second')
+    def test_from_settings_zero(self):
+        with self.assertRaises(ImproperlyConfigured):
+            RateLimiter.from_settings()
+
+
+class SendingLimitTestCase(FakeClockMixin, TestCase):
+    def test_unlimited(self):
+        limit = SendingLimit()
+
+        self.assertTrue(all(limit.take() for _ in range(100)))
+        self.assertFalse(limit.is_set())
+
+    def test_max_messages(self):
+        limit = SendingLimit(max_messages=2)
+
+        self.assertEqual([limit.take() for _ in range(3)], [True, True, False])
+        self.assertTrue(limit.is_set())
+        self.assertEqual(limit.messages, 2)
+
+    def test_time_limit(self):
+        limit = SendingLimit(time_limit=10)
+        self.assertTrue(limit.take())
+
+        self.clock.now += 10
+
+        self.assertTrue(limit.is_set())
+        self.assertFalse(limit.take())
+
+    def test_set(self):
+        limit = SendingLimit(max_messages=2)
+        limit.set()
+
+        self.assertFalse(limit.take())
+        self.assertTrue(limit.wait(1))
@@ -1,30 +1,49 @@
 import itertools
 import os
 import re
+import signal
+import socket
 
 from unittest import mock
 import unittest
 
 from datetime import timedelta
+from email.utils import parseaddr
 
+from django.contrib.auth import get_user_model
 from django.contrib.sites.models import Site
 from django.core import mail
 from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models.fields.files import FieldFile
+from django.template import Context, Template, TemplateDoesNotExist
 from django.utils.timezone import now
-from django.test.utils import override_settings
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext, override_settings
 
+from newsletter.delivery import SendingLimit
 from newsletter.models import (
-    Newsletter, Subscription, Submission, Message, Article, Attachment, SubscriptionGenerator,
-    get_default_sites, render_message
+    ActivationEmail, Newsletter, Subscription, SubscriptionJob, Recipient, Submission, SubmissionChunk, Delivery, Message, Article,
+    Attachment, SubscriptionGenerator, get_default_sites, render_message,
+    _SubscriptionProbe
 )
 from newsletter.utils import ACTIONS
 
-from .utils import MailTestCase, UserTestCase, template_exists
+from .utils import (
+    MailTestCase, UserTestCase, CountingEmailBackend, SMTPSink,
+    template_exists
+)
+
+try:
+    import aiosmtplib
+except ImportError:
+    aiosmtplib = None
 
 NUM_SUBSCRIBED = 2
 
 
-class MailingTestCase(MailTestCase):
+class MailingTestMixin:
 
     def get_newsletter_kwargs(self):
         """ Returns the keyword arguments for instanciating the newsletter. """
@@ -66,6 +85,23 @@ class MailingTestCase(MailTestCase):
             newsletter=self.n, subscribed=True
         )
 
+    def stop_after_message(self):
+        """ Return a limit, set once sending the first message started. """
+        stop = SendingLimit()
+        send_message = Submission.send_message
+
+        def side_effect(submission, *args, **kwargs):
+            stop.set()
+            return send_message(submission, *args, **kwargs)
+
+        patcher = mock.patch.object(
+            Submission, 'send_message', autospec=True, side_effect=side_effect
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        return stop
+
     def send_email(self, action):
         assert action in ACTIONS + ('message', ), 'Unknown action: %s' % action
 
@@ -83,6 +119,10 @@ class MailingTestCase(MailTestCase):
                 subscriber.send_activation_email(action)
 
 
+class MailingTestCase(MailingTestMixin, MailTestCase):
+    pass
+
+
 class ArticleTestCase(MailingTestCase):
     def make_article(self):
         a = Article()
@@ -259,6 +299,15 @@ class TestingSubscriptionGenerator(SubscriptionGenerator):
         ]
 
 
+class StreamingSubscriptionGenerator(SubscriptionGenerator):
+    def generate_subscriptions(self, newsletter):
+        yield 'name 1', 'test@test.com'
+        yield 'name 2', 'test2@test.com'
+        yield 'name 3', 'test3@test.com'
+        yield 'name 2', 'test2@test.com'
+        yield 'name 4', 'test4@test.com'
+
+
 class SubscriptionGeneratorTestCase(MailingTestCase):
     def setUp(self):
         super().setUp()
@@ -278,13 +327,34 @@ class SubscriptionGeneratorTestCase(MailingTestCase):
         self.sub.subscriptions.add(sub2)
         self.sub.subscriptions.add(sub3)
 
-        self.sub.submit()
+        with self.assertLogs('newsletter.models', 'INFO') as logs:
+            self.sub.submit()
+        self.assertIn(
+            'to 2 subscribers and generated subscriptions', logs.output[0]
+        )
+        self.assertIn('Sent 3 messages', logs.output[-1])
+
         Submission.submit_queue()
         submission = Submission.objects.get(pk=self.sub.pk)
         self.assertTrue(submission.sent)
         self.assertEqual([m.to for m in mail.outbox],
                          [['name 1 <test1@test.com>'], ['name 2 <test2@test.com>'], ['name 4 <test4@test.com>']])
 
+    @override_settings(NEWSLETTER_SUBSCRIPTION_FETCH_SIZE=2)
+    def test_subscription_generator_streamed(self):
+        """ Generated subscriptions are checked a batch at a time. """
+        self.n.subscription_generator_class = 'tests.test_mailing.StreamingSubscriptionGenerator'
+        self.n.save()
+        Subscription.objects.create(
+            name='name 3', email='test3@test.com', newsletter=self.n,
+            unsubscribed=True
+        )
+
+        self.assertEqual(
+            [s.email for s in self.sub.iter_recipients()],
+            ['test@test.com', 'rene@test.com', 'test2@test.com', 'test4@test.com']
+        )
+
     def test_nonexistent_generator_class(self):
         """ Test failure when generator class does not exist """
         try:
@@ -373,6 +443,61 @@ class SubmitSubmissionTestCase(MailingTestCase):
         self.assertFalse(self.sub.sent)
         self.assertFalse(self.sub.sending)
 
+    @override_settings(NEWSLETTER_SUBSCRIPTION_FETCH_SIZE=1)
+    def test_subscriptions_fetched_in_batches(self):
+        subscriptions = self.sub.iter_recipients()
+
+        # A query per subscription and one finding no more
+        with self.assertNumQueries(NUM_SUBSCRIBED + 1):
+            self.assertEqual(
+                [s.pk for s in subscriptions], [self.s.pk, self.s2.pk]
+            )
+
+    def count_submit_queries(self, submission):
+        with self.assertLogs('newsletter', 'DEBUG'), \
+                CaptureQueriesContext(connection) as queries:
+            submission.submit()
+
+        return len(queries)
+
+    def add_user_subscriptions(self, count):
+        User = get_user_model()
+        for number in range(User.objects.count(), User.objects.count() + count):
+            Subscription.objects.create(
+                user=User.objects.create_user(
+                    'user%d' % number, 'user%d@test.com' % number
+                ),
+                newsletter=self.n, subscribed=True
+            )
+
+    def test_query_budget(self):
+        """ The number of queries does not depend on the recipients. """
+        self.n.personalized = True
+        self.n.save()
+        Article.objects.create(title='Article', text='Text', post=self.m)
+
+        self.add_user_subscriptions(1)
+        queries = self.count_submit_queries(Submission.from_message(
+            Message.objects.get(pk=self.m.pk), site=self.get_site()
+        ))
+
+        self.add_user_subscriptions(3)
+        submission = Submission.from_message(
+            Message.objects.get(pk=self.m.pk), site=self.get_site()
+        )
+
+        self.assertEqual(self.count_submit_queries(submission), queries)
+        self.assertEqual(len(mail.outbox), 2 * NUM_SUBSCRIBED + 4 + 1)
+
+    def test_articles_prefetched(self):
+        Article.objects.create(title='Article', text='Text', post=self.m)
+        self.sub.submit()
+
+        with self.assertNumQueries(0):
+            render_message(
+                self.sub.message, submission=self.sub, subscription=self.s
+            )
+
     def test_submit_submission(self):
         """ Test queue-based submission. """
 
@@ -417,7 +542,10 @@ class SubmitSubmissionTestCase(MailingTestCase):
             with mock.patch('time.sleep', return_value=None) as sleep_mock:
                 Submission.submit_queue()
 
-        sleep_mock.assert_called_with(0.01)
+        # Time spent rendering and sending is subtracted from the delay
+        sleep_mock.assert_called_once()
+        self.assertGreater(sleep_mock.call_args[0][0], 0)
+        self.assertLessEqual(sleep_mock.call_args[0][0], 0.01)
 
     def test_delayed_batch_sumbmission(self):
         """ Test delays between emails """
@@ -435,6 +563,54 @@ class SubmitSubmissionTestCase(MailingTestCase):
 
         sleep_mock.assert_called_with(0.02)
 
+    @override_settings(EMAIL_BACKEND='tests.utils.CountingEmailBackend')
+    def test_connection_reuse(self):
+        """ Test all messages are sent over a single connection. """
+
+        CountingEmailBackend.opened = 0
+
+        self.sub.prepared = True
+        self.sub.publish_date = now() - timedelta(seconds=1)
+        self.sub.save()
+
+        Submission.submit_queue()
+
+        self.assertEqual(len(mail.outbox), NUM_SUBSCRIBED)
+        self.assertEqual(CountingEmailBackend.opened, 1)
+
+    @override_settings(
+        EMAIL_BACKEND='tests.utils.CountingEmailBackend',
+        NEWSLETTER_MAX_MESSAGES_PER_CONNECTION=1
+    )
+    def test_connection_max_messages(self):
+        """ Test reconnecting after the maximum amount of messages. """
+
+        CountingEmailBackend.opened = 0
+
+        self.sub.prepared = True
+        self.sub.publish_date = now() - timedelta(seconds=1)
+        self.sub.save()
+
+        Submission.submit_queue()
+
+        self.assertEqual(len(mail.outbox), NUM_SUBSCRIBED)
+        self.assertEqual(CountingEmailBackend.opened, NUM_SUBSCRIBED)
+
+    @override_settings(EMAIL_BACKEND='tests.utils.DisconnectingEmailBackend')
+    def test_connection_reconnect(self):
+        """ Test reconnecting when the server drops the connection. """
+
+        CountingEmailBackend.opened = 0
+
+        self.sub.prepared = True
+        self.sub.publish_date = now() - timedelta(seconds=1)
+        self.sub.save()
+
+        Submission.submit_queue()
+
+        self.assertEqual(len(mail.outbox), NUM_SUBSCRIBED)
+        self.assertEqual(CountingEmailBackend.opened, 2)
+
     def test_management_command(self):
         """ Test submission through management command. """
 
@@ -447,55 +623,1196 @@ class SubmitSubmissionTestCase(MailingTestCase):
             mock_submit.assert_called_once()
 
 
-class SubscriptionTestCase(UserTestCase, MailingTestCase):
+class ClaimSubmissionTestCase(MailingTestCase):
+    """ Submissions are claimed by a single worker at a time. """
+
     def setUp(self):
         super().setUp()
 
-        self.us = Subscription(user=self.user, newsletter=self.n)
-        self.us.save()
+        self.sub = Submission.from_message(self.m, site=self.get_site())
+        self.sub.prepared = True
+        self.sub.publish_date = now() - timedelta(seconds=1)
+        self.sub.save()
 
-        self.ns = Subscription(
-            name='Test susbcriber', newsletter=self.n,
-            email='test@test.com'
+    def test_claim(self):
+        self.assertTrue(self.sub.claim('worker'))
+        self.assertFalse(
+            Submission.objects.get(pk=self.sub.pk).claim('other-worker')
         )
-        self.ns.save()
 
-        self.ss = [self.us, self.ns]
+        submission = Submission.objects.get(pk=self.sub.pk)
+        self.assertTrue(submission.sending)
+        self.assertEqual(submission.claimed_by, 'worker')
+
+    def test_claim_sent(self):
+        """ Submissions sent by another run since listing aren't claimed. """
+        submission = (
+            Submission.objects.filter(pk=self.sub.pk) & Submission.claimable()
+        ).get()
+        Submission.objects.filter(pk=self.sub.pk).update(
+            sent=True, sending=False
+        )
 
-    def test_user_subscription(self):
-        self.assertEqual(self.us.name, self.user.get_full_name())
-        self.assertEqual(self.us.email, self.user.email)
+        self.assertFalse(submission.claim('worker'))
 
-    def test_subscribe_unsubscribe(self):
-        for s in self.ss:
-            self.assertFalse(s.subscribed)
-            self.assertFalse(s.unsubscribed)
-            self.assertFalse(s.subscribe_date)
-            self.assertFalse(s.unsubscribe_date)
+    @override_settings(NEWSLETTER_TRACK_DELIVERIES=False)
+    def test_claim_sent_submit(self):
+        """ Without delivery tracking, nobody receives a second copy. """
+        submission = Submission.objects.get(pk=self.sub.pk)
+        Submission.objects.filter(pk=self.sub.pk).update(
+            sent=True, sending=False
+        )
 
-            # Repeat this to ensure consequencentness
-            for x in range(2):
-                s.subscribed = True
-                s.save()
+        submission.submit()
 
-                self.assertTrue(s.subscribed)
-                self.assertTrue(s.subscribe_date)
-                self.assertFalse(s.unsubscribed)
-                old_subscribe_date = s.subscribe_date
+        self.assertEqual(len(mail.outbox), 0)
 
-                s.unsubscribed = True
-                s.save()
+    def test_claim_expired(self):
+        """ Claims of crashed workers expire. """
+        self.sub.claim('worker')
+        Submission.objects.filter(pk=self.sub.pk).update(
+            claimed_at=now() - timedelta(seconds=3601)
+        )
 
-                self.assertFalse(s.subscribed)
-                self.assertTrue(s.unsubscribed)
-                self.assertTrue(s.unsubscribe_date)
+        Submission.submit_queue()
 
-                s.unsubscribed = False
-                s.save()
+        self.assertEqual(len(mail.outbox), NUM_SUBSCRIBED)
 
-                self.assertFalse(s.unsubscribed)
-                self.assertTrue(s.subscribed)
-                self.assertNotEqual(s.subscribe_date, old_subscribe_date)
+        submission = Submission.objects.get(pk=self.sub.pk)
+        self.assertTrue(submission.sent)
+        self.assertFalse(submission.sending)
+        self.assertIsNone(submission.claimed_by)
+
+    def test_claimed_elsewhere(self):
+        Submission.objects.get(pk=self.sub.pk).claim('other-worker')
+
+        Submission.submit_queue()
+        self.sub.submit()
+
+        self.assertEqual(len(mail.outbox), 0)
+
+    @override_settings(NEWSLETTER_SUBMISSION_LEASE=30)
+    def test_heartbeat(self):
+        self.sub.claim('worker')
+        claimed_at = self.sub.claimed_at
+
+        self.sub.heartbeat()
+        self.assertEqual(self.sub.claimed_at, claimed_at)
+
+        self.sub.claimed_at -= timedelta(seconds=10)
+        self.sub.heartbeat()
+
+        self.assertGreater(self.sub.claimed_at, claimed_at)
+        self.assertEqual(
+            Submission.objects.get(pk=self.sub.pk).claimed_at,
+            self.sub.claimed_at
+        )
+
+    @override_settings(NEWSLETTER_SUBMISSION_LEASE=30)
+    def test_heartbeat_taken_over(self):
+        """ Workers stop sending once their claim was taken over. """
+        send_message = Submission.send_message
+
+        def take_over(submission, *args, **kwargs):
+            # The claim expired, and another worker claimed the submission
+            submission.claimed_at -= timedelta(seconds=60)
+            Submission.objects.filter(pk=submission.pk).update(
+                claimed_by='other-worker', claimed_at=now()
+            )
+            return send_message(submission, *args, **kwargs)
+
+        with mock.patch.object(
+            Submission, 'send_message', autospec=True, side_effect=take_over
+        ):
+            self.sub.submit()
+
+        self.assertEqual(len(mail.outbox), 1)
+
+        submission = Submission.objects.get(pk=self.sub.pk)
+        self.assertFalse(submission.sent)
+        self.assertTrue(submission.sending)
+        self.assertEqual(submission.claimed_by, 'other-worker')
+
+    def test_release_on_error(self):
+        with mock.patch.object(
+            Submission, '_send', side_effect=ValueError('broken')
+        ), self.assertRaises(ValueError):
+            self.sub.submit()
+
+        submission = Submission.objects.get(pk=self.sub.pk)
+        self.assertFalse(submission.sent)
+        self.assertFalse(submission.sending)
+        self.assertIsNone(submission.claimed_by)
+
+
+class StopSubmissionTestCase(MailingTestCase):
+    """ Sending stops gracefully, to be resumed later. """
+
+    def setUp(self):
+        super().setUp()
+
+        self.sub = Submission.from_message(self.m, site=self.get_site())
+        self.sub.prepared = True
+        self.sub.publish_date = now() - timedelta(seconds=1)
+        self.sub.save()
+
+    def test_stop(self):
+        Submission.submit_queue(self.stop_after_message())
+
+        self.assertEqual(len(mail.outbox), 1)
+
+        submission = Submission.objects.get(pk=self.sub.pk)
+        self.assertFalse(submission.sent)
+        self.assertFalse(submission.sending)
+
+        Submission.submit_queue()
+
+        self.assertEqual(len(mail.outbox), NUM_SUBSCRIBED)
+        self.assertTrue(Submission.objects.get(pk=self.sub.pk).sent)
+
+    def test_daemon(self):
+        def submit_queue(limit, queryset):
+            if mock_submit.call_count == 2:
+                os.kill(os.getpid(), signal.SIGTERM)
+
+        handler = signal.getsignal(signal.SIGTERM)
+
+        with mock.patch.object(
+            Submission, 'submit_queue', side_effect=submit_queue
+        ) as mock_submit:
+            call_command('submit_newsletter', daemon=True, poll_interval=0.01)
+
+        self.assertEqual(mock_submit.call_count, 2)
+        self.assertEqual(signal.getsignal(signal.SIGTERM), handler)
+
+    def test_max_messages(self):
+        call_command('submit_newsletter', max_messages=1)
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertFalse(Submission.objects.get(pk=self.sub.pk).sent)
+
+        call_command('submit_newsletter', max_messages=1)
+
+        self.assertEqual(len(mail.outbox), NUM_SUBSCRIBED)
+        self.assertTrue(Submission.objects.get(pk=self.sub.pk).sent)
+
+    def test_time_limit(self):
+        call_command('submit_newsletter', time_limit=0)
+
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertFalse(Submission.objects.get(pk=self.sub.pk).sent)
+
+    def test_submission(self):
+        other = Submission.from_message(self.m, site=self.get_site())
+        Submission.objects.filter(pk=other.pk).update(
+            prepared=True, publish_date=self.sub.publish_date
+        )
+
+        call_command('submit_newsletter', submission_id=other.pk)
+
+        self.assertTrue(Submission.objects.get(pk=other.pk).sent)
+        self.assertFalse(Submission.objects.get(pk=self.sub.pk).sent)
+
+    def test_newsletter(self):
+        call_command('submit_newsletter', newsletter_slug=self.n.slug)
+
+        self.assertTrue(Submission.objects.get(pk=self.sub.pk).sent)
+
+        with self.assertRaises(CommandError):
+            call_command('submit_newsletter', newsletter_slug='nonexistent')
+
+
+class ParallelSubmitTestCase(MailingTestMixin, TransactionTestCase):
+    """ Submissions sent by worker threads, using their own connections. """
+
+    serialized_rollback = True
+
+    def setUp(self):
+        super().setUp()
+
+        for i in range(3, 8):
+            Subscription.objects.create(
+                email='test%d@test.com' % i, newsletter=self.n, subscribed=True
+            )
+
+        self.sub = Submission.from_message(self.m, site=self.get_site())
+        self.sub.prepared = True
+        self.sub.publish_date = now() - timedelta(seconds=1)
+        self.sub.save()
+
+    @override_settings(
+        EMAIL_BACKEND='tests.utils.CountingEmailBackend',
+        NEWSLETTER_SEND_WORKERS=3
+    )
+    def test_parallel_submission(self):
+        CountingEmailBackend.opened = 0
+
+        Submission.submit_queue()
+
+        submission = Submission.objects.get(pk=self.sub.pk)
+        self.assertTrue(submission.sent)
+        self.assertFalse(submission.sending)
+
+        self.assertEqual(
+            sorted(m.to[0] for m in mail.outbox),
+            sorted(s.get_recipient() for s in self.sub.subscriptions.all())
+        )
+        self.assertLessEqual(CountingEmailBackend.opened, 3)
+
+    @override_settings(
+        NEWSLETTER_SEND_WORKERS=3, NEWSLETTER_DELIVERY_BATCH_SIZE=1
+    )
+    def test_parallel_submission_deliveries(self):
+        """ Workers write deliveries to a shared ledger one at a time. """
+        for i in range(8, 40):
+            Subscription.objects.create(
+                email='test%d@test.com' % i, newsletter=self.n, subscribed=True
+            )
+        self.sub.subscriptions.set(self.n.get_subscriptions())
+
+        Submission.submit_queue()
+
+        self.assertEqual(len(mail.outbox), 39)
+        self.assertEqual(
+            Delivery.objects.filter(
+                submission=self.sub, status=Delivery.SENT
+            ).count(),
+            39
+        )
+
+    @override_settings(
+        EMAIL_BACKEND='tests.utils.FailingEmailBackend',
+        NEWSLETTER_SEND_WORKERS=3
+    )
+    def test_parallel_submission_failures(self):
+        with self.assertLogs('newsletter.models', level='ERROR') as logs:
+            Submission.submit_queue()
+
+        self.assertIn('7 messages for', logs.output[-1])
+
+        submission = Submission.objects.get(pk=self.sub.pk)
+        self.assertFalse(submission.sending)
+
+    @override_settings(NEWSLETTER_SEND_WORKERS=3)
+    def test_parallel_submission_worker_error(self):
+        with mock.patch.object(
+            Submission, 'get_message', side_effect=ValueError('broken')
+        ):
+            with self.assertRaises(ValueError):
+                Submission.submit_queue()
+
+        submission = Submission.objects.get(pk=self.sub.pk)
+        self.assertFalse(submission.sent)
+        self.assertFalse(submission.sending)
+
+
+@unittest.skipUnless(aiosmtplib, 'aiosmtplib not installed.')
+class AsyncSubmitTestCase(MailingTestMixin, TransactionTestCase):
+    """ Submissions sent from an asyncio event loop to a local SMTP sink. """
+
+    serialized_rollback = True
+
+    def setUp(self):
+        super().setUp()
+
+        self.sink = SMTPSink()
+        self.sink.start()
+        self.addCleanup(self.sink.stop)
+
+        for i in range(3, 8):
+            Subscription.objects.create(
+                email='test%d@test.com' % i, newsletter=self.n, subscribed=True
+            )
+
+        self.sub = Submission.from_message(self.m, site=self.get_site())
+        self.sub.prepared = True
+        self.sub.publish_date = now() - timedelta(seconds=1)
+        self.sub.save()
+
+    def test_async_submission(self):
+        with self.settings(
+            EMAIL_HOST='127.0.0.1', EMAIL_PORT=self.sink.port,
+            NEWSLETTER_ASYNC_CONCURRENCY=3
+        ):
+            Submission.submit_queue()
+
+        submission = Submission.objects.get(pk=self.sub.pk)
+        self.assertTrue(submission.sent)
+        self.assertFalse(submission.sending)
+
+        self.assertEqual(len(self.sink.messages), 7)
+        self.assertLessEqual(self.sink.connections, 3)
+        self.assertTrue(
+            all(b'Test message' in m for m in self.sink.messages)
+        )
+
+    def test_async_submission_failures(self):
+        # Nothing listens on a port which has just been released
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+
+        with self.settings(
+            EMAIL_HOST='127.0.0.1', EMAIL_PORT=port,
+            NEWSLETTER_ASYNC_CONCURRENCY=3, NEWSLETTER_ASYNC_TIMEOUT=1
+        ):
+            with self.assertLogs('newsletter.models', level='ERROR') as logs:
+                Submission.submit_queue()
+
+        self.assertIn('7 messages for', logs.output[-1])
+        self.assertEqual(self.sink.messages, [])
+
+
+class AttachmentTestCase(MailingTestCase):
+    """ Attachments are read and encoded once per submission. """
+
+    def setUp(self):
+        super().setUp()
+
+        self.sub = Submission.from_message(self.m, site=self.get_site())
+
+        with open(os.path.join('tests', 'files', 'sample.pdf'), 'rb') as f:
+            self.content = f.read()
+
+    def assertAttachmentsSent(self):
+        self.assertEqual(len(mail.outbox), NUM_SUBSCRIBED)
+
+        for message in mail.outbox:
+            [part] = message.attachments
+            self.assertEqual(part.get_content_type(), 'application/pdf')
+            self.assertEqual(part.get_filename(), 'tests/files/sample.pdf')
+            self.assertEqual(part.get_payload(decode=True), self.content)
+
+    def test_attachments_read_once(self):
+        with mock.patch.object(
+            FieldFile, 'open', autospec=True, side_effect=FieldFile.open
+        ) as open_mock:
+            self.sub.submit()
+
+        open_mock.assert_called_once()
+        self.assertAttachmentsSent()
+
+    @override_settings(NEWSLETTER_ATTACHMENT_MEMORY_LIMIT=0)
+    def test_attachments_spilled(self):
+        self.sub.submit()
+
+        self.assertAttachmentsSent()
+
+    def test_attachments_released(self):
+        self.sub.submit()
+
+        self.assertNotIn('attachment_cache', self.sub.__dict__)
+
+
+class RecipientTestCase(MailingTestCase):
+    """ Recipients stand in for subscriptions while sending. """
+
+    def setUp(self):
+        super().setUp()
+
+        user = get_user_model().objects.create_user(
+            'john', 'lennon@thebeatles.com', first_name='John',
+            last_name='Lennon'
+        )
+        self.user_subscription = Subscription.objects.create(
+            user=user, newsletter=self.n, subscribed=True
+        )
+
+    def test_from_queryset(self):
+        subscriptions = [self.s, self.s2, self.user_subscription]
+        recipients = list(Recipient.from_queryset(
+            Subscription.objects.filter(newsletter=self.n)
+        ))
+
+        self.assertEqual(len(recipients), len(subscriptions))
+        for recipient, subscription in zip(recipients, subscriptions):
+            self.assertEqual(recipient.pk, subscription.pk)
+            self.assertEqual(recipient.name, subscription.name)
+            self.assertEqual(recipient.email, subscription.email)
+            self.assertEqual(
+                recipient.get_recipient(), subscription.get_recipient()
+            )
+            self.assertEqual(str(recipient), str(subscription))
+
+            for action in ACTIONS:
+                url = '%s_activate_url' % action
+                self.assertEqual(
+                    getattr(recipient, url)(), getattr(subscription, url)()
+                )
+
+    def test_template_access(self):
+        recipient = Recipient.from_subscription(self.user_subscription)
+
+        self.assertEqual(Template(
+            '{{ subscription.name }} {{ subscription.email }} '
+            '{{ subscription.unsubscribe_activate_url }}'
+        ).render(Context({'subscription': recipient})), 'John Lennon '
+            'lennon@thebeatles.com '
+            + self.user_subscription.unsubscribe_activate_url())
+
+    def test_read_only(self):
+        recipient = Recipient.from_subscription(self.s)
+
+        with self.assertRaises(AttributeError):
+            recipient.email = 'other@test.com'
+
+        self.assertFalse(hasattr(recipient, '__dict__'))
+
+
+class RenderOnceTestCase(MailingTestCase):
+    """ Messages without personal content are rendered once. """
+
+    def setUp(self):
+        super().setUp()
+
+        self.sub = Submission.from_message(self.m, site=self.get_site())
+
+    def submit(self):
+        with mock.patch(
+            'newsletter.models.render_message', side_effect=render_message
+        ) as render_mock:
+            self.sub.submit()
+
+        self.assertEqual(
+            sorted(message.to[0] for message in mail.outbox),
+            sorted(s.get_recipient() for s in (self.s, self.s2))
+        )
+
+        return render_mock.call_count
+
+    def use_personalized_templates(self):
+        self.n.slug = 'test-newsletter-personalized'
+        self.n.send_html = False
+        self.n.save()
+
+    def test_render_once(self):
+        self.assertEqual(self.submit(), 1)
+        self.assertEqual(mail.outbox[0].body, mail.outbox[1].body)
+
+    @unittest.skipUnless(
+        template_exists(
+            'newsletter/message/test-newsletter-personalized/message.txt'
+        ),
+        'Test templates overrides not found.'
+    )
+    def test_personalized(self):
+        self.use_personalized_templates()
+
+        # Detection followed by a rendering per subscription
+        self.assertEqual(self.submit(), 1 + NUM_SUBSCRIBED)
+
+        self.assertEqual(
+            sorted(message.body.splitlines()[0] for message in mail.outbox),
+            ['Dear René Luçon,', 'Dear Test Name,']
+        )
+
+    def test_declared_personalized(self):
+        self.n.personalized = True
+        self.n.save()
+
+        self.assertEqual(self.submit(), NUM_SUBSCRIBED)
+
+    def test_declared_not_personalized(self):
+        self.use_personalized_templates()
+        self.n.personalized = False
+        self.n.save()
+
+        self.assertEqual(self.submit(), 1)
+
+    def test_rendering_released(self):
+        self.sub.submit()
+
+        self.assertNotIn('shared_rendering', self.sub.__dict__)
+
+    def test_probe_failed(self):
+        """ Templates failing on the stand-in are rendered per recipient. """
+        def render(message, subscription=None, **kwargs):
+            if isinstance(subscription, _SubscriptionProbe):
+                raise TypeError('expected string or bytes-like object')
+            return render_message(
+                message, subscription=subscription, **kwargs
+            )
+
+        with mock.patch(
+            'newsletter.models.render_message', side_effect=render
+        ) as render_mock:
+            self.sub.submit()
+
+        self.assertEqual(render_mock.call_count, 1 + NUM_SUBSCRIBED)
+        self.assertEqual(len(mail.outbox), NUM_SUBSCRIBED)
+
+    def test_rendering_failed_released(self):
+        """ Attachments are closed when rendering fails. """
+        self.n.personalized = False
+        self.n.save()
+
+        with mock.patch(
+            'newsletter.models.render_message', side_effect=TypeError
+        ), self.assertRaises(TypeError):
+            self.sub.submit()
+
+        self.assertNotIn('attachment_cache', self.sub.__dict__)
+
+
+@unittest.skipUnless(
+    template_exists(
+        'newsletter/message/test-newsletter-personalized/message.txt'
+    ),
+    'Test templates overrides not found.'
+)
+class SharedFragmentTestCase(MailingTestCase):
+    """ Shared parts of personalized messages are rendered once. """
+
+    def get_newsletter_kwargs(self):
+        kwargs = super().get_newsletter_kwargs()
+        kwargs.update(slug='test-newsletter-personalized', send_html=False)
+
+        return kwargs
+
+    def setUp(self):
+        super().setUp()
+
+        for title in ('First article', 'Second article'):
+            Article.objects.create(title=title, text=title, post=self.m)
+
+        self.sub = Submission.from_message(self.m, site=self.get_site())
+
+    def render(self, source, **context):
+        return Template('{% load newsletter_tags %}' + source).render(
+            Context(context)
+        )
+
+    def test_shared_rendered_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.sub.submit()
+
+        self.assertEqual(len([
+            query for query in queries
+            if 'FROM "newsletter_article"' in query['sql']
+        ]), 1)
+
+        self.assertEqual(len(mail.outbox), NUM_SUBSCRIBED)
+        for message in mail.outbox:
+            self.assertIn('First article\nSecond article', message.body)
+        self.assertEqual(
+            sorted(message.body.splitlines()[0] for message in mail.outbox),
+            ['Dear René Luçon,', 'Dear Test Name,']
+        )
+
+    def test_fragments_released(self):
+        self.sub.submit()
+
+        self.assertNotIn('shared_fragments', self.sub.__dict__)
+
+    def test_shared_without_subscription(self):
+        self.assertEqual(self.render(
+            '{% shared %}{{ subscription.name }}{% endshared %}'
+            '{{ subscription.name }}',
+            subscription=self.s, shared_fragments={}
+        ), 'Test Name')
+
+    def test_shared_without_outside_variables(self):
+        """ Variables set from the subscription don't leak into fragments. """
+        fragments = {}
+        template = (
+            '{% with name=subscription.name %}'
+            '{% shared %}{{ name }}{{ message }}{% endshared %}'
+            '{% endwith %}'
+        )
+
+        for subscription in (self.s, self.s2):
+            self.assertEqual(self.render(
+                template, subscription=subscription, message='Message',
+                shared_fragments=fragments
+            ), 'Message')
+
+    def test_shared_reused(self):
+        fragments = {}
+        template = '{% shared %}{{ message }}{% endshared %}'
+
+        self.render(template, message='First', shared_fragments=fragments)
+
+        self.assertEqual(self.render(
+            template, message='Second', shared_fragments=fragments
+        ), 'First')
+
+    def test_shared_in_loop(self):
+        self.assertEqual(self.render(
+            '{% for i in items %}{% shared %}{{ i }}{% endshared %}{% endfor %}',
+            items=[1, 2], shared_fragments={}
+        ), '12')
+
+
+class DeliveryLedgerTestCase(MailingTestCase):
+    """ Deliveries are recorded, so interrupted submissions can resume. """
+
+    def setUp(self):
+        super().setUp()
+
+        self.sub = Submission.from_message(self.m, site=self.get_site())
+        self.sub.prepared = True
+        self.sub.publish_date = now() - timedelta(seconds=1)
+        self.sub.save()
+
+    def test_deliveries_recorded(self):
+        Submission.submit_queue()
+
+        deliveries = self.sub.deliveries.order_by('email')
+        self.assertEqual(
+            [(d.email, d.status, d.attempts, d.subscription) for d in deliveries],
+            [('rene@test.com', Delivery.SENT, 1, self.s2),
+             ('test@test.com', Delivery.SENT, 1, self.s)]
+        )
+
+    def test_resume_submission(self):
+        """ Recipients delivered to before a crash are skipped. """
+        Delivery.objects.create(
+            submission=self.sub, subscription=self.s, email=self.s.email,
+            status=Delivery.SENT, attempts=1
+        )
+
+        Submission.submit_queue()
+
+        self.assertEqual([m.to for m in mail.outbox], [[self.s2.get_recipient()]])
+        self.assertTrue(Submission.objects.get(pk=self.sub.pk).sent)
+
+    def test_retry_failed(self):
+        with self.settings(EMAIL_BACKEND='tests.utils.FailingEmailBackend'):
+            self.sub.submit()
+
+        delivery = self.sub.deliveries.get(email=self.s.email)
+        self.assertEqual(delivery.status, Delivery.FAILED)
+        self.assertEqual(delivery.error, 'Connection refused')
+        self.assertEqual(delivery.attempts, 1)
+
+        # Sent submissions are not claimed again, unless marked unsent
+        self.sub.sent = False
+        self.sub.save()
+        self.sub.submit()
+
+        delivery = self.sub.deliveries.get(email=self.s.email)
+        self.assertEqual(delivery.status, Delivery.SENT)
+        self.assertEqual(delivery.error, '')
+        self.assertEqual(delivery.attempts, 2)
+        self.assertEqual(len(mail.outbox), NUM_SUBSCRIBED)
+
+    @override_settings(NEWSLETTER_DELIVERY_BATCH_SIZE=1)
+    def test_deliveries_written_in_batches(self):
+        """ Deliveries are written before the submission finishes. """
+        with mock.patch.object(
+            Submission, 'get_message',
+            side_effect=[Submission.get_message(self.sub, self.s), ValueError]
+        ):
+            with self.assertRaises(ValueError):
+                self.sub.submit()
+
+        self.assertEqual(
+            list(self.sub.deliveries.values_list('email', flat=True)),
+            [self.s.email]
+        )
+
+    @override_settings(NEWSLETTER_TRACK_DELIVERIES=False)
+    def test_tracking_disabled(self):
+        Submission.submit_queue()
+
+        self.assertEqual(len(mail.outbox), NUM_SUBSCRIBED)
+        self.assertFalse(self.sub.deliveries.exists())
+
+
+@override_settings(NEWSLETTER_CHUNK_SIZE=2)
+class ChunkedSubmitTestCase(MailingTestCase):
+    """ Submissions split into chunks claimed by (concurrent) workers. """
+
+    def setUp(self):
+        super().setUp()
+
+        Subscription.objects.create(
+            email='test3@test.com', newsletter=self.n, subscribed=True
+        )
+
+        self.sub = Submission.from_message(self.m, site=self.get_site())
+        self.sub.prepared = True
+        self.sub.publish_date = now() - timedelta(seconds=1)
+        self.sub.save()
+
+    def test_create_chunks(self):
+        self.sub.create_chunks()
+        self.sub.create_chunks()
+
+        chunks = list(self.sub.chunks.all())
+        self.assertEqual([c.number for c in chunks], [0, 1])
+        self.assertEqual(len(chunks[0].get_recipients()), 2)
+        self.assertEqual(len(chunks[1].get_recipients()), 1)
+
+    def test_create_chunks_dynamic(self):
+        self.n.subscription_generator_class = 'tests.test_mailing.TestingSubscriptionGenerator'
+        self.n.save()
+
+        self.sub.create_chunks()
+
+        chunk = self.sub.chunks.get(dynamic=True)
+        self.assertEqual(
+            [s.email for s in chunk.get_recipients()],
+            ['test2@test.com', 'test4@test.com']
+        )
+
+    def test_claim_chunk(self):
+        self.sub.create_chunks()
+
+        first = self.sub.claim_chunk('worker-1')
+        second = self.sub.claim_chunk('worker-2')
+
+        self.assertEqual((first.number, second.number), (0, 1))
+        self.assertEqual(first.claimed_by, 'worker-1')
+        self.assertIsNone(self.sub.claim_chunk('worker-3'))
+
+    def test_claim_expired_chunk(self):
+        self.sub.create_chunks()
+        self.sub.chunks.update(
+            claimed_by='crashed', claimed_at=now() - timedelta(hours=2)
+        )
+
+        chunk = self.sub.claim_chunk('worker')
+        self.assertEqual(chunk.number, 0)
+        self.assertEqual(
+            SubmissionChunk.objects.get(pk=chunk.pk).claimed_by, 'worker'
+        )
+
+    def test_chunked_submission(self):
+        Submission.submit_queue()
+
+        submission = Submission.objects.get(pk=self.sub.pk)
+        self.assertTrue(submission.sent)
+        self.assertFalse(submission.sending)
+        self.assertFalse(submission.chunks.filter(sent=False).exists())
+
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(len({m.to[0] for m in mail.outbox}), 3)
+
+    def test_chunk_stopped(self):
+        """ Claims on chunks which were partly sent are released. """
+        Submission.submit_queue(self.stop_after_message())
+
+        self.assertEqual(len(mail.outbox), 1)
+
+        chunk = self.sub.chunks.get(number=0)
+        self.assertFalse(chunk.sent)
+        self.assertIsNone(chunk.claimed_by)
+
+        Submission.submit_queue()
+
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertTrue(Submission.objects.get(pk=self.sub.pk).sent)
+
+    def test_chunk_claimed_elsewhere(self):
+        """ Chunks claimed by another worker are left alone. """
+        self.sub.create_chunks()
+        self.sub.claim_chunk('other-worker')
+
+        Submission.submit_queue()
+
+        self.assertEqual(len(mail.outbox), 1)
+
+        submission = Submission.objects.get(pk=self.sub.pk)
+        self.assertFalse(submission.sent)
+        self.assertTrue(submission.sending)
+
+    def backdate_chunk_claim(self, **kwargs):
+        """
+        Patch sending the first message to backdate the claim on its chunk
+        by 20 seconds, updating the chunk with kwargs.
+        """
+        send_message = Submission.send_message
+
+        def backdate(submission, *args, **kwargs_):
+            chunk = submission._chunk
+            if chunk.number == 0 and not mail.outbox:
+                chunk.claimed_at -= timedelta(seconds=20)
+                SubmissionChunk.objects.filter(pk=chunk.pk).update(
+                    claimed_at=chunk.claimed_at, **kwargs
+                )
+            return send_message(submission, *args, **kwargs_)
+
+        return mock.patch.object(
+            Submission, 'send_message', autospec=True, side_effect=backdate
+        )
+
+    @override_settings(NEWSLETTER_CHUNK_LEASE=30)
+    def test_chunk_heartbeat(self):
+        """ Claims on chunks are renewed while sending. """
+        with self.backdate_chunk_claim():
+            Submission.submit_queue()
+
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertGreater(
+            self.sub.chunks.get(number=0).claimed_at,
+            now() - timedelta(seconds=10)
+        )
+
+    @override_settings(NEWSLETTER_CHUNK_LEASE=30)
+    def test_chunk_taken_over(self):
+        """ Workers stop sending chunks taken over by other workers. """
+        with self.backdate_chunk_claim(claimed_by='other-worker'):
+            Submission.submit_queue()
+
+        # The rest of the chunk is left to the other worker
+        self.assertEqual(len(mail.outbox), 2)
+
+        chunk = self.sub.chunks.get(number=0)
+        self.assertFalse(chunk.sent)
+        self.assertEqual(chunk.claimed_by, 'other-worker')
+        self.assertTrue(self.sub.chunks.get(number=1).sent)
+        self.assertFalse(Submission.objects.get(pk=self.sub.pk).sent)
+
+    def make_other_submission(self, count, **kwargs):
+        """ Prepare a submission for another newsletter. """
+        newsletter = Newsletter.objects.create(
+            title='Other newsletter', slug='other-newsletter',
+            sender='Other sender', email='other@test.com', **kwargs
+        )
+        newsletter.site.set(self.get_newsletter_sites())
+
+        for number in range(count):
+            Subscription.objects.create(
+                email='other%d@other.com' % number,
+                newsletter=newsletter, subscribed=True
+            )
+
+        message = Message.objects.create(
+            title='Other message', newsletter=newsletter, slug='other-message'
+        )
+        submission = Submission.from_message(message, site=self.get_site())
+        submission.prepared = True
+        submission.publish_date = now() - timedelta(seconds=1)
+        submission.save()
+
+        return submission
+
+    def get_sent_domains(self):
+        return [parseaddr(m.to[0])[1].split('@')[1] for m in mail.outbox]
+
+    def get_sent_chunks(self):
+        """ Return the domains of sent messages, one per chunk. """
+        domains = self.get_sent_domains()
+        return [domain for number, domain in enumerate(domains)
+                if number == 0 or domains[number - 1] != domain]
+
+    def test_interleaved(self):
+        """ Submissions take turns in sending chunks. """
+        other = self.make_other_submission(4)
+
+        Submission.submit_queue()
+
+        self.assertEqual(
+            self.get_sent_chunks(),
+            ['test.com', 'other.com', 'test.com', 'other.com']
+        )
+        self.assertTrue(Submission.objects.get(pk=self.sub.pk).sent)
+        self.assertTrue(Submission.objects.get(pk=other.pk).sent)
+
+    def test_interleaved_weight(self):
+        """ Newsletters with more weight get more turns. """
+        self.make_other_submission(5, weight=3)
+
+        Submission.submit_queue()
+
+        self.assertEqual(
+            self.get_sent_chunks(),
+            ['other.com', 'test.com', 'other.com', 'test.com']
+        )
+        self.assertEqual(
+            self.get_sent_domains()[4:], ['other.com'] * 3 + ['test.com']
+        )
+
+    def test_max_concurrent_chunks(self):
+        self.n.max_concurrent_chunks = 1
+        self.n.save()
+        self.sub.create_chunks()
+
+        first = self.sub.claim_chunk('worker-1')
+        self.assertIsNone(self.sub.claim_chunk('worker-2'))
+
+        SubmissionChunk.objects.filter(pk=first.pk).update(sent=True)
+        self.assertEqual(self.sub.claim_chunk('worker-2').number, 1)
+
+
+@override_settings(NEWSLETTER_QUEUE_ACTIVATION_EMAILS=True)
+class ActivationEmailTestCase(MailingTestCase):
+    """ Activation emails queued for sending by submit_newsletter. """
+
+    def test_send_queue(self):
+        self.s.queue_activation_email('unsubscribe')
+        self.s2.queue_activation_email('update')
+
+        self.assertEqual(ActivationEmail.send_queue(), 2)
+
+        self.assertEqual(
+            [m.to for m in mail.outbox], [[self.s.email], [self.s2.email]]
+        )
+        self.assertIn(self.s.unsubscribe_activate_url(), mail.outbox[0].body)
+        self.assertFalse(ActivationEmail.objects.exists())
+
+    def test_send_queue_failed(self):
+        email = self.s.queue_activation_email('subscribe')
+
+        with mock.patch.object(
+            Subscription, 'send_activation_email',
+            side_effect=socket.error('Connection refused')
+        ):
+            self.assertEqual(ActivationEmail.send_queue(), 0)
+
+        email.refresh_from_db()
+        self.assertEqual(email.attempts, 1)
+        self.assertEqual(email.error, 'Connection refused')
+
+        ActivationEmail.objects.update(attempts=ActivationEmail.MAX_ATTEMPTS)
+        self.assertEqual(ActivationEmail.send_queue(), 0)
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_send_queue_error(self):
+        """ Any error is recorded, without blocking later emails. """
+        email = self.s.queue_activation_email('subscribe')
+        self.s2.queue_activation_email('update')
+
+        send_activation_email = Subscription.send_activation_email
+
+        def side_effect(subscription, *args, **kwargs):
+            if subscription.pk == self.s.pk:
+                raise TemplateDoesNotExist('message.txt')
+            return send_activation_email(subscription, *args, **kwargs)
+
+        with mock.patch.object(
+            Subscription, 'send_activation_email', autospec=True,
+            side_effect=side_effect
+        ), self.assertLogs('newsletter.models', 'ERROR'):
+            self.assertEqual(ActivationEmail.send_queue(), 1)
+
+        email.refresh_from_db()
+        self.assertEqual(email.attempts, 1)
+        self.assertEqual(email.error, 'message.txt')
+        self.assertEqual([m.to for m in mail.outbox], [[self.s2.email]])
+
+    @override_settings(NEWSLETTER_QUEUE_ACTIVATION_EMAILS=True)
+    @mock.patch.object(Submission, 'ACTIVATION_EMAIL_INTERVAL', 0)
+    def test_queue_failed_sending(self):
+        """ Submissions are sent even when the activation queue fails. """
+        sub = Submission.from_message(self.m)
+        sub.prepared = True
+        sub.publish_date = now() - timedelta(seconds=1)
+        sub.save()
+
+        with mock.patch.object(
+            ActivationEmail, 'send_queue', side_effect=ValueError('broken')
+        ) as send_queue, self.assertLogs('newsletter.models', 'ERROR'):
+            Submission.submit_queue()
+
+        self.assertGreater(send_queue.call_count, 1)
+        self.assertEqual(len(mail.outbox), NUM_SUBSCRIBED)
+        self.assertTrue(Submission.objects.get(pk=sub.pk).sent)
+
+    @mock.patch.object(Submission, 'ACTIVATION_EMAIL_INTERVAL', 0)
+    def test_priority(self):
+        """ Activation emails queued while sending are sent first. """
+        sub = Submission.from_message(self.m)
+        sub.prepared = True
+        sub.publish_date = now() - timedelta(seconds=1)
+        sub.save()
+
+        send_message = Submission.send_message
+
+        def side_effect(submission, *args, **kwargs):
+            if not mail.outbox:
+                self.s.queue_activation_email('unsubscribe')
+            return send_message(submission, *args, **kwargs)
+
+        with mock.patch.object(
+            Submission, 'send_message', autospec=True, side_effect=side_effect
+        ):
+            Submission.submit_queue()
+
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertIn(self.s.unsubscribe_activate_url(), mail.outbox[1].body)
+
+
+@override_settings(NEWSLETTER_SUBSCRIPTION_FETCH_SIZE=1)
+class SubscriptionJobTestCase(MailingTestCase):
+    """ Bulk (un)subscriptions run in the background. """
+
+    def test_run_queue(self):
+        job = SubscriptionJob.create(Subscription.objects.all(), 'unsubscribe')
+        self.assertEqual(job.total, 2)
+
+        self.assertEqual(SubscriptionJob.run_queue(), 1)
+        self.assertEqual(SubscriptionJob.run_queue(), 0)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, SubscriptionJob.DONE)
+        self.assertEqual(job.processed, 2)
+        self.assertFalse(Subscription.objects.filter(subscribed=True).exists())
+
+    def test_resume(self):
+        """ Jobs of stopped workers are resumed where they were left. """
+        job = SubscriptionJob.create(Subscription.objects.all(), 'unsubscribe')
+        SubscriptionJob.objects.filter(pk=job.pk).update(
+            status=SubscriptionJob.RUNNING, processed=1
+        )
+        self.assertEqual(SubscriptionJob.run_queue(), 0)
+
+        SubscriptionJob.objects.filter(pk=job.pk).update(
+            updated=now() - timedelta(days=1)
+        )
+        self.assertEqual(SubscriptionJob.run_queue(), 1)
+
+        self.assertTrue(Subscription.objects.get(pk=self.s.pk).subscribed)
+        self.assertFalse(Subscription.objects.get(pk=self.s2.pk).subscribed)
+
+    def test_failed(self):
+        job = SubscriptionJob.create(Subscription.objects.all(), 'subscribe')
+
+        with mock.patch.object(
+            Subscription, 'update_queryset', side_effect=ValueError('Broken')
+        ):
+            SubscriptionJob.run_queue()
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, SubscriptionJob.FAILED)
+        self.assertEqual(job.error, 'Broken')
+
+    def test_command(self):
+        """ Jobs are run by submit_newsletter --jobs only. """
+        job = SubscriptionJob.create(Subscription.objects.all(), 'unsubscribe')
+
+        call_command('submit_newsletter')
+        job.refresh_from_db()
+        self.assertEqual(job.status, SubscriptionJob.PENDING)
+
+        call_command('submit_newsletter', jobs=True)
+        job.refresh_from_db()
+        self.assertEqual(job.status, SubscriptionJob.DONE)
+
+        with self.assertRaises(CommandError):
+            call_command('submit_newsletter', jobs=True, time_limit=900)
+
+
+class SubscriptionTestCase(UserTestCase, MailingTestCase):
+    def setUp(self):
+        super().setUp()
+
+        self.us = Subscription(user=self.user, newsletter=self.n)
+        self.us.save()
+
+        self.ns = Subscription(
+            name='Test susbcriber', newsletter=self.n,
+            email='test@test.com'
+        )
+        self.ns.save()
+
+        self.ss = [self.us, self.ns]
+
+    def test_user_subscription(self):
+        self.assertEqual(self.us.name, self.user.get_full_name())
+        self.assertEqual(self.us.email, self.user.email)
+
+    def test_subscribe_unsubscribe(self):
+        for s in self.ss:
+            self.assertFalse(s.subscribed)
+            self.assertFalse(s.unsubscribed)
+            self.assertFalse(s.subscribe_date)
+            self.assertFalse(s.unsubscribe_date)
+
+            # Repeat this to ensure consequencentness
+            for x in range(2):
+                s.subscribed = True
+                s.save()
+
+                self.assertTrue(s.subscribed)
+                self.assertTrue(s.subscribe_date)
+                self.assertFalse(s.unsubscribed)
+                old_subscribe_date = s.subscribe_date
+
+                s.unsubscribed = True
+                s.save()
+
+                self.assertFalse(s.subscribed)
+                self.assertTrue(s.unsubscribed)
+                self.assertTrue(s.unsubscribe_date)
+
+                s.unsubscribed = False
+                s.save()
+
+                self.assertFalse(s.unsubscribed)
+                self.assertTrue(s.subscribed)
+                self.assertNotEqual(s.subscribe_date, old_subscribe_date)
+
+    def test_update_queryset(self):
+        self.ns.subscribed = True
+        self.ns.save()
+        subscribe_date = self.ns.subscribe_date
+
+        queryset = Subscription.objects.filter(pk__in=[self.us.pk, self.ns.pk])
+        self.assertEqual(Subscription.update_queryset(queryset, 'subscribe'), 1)
+
+        self.us.refresh_from_db()
+        self.ns.refresh_from_db()
+        self.assertTrue(self.us.subscribed)
+        self.assertTrue(self.us.subscribe_date)
+        self.assertEqual(self.ns.subscribe_date, subscribe_date)
+
+        self.assertEqual(Subscription.update_queryset(queryset, 'unsubscribe'), 2)
+        self.assertEqual(Subscription.update_queryset(queryset, 'unsubscribe'), 0)
+
+        for s in self.ss:
+            s.refresh_from_db()
+            self.assertFalse(s.subscribed)
+            self.assertTrue(s.unsubscribed)
+            self.assertTrue(s.unsubscribe_date)
+
+        self.assertEqual(Subscription.update_queryset(queryset, 'update'), 2)
+        self.assertFalse(queryset.filter(unsubscribed=True).exists())
+
+    def test_save_queries(self):
+        """ Saving a loaded subscription doesn't read it again. """
+        for pk in (self.us.pk, self.ns.pk):
+            s = Subscription.objects.get(pk=pk)
+            s.subscribed = True
+
+            with self.assertNumQueries(1):
+                s.save()
+            self.assertTrue(s.subscribe_date)
+
+            s.unsubscribed = True
+            with self.assertNumQueries(1):
+                s.save()
+            self.assertFalse(s.subscribed)
+            self.assertTrue(s.unsubscribe_date)
+
+    def test_save_unloaded(self):
+        """ The stored state is read for subscriptions not loaded. """
+        Subscription.objects.filter(pk=self.ns.pk).update(subscribed=True)
+
+        s = Subscription(
+            pk=self.ns.pk, newsletter=self.n, email='test@test.com',
+            subscribed=False
+        )
+        s.save()
+        self.assertTrue(s.unsubscribed)
+        self.assertTrue(s.unsubscribe_date)
+
+        s = Subscription.objects.only('pk', 'email_field', 'newsletter').get(
+            pk=self.ns.pk
+        )
+        s.subscribed = True
+        s.save()
+        self.assertFalse(s.unsubscribed)
+        self.assertTrue(s.subscribe_date)
+
+    def test_save_refreshed(self):
+        Subscription.objects.filter(pk=self.ns.pk).update(subscribed=True)
+        self.ns.refresh_from_db()
+
+        self.ns.subscribed = False
+        self.ns.save()
+        self.assertTrue(self.ns.unsubscribed)
 
 
 class AllEmailsTestsMixin:
@@ -590,6 +590,37 @@ class AnonymousSubscribeTestCase(
 
         self.assertEmailContains(full_activate_url)
 
+    @override_settings(
+        NEWSLETTER_CONFIRM_EMAIL_SUBSCRIBE=True,
+        NEWSLETTER_QUEUE_ACTIVATION_EMAILS=True
+    )
+    def test_subscribe_request_post_queued(self):
+        """ Activation emails are sent by submit_newsletter when queued. """
+
+        response = self.client.post(
+            self.subscribe_url, {
+                'name_field': self.testname,
+                'email_field': self.testemail
+            }
+        )
+
+        self.assertRedirects(response, self.subscribe_email_sent_url)
+        self.assertEqual(len(mail.outbox), 0)
+
+        subscription = self.get_only_subscription(
+            email_field__exact=self.testemail
+        )
+        self.assertEqual(
+            list(subscription.activation_emails.values_list('action', flat=True)),
+            ['subscribe']
+        )
+
+        Submission.submit_queue()
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEmailContains(subscription.subscribe_activate_url())
+        self.assertFalse(subscription.activation_emails.exists())
+
     @override_settings(NEWSLETTER_CONFIRM_EMAIL_SUBSCRIBE=True)
     def test_subscribe_request_post_emptyemail(self):
         """ Post the subscription form without email shoud fail. """
@@ -1,11 +1,14 @@
+import asyncio
 import logging
 import smtplib
+import threading
 
 from django.contrib.auth import get_user_model
 from django.contrib.sites.models import Site
 
 from django.core import mail
 from django.core.mail.backends.base import BaseEmailBackend
+from django.core.mail.backends.locmem import EmailBackend as LocmemEmailBackend
 
 from django.test import TestCase
 
@@ -156,3 +159,83 @@ class FailingEmailBackend(BaseEmailBackend):
 
     def send_messages(self, email_messages):
         raise smtplib.SMTPException('Connection refused')
+
+
+class CountingEmailBackend(LocmemEmailBackend):
+    """ Locmem email backend keeping track of opened connections. """
+
+    opened = 0
+
+    def open(self):
+        CountingEmailBackend.opened += 1
+        return super().open()
+
+
+class DisconnectingEmailBackend(CountingEmailBackend):
+    """ Email backend dropping the connection on its first message. """
+
+    def send_messages(self, email_messages):
+        if CountingEmailBackend.opened == 1:
+            raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+        return super().send_messages(email_messages)
+
+
+class SMTPSink:
+    """
+    Minimal asyncio SMTP server running in a separate thread, collecting
+    received messages for testing purposes.
+    """
+
+    def __init__(self):
+        self.messages = []
+        self.connections = 0
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        writer.write(b'220 localhost SMTP sink\r\n')
+
+        data = None
+        while line := await reader.readline():
+            if data is not None:
+                if line == b'.\r\n':
+                    self.messages.append(b''.join(data))
+                    data = None
+                    writer.write(b'250 OK\r\n')
+                else:
+                    data.append(line)
+                    continue
+            else:
+                command = line[:4].upper()
+                if command in (b'EHLO', b'HELO'):
+                    writer.write(b'250 localhost\r\n')
+                elif command == b'DATA':
+                    data = []
+                    writer.write(b'354 End data with <CR><LF>.<CR><LF>\r\n')
+                elif command == b'QUIT':
+                    writer.write(b'221 Bye\r\n')
+                    await writer.drain()
+                    break
+                else:
+                    writer.write(b'250 OK\r\n')
+
+            await writer.drain()
+
+        writer.close()
+
+    def start(self):
+        self.loop = asyncio.new_event_loop()
+        self.server = self.loop.run_until_complete(
+            asyncio.start_server(self.handle, '127.0.0.1', 0)
+        )
+        self.port = self.server.sockets[0].getsockname()[1]
+
+        self.thread = threading.Thread(
+            target=self.loop.run_forever, daemon=True
+        )
+        self.thread.start()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.server.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()